@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import os
+import time
+from urllib.parse import urlsplit
+
+import metrics
+from cache import TTLCache
+from logs import get_logger
+
+logger = get_logger("avatars")
+
+# --- Sincronização de avatar em segundo plano ---
+# A foto de perfil nunca é buscada no caminho da mensagem: o webhook só agenda o contato
+# e um worker em segundo plano consulta a WuzAPI e atualiza o Chatwoot em lotes.
+# Com o índice local de IDs, a última conferência de cada contato sobrevive a reinícios.
+
+AVATAR_REFRESH_INTERVAL = float(os.getenv("AVATAR_REFRESH_INTERVAL", "86400"))
+AVATAR_BATCH_SIZE = int(os.getenv("AVATAR_BATCH_SIZE", "10"))
+AVATAR_BATCH_WAIT = 0.5
+
+
+def avatar_identity(picture: dict) -> str:
+    """Identidade estável da foto: o ID da foto no WhatsApp ou, na falta dele, um hash da URL
+    sem a query string (as URLs do WhatsApp trazem assinaturas que mudam a cada consulta)."""
+    if picture.get("id"):
+        return str(picture["id"])
+    parts = urlsplit(picture["url"])
+    return hashlib.sha1(f"{parts.netloc}{parts.path}".encode()).hexdigest()
+
+
+class AvatarRefresher:
+    """Fila de contatos cujo avatar deve ser conferido, com janela de validade por contato."""
+
+    def __init__(self, chatwoot, wuzapi, refresh_interval: float = AVATAR_REFRESH_INTERVAL,
+                 batch_size: int = AVATAR_BATCH_SIZE, maxsize: int = 10000, ids=None):
+        self.chatwoot = chatwoot
+        self.wuzapi = wuzapi
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        # Índice local (idmap.TenantIdMap), opcional
+        self.ids = ids
+        # Contatos conferidos recentemente (expiram ao fim da janela de validade)
+        self._checked = TTLCache(maxsize=maxsize, ttl=refresh_interval)
+        # Última identidade de avatar enviada ao Chatwoot por contato
+        self._avatar_ids = TTLCache(maxsize=maxsize, ttl=refresh_interval * 7)
+        self._pending: set[int] = set()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, contact_id: int, sender_raw: str):
+        """Agenda a conferência do avatar do contato, sem bloquear. Ignora contatos ainda válidos."""
+        fresh = contact_id in self._pending or contact_id in self._checked
+        metrics.cache_lookup("avatar", fresh)
+        if fresh:
+            return
+        try:
+            self._queue.put_nowait((contact_id, sender_raw))
+            self._pending.add(contact_id)
+        except asyncio.QueueFull:
+            logger.warning("Fila de avatares cheia. Contato %s será conferido depois.", contact_id)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Agrupa o que chegar na janela curta para processar em lote
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + AVATAR_BATCH_WAIT
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            with metrics.STAGE_LATENCY.labels("avatar_batch").time():
+                await asyncio.gather(*(self._refresh(contact_id, sender_raw) for contact_id, sender_raw in batch))
+
+    async def _refresh(self, contact_id: int, sender_raw: str):
+        """Confere o avatar do contato. Só uma consulta bem-sucedida conta como conferência: se a WuzAPI
+        ou o Chatwoot falharem, o contato volta a ser conferido na próxima mensagem."""
+        try:
+            if await self._sync(contact_id, sender_raw):
+                self._checked.set(contact_id, True)
+        except Exception as e:
+            logger.error("Erro ao sincronizar avatar do contato %s: %s", contact_id, e)
+        finally:
+            self._pending.discard(contact_id)
+
+    async def _sync(self, contact_id: int, sender_raw: str) -> bool:
+        """Retorna True se o avatar foi conferido (e atualizado, quando mudou)."""
+        known = self._avatar_ids.get(contact_id)
+        if known is None and self.ids is not None:
+            stored = await self.ids.avatar(contact_id)
+            if stored is not None:
+                known = stored["avatar_id"]
+                if known is not None:
+                    self._avatar_ids.set(contact_id, known)
+                # Conferido antes do reinício, dentro da janela de validade
+                if time.time() - stored["checked_at"] < self.refresh_interval:
+                    return True
+        picture = await self.wuzapi.get_profile_pic(sender_raw)
+        if not picture:
+            if self.ids is not None:
+                self.ids.set_avatar(contact_id, known)
+            return True
+        identity = avatar_identity(picture)
+        if known == identity:
+            if self.ids is not None:
+                self.ids.set_avatar(contact_id, identity)
+            return True
+        logger.info("Contato %s: Avatar desatualizado. Atualizando...", contact_id)
+        if not await self.chatwoot.update_contact_avatar(contact_id, picture["url"]):
+            return False
+        self._avatar_ids.set(contact_id, identity)
+        if self.ids is not None:
+            self.ids.set_avatar(contact_id, identity)
+        return True
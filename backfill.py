@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import zlib
+
+import events
+import main as bridge
+from breaker import CircuitOpenError
+from events import WuzAPIEvent
+from logs import get_logger
+
+logger = get_logger("backfill")
+
+# --- Importação de histórico (backfill) ---
+# Lê um arquivo JSONL com um evento de mensagem da WuzAPI por linha (o mesmo formato dos webhooks)
+# e o envia ao Chatwoot pela mesma resolução de contato/conversa da ponte, com concorrência limitada.
+# As linhas de um mesmo chat vão sempre para a mesma fila, preservando a ordem das mensagens.
+# O progresso é gravado em um checkpoint: uma execução interrompida continua de onde parou.
+# As linhas concluídas depois do último checkpoint são lidas de novo na retomada; o ID de cada
+# mensagem passa pelo índice de deduplicação da ponte, e as já importadas (ou recebidas pelo
+# webhook dentro de DEDUP_WINDOW) não são enviadas outra vez.
+#
+#   python backfill.py historico.jsonl [--tenant ID] [--concurrency 16]
+
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "8"))
+BACKFILL_MAX_ATTEMPTS = 5
+BACKFILL_QUEUE_SIZE = 100
+BACKFILL_CHECKPOINT_INTERVAL = 5.0
+BACKFILL_REPORT_INTERVAL = 10.0
+
+
+class Checkpoint:
+    """Posição do arquivo até a qual todas as linhas foram tratadas, as linhas já concluídas depois
+    dela (a importação é concorrente) e os totais acumulados entre execuções."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.done_after: set[int] = set()
+        self.stats = {"imported": 0, "ignored": 0, "failed": 0}
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        self.offset = data["offset"]
+        self.done_after = set(data.get("done_after", []))
+        self.stats.update(data.get("stats", {}))
+
+    def save(self, offset: int):
+        self.offset = offset
+        self.done_after = {done for done in self.done_after if done >= offset}
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"offset": offset, "done_after": sorted(self.done_after), "stats": self.stats}, f)
+        os.replace(temporary, self.path)
+
+
+class Backfill:
+    def __init__(self, tenant, path: str, concurrency: int = BACKFILL_CONCURRENCY, checkpoint_path: str | None = None):
+        self.tenant = tenant
+        self.path = path
+        self.concurrency = concurrency
+        self.checkpoint = Checkpoint(checkpoint_path or f"{path}.checkpoint")
+        self.failed_path = f"{path}.failed.jsonl"
+        self._in_flight: set[int] = set()
+        self._read_offset = 0
+        self._processed = 0
+        self._started = 0.0
+
+    async def run(self):
+        self.checkpoint.load()
+        if self.checkpoint.offset:
+            logger.info("Retomando importação de %s a partir do byte %s.", self.path, self.checkpoint.offset)
+        self._started = time.monotonic()
+        lanes = [asyncio.Queue(maxsize=BACKFILL_QUEUE_SIZE) for _ in range(self.concurrency)]
+        workers = [asyncio.create_task(self._worker(lane)) for lane in lanes]
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.checkpoint.offset)
+                while True:
+                    offset = f.tell()
+                    line = f.readline()
+                    if not line:
+                        break
+                    self._read_offset = f.tell()
+                    if offset in self.checkpoint.done_after or not line.strip():
+                        continue
+                    if not events.wuzapi_prefilter(line):
+                        self.checkpoint.stats["ignored"] += 1
+                        self._complete(offset)
+                        continue
+                    try:
+                        event = WuzAPIEvent(events.loads(line))
+                    except (ValueError, AttributeError) as e:
+                        self._fail(offset, line.decode("utf-8", "replace"), f"JSON inválido: {e}")
+                        continue
+                    # Pelo chat, não pelo remetente: as mensagens enviadas pelo próprio número têm o
+                    # nosso JID como remetente
+                    lane = zlib.crc32((event.chat or "").encode()) % self.concurrency
+                    self._in_flight.add(offset)
+                    await lanes[lane].put((offset, event))
+            for lane in lanes:
+                await lane.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(reporter, *workers, return_exceptions=True)
+            self._save()
+        self._report(final=True)
+
+    async def _worker(self, lane: asyncio.Queue):
+        while True:
+            item = await lane.get()
+            if item is None:
+                return
+            offset, event = item
+            message_id = bridge.tenant_key(self.tenant, bridge.wuzapi_message_id(event))
+            if message_id and await bridge.dedup_index.contains(message_id):
+                logger.debug("Mensagem %s já importada ou recebida pelo webhook.", message_id)
+                self.checkpoint.stats["ignored"] += 1
+                self._complete(offset)
+                continue
+            try:
+                result = await self._import(event)
+            except Exception as e:
+                self._fail(offset, json.dumps(event.data), str(e))
+            else:
+                # Registrada só depois de importada: uma interrupção no meio não a faz ser pulada na retomada
+                if message_id:
+                    await bridge.dedup_index.seen(message_id)
+                key = "imported" if result.get("status") == "success" else "ignored"
+                self.checkpoint.stats[key] += 1
+                self._complete(offset)
+
+    async def _import(self, event: WuzAPIEvent) -> dict:
+        """Importa uma mensagem, repetindo falhas temporárias com backoff exponencial."""
+        attempt = 1
+        while True:
+            try:
+                return await bridge.forward_wuzapi_message(self.tenant, event, backfill=True)
+            except CircuitOpenError as e:
+                # Upstream fora do ar: espera o circuito e tenta de novo, sem gastar tentativa
+                await asyncio.sleep(e.retry_after)
+            except Exception:
+                if attempt == BACKFILL_MAX_ATTEMPTS:
+                    raise
+                await asyncio.sleep(min(2 ** attempt, 60))
+                attempt += 1
+
+    def _complete(self, offset: int):
+        self._in_flight.discard(offset)
+        self.checkpoint.done_after.add(offset)
+        self._processed += 1
+
+    def _fail(self, offset: int, line: str, error: str):
+        """Registra a linha em <arquivo>.failed.jsonl (para reimportar depois) e segue em frente."""
+        logger.warning("Falha ao importar a linha do byte %s: %s", offset, error)
+        with open(self.failed_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"offset": offset, "error": error, "line": line.rstrip("\n")}) + "\n")
+        self.checkpoint.stats["failed"] += 1
+        self._complete(offset)
+
+    def _save(self):
+        # Tudo antes da linha pendente mais antiga já foi tratado
+        self.checkpoint.save(min(self._in_flight, default=self._read_offset))
+
+    async def _report_loop(self):
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(BACKFILL_CHECKPOINT_INTERVAL)
+            self._save()
+            if time.monotonic() - last_report >= BACKFILL_REPORT_INTERVAL:
+                last_report = time.monotonic()
+                self._report()
+
+    def _report(self, final: bool = False):
+        elapsed = time.monotonic() - self._started
+        rate = self._processed / elapsed if elapsed > 0 else 0.0
+        size = os.path.getsize(self.path)
+        progress = 100.0 * self._read_offset / size if size else 100.0
+        stats = self.checkpoint.stats
+        logger.info(
+            "Importação %s: %.1f%% do arquivo, %s importadas, %s ignoradas, %s falhas, %.1f msg/s.",
+            "concluída" if final else "em andamento", progress, stats["imported"], stats["ignored"],
+            stats["failed"], rate,
+            extra={"tenant": self.tenant.id, "progress_percent": round(progress, 2), "messages_per_second": round(rate, 2),
+                   "in_flight": len(self._in_flight), **stats},
+        )
+
+
+async def run(path: str, tenant_id: str | None, concurrency: int, checkpoint_path: str | None):
+    bridge.id_map.open()
+    bridge.id_map.start()
+    bridge.dedup_index.open()
+    bridge.tenants.load()
+    bridge.tenants.start()
+    try:
+        tenant = bridge.tenants.get(tenant_id)
+        if tenant is None:
+            raise SystemExit(f"Tenant '{tenant_id}' não encontrado.")
+        await Backfill(tenant, path, concurrency, checkpoint_path).run()
+    finally:
+        await bridge.tenants.stop()
+        await bridge.id_map.stop()
+        bridge.id_map.close()
+        bridge.dedup_index.close()
+        await bridge.media_client.aclose()
+        await bridge.state.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa para o Chatwoot o histórico de conversas do WhatsApp.")
+    parser.add_argument("arquivo", help="JSONL com um evento de mensagem da WuzAPI por linha (formato do webhook)")
+    parser.add_argument("--tenant", help="ID do tenant (obrigatório com mais de um tenant configurado)")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY,
+                        help=f"Mensagens importadas em paralelo (padrão {BACKFILL_CONCURRENCY})")
+    parser.add_argument("--checkpoint", help="Arquivo de checkpoint (padrão <arquivo>.checkpoint)")
+    args = parser.parse_args()
+    asyncio.run(run(args.arquivo, args.tenant, args.concurrency, args.checkpoint))
@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import random
+import re
+import time
+from collections import Counter
+from typing import Callable
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+# --- Servidores falsos do Chatwoot e da WuzAPI para o benchmark ---
+# Respondem às mesmas rotas usadas pelos clientes da ponte, com latência e erros injetados.
+# Cada chamada é contada por endpoint (mesmos nomes das métricas UPSTREAM_REQUESTS) e as
+# mensagens entregues são reconhecidas pelo marcador "bench-<n>" no conteúdo.
+
+MARKER = re.compile(rb"bench-(\d+)")
+
+
+class Recorder:
+    """Chamadas recebidas por (upstream, endpoint) e instante de entrega de cada marcador."""
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self.delivered: dict[int, float] = {}
+
+    def hit(self, upstream: str, endpoint: str):
+        self.calls[(upstream, endpoint)] += 1
+
+    def deliver(self, body: bytes):
+        now = time.perf_counter()
+        for marker in MARKER.findall(body):
+            self.delivered.setdefault(int(marker), now)
+
+
+class Faults:
+    """Latência (segundos, mais um jitter uniforme) e fração de respostas 500 de um upstream."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    async def apply(self) -> Response | None:
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return JSONResponse({"error": "erro injetado pelo benchmark"}, status_code=500)
+        return None
+
+
+def router(app: FastAPI, upstream: str, recorder: Recorder, faults: Faults):
+    """Decorador de rotas que conta a chamada e aplica as falhas antes do handler. O endpoint pode
+    ser uma função da requisição (mensagens e anexos do Chatwoot usam a mesma rota)."""
+    def route(endpoint: str | Callable[[Request], str], method: str, path: str):
+        def decorator(handler):
+            async def wrapper(request: Request):
+                recorder.hit(upstream, endpoint(request) if callable(endpoint) else endpoint)
+                failure = await faults.apply()
+                return failure or await handler(request)
+            app.add_api_route(path, wrapper, methods=[method])
+            return handler
+        return decorator
+    return route
+
+
+def sample_media(size: int) -> bytes:
+    """Arquivo de `size` bytes com cabeçalho JPEG, servido como mídia baixada."""
+    return b"\xff\xd8\xff\xe0" + bytes(max(size - 4, 0))
+
+
+def chatwoot_app(recorder: Recorder, faults: Faults, media_size: int = 64 * 1024) -> FastAPI:
+    """API do Chatwoot (uma conta): contatos, conversas e mensagens em memória, mais /files/<nome>
+    para os anexos das respostas dos agentes."""
+    app = FastAPI()
+    contacts: list[dict] = []
+    conversations: dict[int, dict] = {}
+    file_body = sample_media(media_size)
+
+    route = router(app, "chatwoot", recorder, faults)
+    prefix = "/api/v1/accounts/{account_id}"
+
+    # Sondagem de prontidão da ponte (fora das falhas injetadas e da contagem de chamadas)
+    @app.get(prefix + "/inboxes/{inbox_id}")
+    async def get_inbox(inbox_id: int):
+        return {"id": inbox_id}
+
+    @route("search_contact", "GET", prefix + "/contacts/search")
+    async def search_contact(request: Request):
+        query = request.query_params.get("q", "")
+        found = [contact for contact in contacts
+                 if query in (contact["phone_number"] or "") or query == contact["identifier"]]
+        return {"meta": {"count": len(found)}, "payload": found}
+
+    @route("create_contact", "POST", prefix + "/contacts")
+    async def create_contact(request: Request):
+        data = await request.json()
+        contact = {"id": len(contacts) + 1, "name": data.get("name"), "phone_number": data.get("phone_number"),
+                   "identifier": data.get("identifier")}
+        contacts.append(contact)
+        return {"payload": {"contact": contact}}
+
+    @route("update_contact", "PUT", prefix + "/contacts/{contact_id}")
+    async def update_contact(request: Request):
+        return {"id": int(request.path_params["contact_id"])}
+
+    @route("list_conversations", "GET", prefix + "/contacts/{contact_id}/conversations")
+    async def list_conversations(request: Request):
+        contact_id = int(request.path_params["contact_id"])
+        return {"payload": [c for c in conversations.values() if c["contact_id"] == contact_id]}
+
+    @route("create_conversation", "POST", prefix + "/conversations")
+    async def create_conversation(request: Request):
+        data = await request.json()
+        conversation = {"id": len(conversations) + 1, "contact_id": data.get("contact_id")}
+        conversations[conversation["id"]] = conversation
+        return conversation
+
+    @route("get_conversation", "GET", prefix + "/conversations/{conversation_id}")
+    async def get_conversation(request: Request):
+        conversation = conversations.get(int(request.path_params["conversation_id"])) or {}
+        contact = next((c for c in contacts if c["id"] == conversation.get("contact_id")), {})
+        return {"id": conversation.get("id"), "meta": {"sender": contact}}
+
+    def message_endpoint(request: Request) -> str:
+        multipart = request.headers.get("content-type", "").startswith("multipart/")
+        return "upload_attachment" if multipart else "send_message"
+
+    @route(message_endpoint, "POST", prefix + "/conversations/{conversation_id}/messages")
+    async def send_message(request: Request):
+        body = await request.body()
+        recorder.deliver(body)
+        return {"id": sum(recorder.calls.values())}
+
+    @route("update_message", "PATCH", prefix + "/conversations/{conversation_id}/messages/{message_id}")
+    async def update_message(request: Request):
+        return {"id": int(request.path_params["message_id"]), **(await request.json())}
+
+    @app.get("/files/{name}")
+    async def download_file(name: str):
+        recorder.hit("media", "download")
+        failure = await faults.apply()
+        return failure or Response(file_body, media_type="image/jpeg")
+
+    return app
+
+
+def wuzapi_app(recorder: Recorder, faults: Faults, media_size: int = 64 * 1024) -> FastAPI:
+    """API da WuzAPI: envio de texto e mídia, download de mídia (data URL base64), metadados de grupos
+    e avatares."""
+    app = FastAPI()
+    data_url = "data:image/jpeg;base64," + base64.b64encode(sample_media(media_size)).decode("ascii")
+    route = router(app, "wuzapi", recorder, faults)
+
+    @app.get("/session/status")
+    async def session_status():
+        return {"code": 200, "success": True, "data": {"Connected": True, "LoggedIn": True}}
+
+    def sent(body: bytes) -> dict:
+        # O ID da mensagem no WhatsApp é o marcador, para os recibos do benchmark poderem citá-lo
+        marker = MARKER.search(body)
+        return {"code": 200, "success": True, "data": {"Id": f"bench-{marker.group(1).decode()}" if marker else "bench"}}
+
+    @route("send_text", "POST", "/chat/send/text")
+    async def send_text(request: Request):
+        body = await request.body()
+        recorder.deliver(body)
+        return sent(body)
+
+    @route("send_media", "POST", "/chat/send/{media_type}")
+    async def send_media(request: Request):
+        body = await request.body()
+        recorder.deliver(body)
+        return sent(body)
+
+    @route("download_media", "POST", "/chat/download{media_type}")
+    async def download_media(request: Request):
+        return {"code": 200, "success": True, "data": {"Mimetype": "image/jpeg", "Data": data_url}}
+
+    @route("group_info", "GET", "/group/info")
+    async def group_info(request: Request):
+        group_jid = request.query_params.get("groupJID", "")
+        return {"code": 200, "success": True, "data": {"JID": group_jid, "Name": "Grupo de clientes",
+                                                       "Participants": []}}
+
+    @route("user_avatar", "POST", "/user/avatar")
+    async def user_avatar(request: Request):
+        data = await request.json()
+        return {"results": {"url": f"https://pps.whatsapp.net/bench/{data.get('phone')}.jpg", "id": "1"}}
+
+    @route("legacy_profile_pic", "GET", "/chat/getProfilePic")
+    async def legacy_profile_pic(request: Request):
+        return {"profileImage": None}
+
+    return app
@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+from bench.mocks import Faults, Recorder, chatwoot_app, wuzapi_app
+
+# --- Benchmark da ponte com Chatwoot e WuzAPI falsos ---
+# Sobe os servidores falsos neste processo e a ponte (main:app) em um processo uvicorn separado,
+# envia webhooks gravados (bench/payloads.jsonl) a uma taxa fixa (carga em malha aberta: os envios
+# não esperam as respostas) e, ao final, mostra vazão, latências p50/p99 e chamadas aos upstreams
+# por mensagem. Rode a partir da raiz do repositório:
+#
+#   python -m bench.replay --rps 50 --duration 30 --chatwoot-latency 40 --error-rate 0.01
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_PAYLOADS = Path(__file__).resolve().parent / "payloads.jsonl"
+WEBHOOK_PATHS = {"wuzapi": "/webhook/wuzapi", "chatwoot": "/webhook/chatwoot"}
+# Atraso mínimo entre uma resposta de agente e um recibo que a cite
+RECEIPT_LAG = 1.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def load_templates(path: Path, kinds: set[str] | None = None) -> list[dict]:
+    """Webhooks gravados: {"kind", "target" (wuzapi|chatwoot), "weight", "payload"} por linha. No
+    payload, {{id}}, {{phone}}, {{marker}}, {{files}} e {{reply_id}} são trocados a cada envio."""
+    templates = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if kinds and row["kind"] not in kinds:
+                continue
+            row["template"] = json.dumps(row.pop("payload"), ensure_ascii=False)
+            templates.append(row)
+    if not templates:
+        raise SystemExit(f"Nenhum payload selecionado em {path}.")
+    return templates
+
+
+def render(template: str, run_id: str, sequence: int, phone: str, files_url: str,
+           reply: int | None = None) -> bytes:
+    """`reply` é a sequência de uma resposta de agente já enviada: {{reply_id}} vira o ID que a WuzAPI
+    falsa devolveu para ela (bench-<marcador>), para os recibos citarem uma mensagem enviada pela ponte."""
+    return (template.replace("{{id}}", f"{run_id}{sequence:08d}")
+            .replace("{{phone}}", phone)
+            .replace("{{marker}}", f"bench-{sequence}")
+            .replace("{{files}}", files_url)
+            .replace("{{reply_id}}", f"bench-{reply}" if reply is not None else f"{run_id}{sequence:08d}")
+            .encode("utf-8"))
+
+
+async def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+def start_bridge(port: int, chatwoot_url: str, wuzapi_url: str, data_dir: str, extra_env: list[str]) -> subprocess.Popen:
+    env = {key: value for key, value in os.environ.items() if key not in ("TENANTS_FILE", "STATE_BACKEND_URL")}
+    env.update({
+        "CHATWOOT_URL": chatwoot_url,
+        "CHATWOOT_ACCOUNT_ID": "1",
+        "CHATWOOT_INBOX_ID": "1",
+        "CHATWOOT_API_TOKEN": "bench-token",
+        "WUZAPI_API_URL": wuzapi_url,
+        "WUZAPI_API_TOKEN": "bench-token",
+        "WUZAPI_INSTANCE_NAME": "bench",
+        "QUEUE_DB_PATH": os.path.join(data_dir, "queue.db"),
+        "LOG_LEVEL": "WARNING",
+    })
+    env.update(item.split("=", 1) for item in extra_env)
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], cwd=ROOT, env=env)
+
+
+async def wait_ready(client: httpx.AsyncClient, bridge: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if bridge.poll() is not None:
+            raise SystemExit(f"A ponte terminou durante a inicialização (código {bridge.returncode}).")
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise SystemExit("A ponte não respondeu a tempo.")
+
+
+async def replay(args, client: httpx.AsyncClient, templates: list[dict], recorder: Recorder, files_url: str) -> dict:
+    """Envia os webhooks em malha aberta e espera a ponte terminar de processá-los."""
+    rng = random.Random(args.seed)
+    run_id = f"BENCH{int(time.time())}"
+    phones = [f"55119{index:08d}" for index in range(args.contacts)]
+    weights = [row.get("weight", 1) for row in templates]
+    total = int(args.rps * args.duration)
+    sent: dict[int, tuple[str, float]] = {}
+    acks: list[float] = []
+    ack_errors: Counter = Counter()
+    tasks = []
+    # Respostas de agentes enviadas (sequência, instante): os recibos citam uma enviada há pelo menos
+    # RECEIPT_LAG segundos, quando ela já deve ter saído pela WuzAPI
+    replies: deque[tuple[int, float]] = deque()
+    reply = None
+
+    async def send(sequence: int, row: dict, body: bytes):
+        started = time.perf_counter()
+        sent[sequence] = (row["kind"], started)
+        try:
+            response = await client.post(WEBHOOK_PATHS[row["target"]], content=body,
+                                         headers={"Content-Type": "application/json"})
+            if response.status_code >= 400:
+                ack_errors[str(response.status_code)] += 1
+        except httpx.HTTPError as e:
+            ack_errors[type(e).__name__] += 1
+        acks.append(time.perf_counter() - started)
+
+    start = time.perf_counter()
+    for sequence in range(total):
+        delay = start + sequence / args.rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        row = rng.choices(templates, weights)[0]
+        while replies and replies[0][1] <= time.perf_counter() - RECEIPT_LAG:
+            reply = replies.popleft()[0]
+        body = render(row["template"], run_id, sequence, rng.choice(phones), files_url, reply)
+        if row["target"] == "chatwoot":
+            replies.append((sequence, time.perf_counter()))
+        tasks.append(asyncio.create_task(send(sequence, row, body)))
+    await asyncio.gather(*tasks)
+    send_seconds = time.perf_counter() - start
+
+    # Espera as entregas pararem (fila da ponte vazia) ou o limite de tempo
+    deadline = time.perf_counter() + args.drain
+    last = (-1, -1)
+    idle_since = time.perf_counter()
+    while time.perf_counter() < deadline:
+        current = (len(recorder.delivered), sum(recorder.calls.values()))
+        if current != last:
+            last, idle_since = current, time.perf_counter()
+        elif time.perf_counter() - idle_since >= args.settle:
+            break
+        await asyncio.sleep(0.1)
+    return {"sent": sent, "acks": acks, "ack_errors": ack_errors, "send_seconds": send_seconds,
+            "finished": time.perf_counter()}
+
+
+def build_report(args, result: dict, recorder: Recorder) -> dict:
+    sent = result["sent"]
+    by_kind: dict[str, dict] = defaultdict(lambda: {"sent": 0, "latencies": []})
+    for sequence, (kind, started) in sent.items():
+        entry = by_kind[kind]
+        entry["sent"] += 1
+        if sequence in recorder.delivered:
+            entry["latencies"].append(recorder.delivered[sequence] - started)
+
+    delivered = sum(len(entry["latencies"]) for entry in by_kind.values())
+    last_delivery = max(recorder.delivered.values(), default=None)
+    first_send = min((started for _, started in sent.values()), default=None)
+    all_latencies = [latency for entry in by_kind.values() for latency in entry["latencies"]]
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 1)
+    calls = {f"{upstream}.{endpoint}": count for (upstream, endpoint), count in sorted(recorder.calls.items())}
+    return {
+        "config": {"rps": args.rps, "duration": args.duration, "contacts": args.contacts,
+                   "chatwoot_latency_ms": args.chatwoot_latency, "wuzapi_latency_ms": args.wuzapi_latency,
+                   "jitter_ms": args.jitter, "error_rate": args.error_rate},
+        "webhooks": {
+            "sent": len(sent),
+            "offered_rps": round(len(sent) / result["send_seconds"], 1) if result["send_seconds"] else None,
+            "ack_p50_ms": ms(percentile(result["acks"], 0.50)),
+            "ack_p99_ms": ms(percentile(result["acks"], 0.99)),
+            "ack_errors": dict(result["ack_errors"]),
+        },
+        "delivery": {
+            "delivered": delivered,
+            "throughput_rps": (round(delivered / (last_delivery - first_send), 1)
+                               if delivered and last_delivery > first_send else None),
+            "p50_ms": ms(percentile(all_latencies, 0.50)),
+            "p99_ms": ms(percentile(all_latencies, 0.99)),
+        },
+        "kinds": {
+            kind: {"sent": entry["sent"], "delivered": len(entry["latencies"]),
+                   "p50_ms": ms(percentile(entry["latencies"], 0.50)),
+                   "p99_ms": ms(percentile(entry["latencies"], 0.99))}
+            for kind, entry in sorted(by_kind.items())
+        },
+        "upstream_calls": calls,
+        "upstream_calls_per_message": {
+            name: round(count / delivered, 3) for name, count in calls.items()
+        } if delivered else {},
+        "upstream_calls_per_message_total": round(sum(calls.values()) / delivered, 3) if delivered else None,
+    }
+
+
+def print_report(report: dict):
+    webhooks, delivery = report["webhooks"], report["delivery"]
+    print(f"\nWebhooks: {webhooks['sent']} enviados a {webhooks['offered_rps']} req/s, "
+          f"resposta p50 {webhooks['ack_p50_ms']} ms / p99 {webhooks['ack_p99_ms']} ms, "
+          f"erros {webhooks['ack_errors'] or 0}")
+    print(f"Entregas: {delivery['delivered']} a {delivery['throughput_rps']} msg/s, "
+          f"latência fim a fim p50 {delivery['p50_ms']} ms / p99 {delivery['p99_ms']} ms\n")
+    print(f"{'tipo':<16}{'enviados':>10}{'entregues':>11}{'p50 ms':>10}{'p99 ms':>10}")
+    for kind, entry in report["kinds"].items():
+        print(f"{kind:<16}{entry['sent']:>10}{entry['delivered']:>11}{str(entry['p50_ms']):>10}{str(entry['p99_ms']):>10}")
+    print(f"\n{'chamada':<36}{'total':>8}{'por msg':>10}")
+    for name, count in report["upstream_calls"].items():
+        print(f"{name:<36}{count:>8}{str(report['upstream_calls_per_message'].get(name)):>10}")
+    print(f"{'total':<36}{sum(report['upstream_calls'].values()):>8}"
+          f"{str(report['upstream_calls_per_message_total']):>10}")
+
+
+async def main(args):
+    recorder = Recorder()
+    chatwoot_faults = Faults(args.chatwoot_latency / 1000, args.jitter / 1000, args.error_rate)
+    wuzapi_faults = Faults(args.wuzapi_latency / 1000, args.jitter / 1000, args.error_rate)
+    chatwoot_port, wuzapi_port, bridge_port = free_port(), free_port(), free_port()
+    chatwoot_url, wuzapi_url = f"http://127.0.0.1:{chatwoot_port}", f"http://127.0.0.1:{wuzapi_port}"
+    servers = [await serve(chatwoot_app(recorder, chatwoot_faults, args.media_size), chatwoot_port),
+               await serve(wuzapi_app(recorder, wuzapi_faults, args.media_size), wuzapi_port)]
+    templates = load_templates(Path(args.payloads), set(args.kinds.split(",")) if args.kinds else None)
+
+    with tempfile.TemporaryDirectory(prefix="ricard-zap-bench-") as data_dir:
+        bridge = start_bridge(bridge_port, chatwoot_url, wuzapi_url, data_dir, args.env)
+        limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{bridge_port}", limits=limits,
+                                         timeout=30.0) as client:
+                await wait_ready(client, bridge)
+                result = await replay(args, client, templates, recorder, chatwoot_url)
+        finally:
+            bridge.terminate()
+            bridge.wait(timeout=30)
+            for server in servers:
+                server.should_exit = True
+
+    report = build_report(args, result, recorder)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nRelatório gravado em {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark da ponte com Chatwoot e WuzAPI falsos.")
+    parser.add_argument("--rps", type=float, default=20, help="Webhooks por segundo (padrão 20)")
+    parser.add_argument("--duration", type=float, default=10, help="Segundos de envio (padrão 10)")
+    parser.add_argument("--payloads", default=str(DEFAULT_PAYLOADS), help="JSONL com os webhooks gravados")
+    parser.add_argument("--kinds", help="Apenas estes tipos de payload, separados por vírgula (ex.: text,media)")
+    parser.add_argument("--contacts", type=int, default=200, help="Números de telefone distintos (padrão 200)")
+    parser.add_argument("--chatwoot-latency", type=float, default=20, help="Latência do Chatwoot falso em ms")
+    parser.add_argument("--wuzapi-latency", type=float, default=20, help="Latência da WuzAPI falsa em ms")
+    parser.add_argument("--jitter", type=float, default=10, help="Jitter uniforme somado à latência, em ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 500 dos upstreams")
+    parser.add_argument("--media-size", type=int, default=64 * 1024, help="Tamanho das mídias baixadas, em bytes")
+    parser.add_argument("--connections", type=int, default=100, help="Conexões simultâneas com a ponte")
+    parser.add_argument("--drain", type=float, default=60, help="Tempo máximo de espera pelas entregas, em s")
+    parser.add_argument("--settle", type=float, default=3, help="Segundos sem entregas para considerar o fim")
+    parser.add_argument("--seed", type=int, default=1, help="Semente da escolha de payloads e contatos")
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="Variável de ambiente extra para a ponte (ex.: --env JOB_WORKERS=8)")
+    parser.add_argument("--json", help="Grava o relatório completo neste arquivo JSON")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,116 @@
+import os
+import time
+from collections import deque
+
+import metrics
+from logs import get_logger
+
+logger = get_logger("breaker")
+
+# --- Circuit breakers e timeouts adaptativos por upstream/endpoint ---
+# Quando um upstream falha repetidamente, o breaker abre e as chamadas falham na hora (o job volta
+# para a fila durável) em vez de prender workers esperando timeouts. Após o período de espera, uma
+# única chamada de teste (half-open) decide se o circuito fecha novamente.
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+# O timeout de leitura passa a ser p99 observado × fator, entre o mínimo e o timeout configurado
+ADAPTIVE_TIMEOUT_FACTOR = float(os.getenv("ADAPTIVE_TIMEOUT_FACTOR", "3"))
+ADAPTIVE_TIMEOUT_MIN = float(os.getenv("ADAPTIVE_TIMEOUT_MIN", "1"))
+ADAPTIVE_TIMEOUT_SAMPLES = 200
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 20
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Chamada recusada porque o circuito do upstream/endpoint está aberto."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuito '{name}' aberto; nova tentativa em {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Abre após `failure_threshold` falhas consecutivas e fica aberto por `reset_timeout` segundos."""
+
+    def __init__(self, upstream: str, endpoint: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.upstream = upstream
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    @property
+    def name(self) -> str:
+        return f"{self.upstream}:{self.endpoint}"
+
+    def before_call(self):
+        """Levanta CircuitOpenError se a chamada não deve ser feita agora."""
+        if self.state == CLOSED:
+            return
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if self.state == OPEN and remaining <= 0:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            # Apenas uma chamada de teste por vez
+            self._probing = True
+            return
+        metrics.BREAKER_REJECTED.labels(self.upstream, self.endpoint).inc()
+        raise CircuitOpenError(self.name, max(remaining, 1.0))
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        if self.state != CLOSED:
+            logger.info("Circuito '%s' fechado: upstream respondeu normalmente.", self.name)
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            logger.warning("Circuito '%s' aberto após %s falhas. Chamadas recusadas por %.0fs.",
+                           self.name, self.failures, self.reset_timeout)
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.BREAKER_STATE.labels(self.upstream, self.endpoint).set(STATE_VALUES[state])
+
+
+class AdaptiveTimeout:
+    """Timeout de leitura derivado da latência observada (p99) das últimas chamadas bem-sucedidas."""
+
+    def __init__(self, maximum: float, factor: float = ADAPTIVE_TIMEOUT_FACTOR, minimum: float = ADAPTIVE_TIMEOUT_MIN):
+        self.maximum = maximum
+        self.factor = factor
+        self.minimum = min(minimum, maximum)
+        self._samples: deque = deque(maxlen=ADAPTIVE_TIMEOUT_SAMPLES)
+        self._current = maximum
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        if len(self._samples) >= ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+            ordered = sorted(self._samples)
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+            self._current = max(self.minimum, min(self.maximum, p99 * self.factor))
+
+    def reset(self):
+        """Volta ao timeout configurado. Chamado quando uma chamada estoura o timeout adaptativo: as
+        amostras só vêm de chamadas bem-sucedidas, e sem isso um aumento de latência do upstream faria
+        todas as chamadas seguintes estourarem o mesmo timeout."""
+        self._samples.clear()
+        self._current = self.maximum
+
+    @property
+    def current(self) -> float:
+        return self._current
@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+
+# --- Cache em memória com TTL e despejo LRU ---
+
+
+class TTLCache:
+    """Dicionário limitado: cada entrada expira após `ttl` segundos e, ao atingir `maxsize`,
+    a entrada usada há mais tempo é descartada."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
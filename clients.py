@@ -0,0 +1,563 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+
+import media
+import metrics
+from breaker import AdaptiveTimeout, CircuitBreaker, CircuitOpenError
+from logs import get_logger
+
+logger = get_logger("clients")
+
+# --- Clientes HTTP assíncronos para o Chatwoot e a WuzAPI ---
+# Cada cliente mantém um único httpx.AsyncClient, com pool de conexões keep-alive
+# e HTTP/2 quando o servidor oferece, compartilhado por todos os webhooks.
+
+# Limites do pool de conexões (por upstream)
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+
+# Timeouts por endpoint: buscas e leituras devem ser rápidas, envios podem demorar mais.
+CHATWOOT_TIMEOUTS = {
+    "search_contact": httpx.Timeout(8.0, connect=3.0),
+    "create_contact": httpx.Timeout(10.0, connect=3.0),
+    "list_conversations": httpx.Timeout(8.0, connect=3.0),
+    "create_conversation": httpx.Timeout(10.0, connect=3.0),
+    "send_message": httpx.Timeout(15.0, connect=3.0),
+    "get_conversation": httpx.Timeout(8.0, connect=3.0),
+    "update_contact": httpx.Timeout(10.0, connect=3.0),
+    "upload_attachment": httpx.Timeout(120.0, connect=3.0),
+    "update_message": httpx.Timeout(8.0, connect=3.0),
+    "ping": httpx.Timeout(3.0, connect=2.0),
+}
+
+WUZAPI_TIMEOUTS = {
+    "user_avatar": httpx.Timeout(5.0, connect=3.0),
+    "legacy_profile_pic": httpx.Timeout(5.0, connect=3.0),
+    "send_text": httpx.Timeout(15.0, connect=3.0),
+    "download_media": httpx.Timeout(120.0, connect=3.0),
+    "send_media": httpx.Timeout(120.0, connect=3.0),
+    "group_info": httpx.Timeout(8.0, connect=3.0),
+    "ping": httpx.Timeout(3.0, connect=2.0),
+}
+
+# Páginas de /contacts/search percorridas em busca da correspondência exata
+CONTACT_SEARCH_MAX_PAGES = 10
+
+MEDIA_TIMEOUTS = {
+    "download": httpx.Timeout(120.0, connect=5.0),
+}
+
+# Campos do corpo JSON de /chat/send/<tipo> para cada tipo de mídia
+WUZAPI_MEDIA_FIELDS = {
+    "image": "image",
+    "audio": "audio",
+    "video": "video",
+    "document": "document",
+}
+
+
+def sent_message_id(response: httpx.Response) -> str | bool:
+    """ID da mensagem enviada pela WuzAPI ({"data": {"Id": ...}}), ou True se a resposta não o trouxer."""
+    try:
+        data = response.json().get("data") or {}
+    except ValueError:
+        return True
+    return (data.get("Id") or data.get("ID") or True) if isinstance(data, dict) else True
+
+
+class ChatwootNotFoundError(Exception):
+    """O Chatwoot respondeu 404: o contato ou a conversa não existe mais."""
+
+
+class UpstreamClient:
+    """Base dos clientes: um httpx.AsyncClient por upstream, métricas de latência e um circuit breaker
+    por endpoint. Respostas 5xx e erros de rede contam como falha; com o circuito aberto, as chamadas
+    levantam CircuitOpenError sem tocar a rede."""
+
+    upstream = ""
+    timeouts: dict = {}
+
+    def __init__(self, base_url: str, headers: dict, limits: httpx.Limits = DEFAULT_LIMITS, http2: bool = True,
+                 follow_redirects: bool = False):
+        self._client = httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, http2=http2,
+                                         follow_redirects=follow_redirects)
+        self._breakers = {endpoint: CircuitBreaker(self.upstream, endpoint) for endpoint in self.timeouts}
+        self._read_timeouts = {endpoint: AdaptiveTimeout(timeout.read) for endpoint, timeout in self.timeouts.items()}
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def breaker_states(self) -> dict:
+        return {endpoint: breaker.state for endpoint, breaker in self._breakers.items()}
+
+    async def _ping(self, url: str) -> bool:
+        """Sondagem de prontidão: True se o upstream respondeu com sucesso. Também abre a conexão
+        keep-alive do pool (aquecimento)."""
+        try:
+            response = await self._request("ping", "GET", url)
+            return response.is_success
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            logger.debug("Sondagem de %s falhou: %s", self.upstream, e)
+            return False
+
+    def _timeout(self, endpoint: str, adaptive: bool = True) -> httpx.Timeout:
+        """Timeout configurado do endpoint, com o timeout de leitura ajustado pela latência observada."""
+        configured = self.timeouts[endpoint]
+        if not adaptive:
+            return configured
+        read = self._read_timeouts[endpoint].current
+        metrics.UPSTREAM_TIMEOUT.labels(self.upstream, endpoint).set(read)
+        return httpx.Timeout(connect=configured.connect, read=read, write=configured.write, pool=configured.pool)
+
+    async def _request(self, endpoint: str, method: str, url: str, adaptive: bool = True,
+                       **kwargs) -> httpx.Response:
+        """Executa a requisição com o timeout do endpoint e registra latência e status.
+        Uploads de mídia passam `adaptive=False`: a duração depende do tamanho do arquivo."""
+        breaker = self._breakers[endpoint]
+        breaker.before_call()
+        healthy = False
+        start = time.perf_counter()
+        try:
+            with self._observe(endpoint) as observation:
+                response = await self._client.request(method, url, timeout=self._timeout(endpoint, adaptive),
+                                                      **kwargs)
+                observation["status"] = str(response.status_code)
+            healthy = response.status_code < 500
+            if healthy and adaptive:
+                self._read_timeouts[endpoint].observe(time.perf_counter() - start)
+            return response
+        except httpx.ReadTimeout:
+            if adaptive:
+                self._read_timeouts[endpoint].reset()
+            raise
+        finally:
+            if healthy:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+
+    @asynccontextmanager
+    async def _stream(self, endpoint: str, method: str, url: str, **kwargs):
+        """Como _request, mas o corpo da resposta é lido em blocos (response.aiter_bytes()).
+        Downloads longos mantêm o timeout configurado: só o circuit breaker se aplica."""
+        breaker = self._breakers[endpoint]
+        breaker.before_call()
+        healthy = False
+        try:
+            with self._observe(endpoint) as observation:
+                async with self._client.stream(method, url, timeout=self.timeouts[endpoint], **kwargs) as response:
+                    observation["status"] = str(response.status_code)
+                    healthy = response.status_code < 500
+                    yield response
+        finally:
+            if healthy:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+
+    @contextmanager
+    def _observe(self, endpoint: str):
+        observation = {"status": "error"}
+        start = time.perf_counter()
+        metrics.UPSTREAM_IN_FLIGHT.labels(self.upstream).inc()
+        try:
+            yield observation
+        finally:
+            metrics.UPSTREAM_IN_FLIGHT.labels(self.upstream).dec()
+            metrics.UPSTREAM_LATENCY.labels(self.upstream, endpoint).observe(time.perf_counter() - start)
+            metrics.UPSTREAM_REQUESTS.labels(self.upstream, endpoint, observation["status"]).inc()
+
+
+class ChatwootClient(UpstreamClient):
+    """Cliente assíncrono da API do Chatwoot, restrito a uma conta e uma caixa de entrada."""
+
+    upstream = "chatwoot"
+    timeouts = CHATWOOT_TIMEOUTS
+
+    def __init__(self, base_url: str, account_id: str, inbox_id: str, headers: dict,
+                 limits: httpx.Limits = DEFAULT_LIMITS, http2: bool = True):
+        super().__init__(f"{base_url.rstrip('/')}/api/v1/accounts/{account_id}", headers, limits, http2)
+        self.account_id = account_id
+        self.inbox_id = inbox_id
+
+    async def _search_contacts(self, query: str, match) -> dict | None:
+        """Percorre as páginas de /contacts/search (a busca é ampla e paginada) até achar o contato
+        para o qual `match(contato)` é verdadeiro. Erros são propagados: criar o contato depois de
+        uma busca que falhou geraria um duplicado."""
+        seen = 0
+        for page in range(1, CONTACT_SEARCH_MAX_PAGES + 1):
+            response = await self._request("search_contact", "GET", "/contacts/search",
+                                           params={"q": query, "page": page})
+            response.raise_for_status()
+            data = response.json()
+            payload = data.get("payload") or []
+            for contact in payload:
+                if match(contact):
+                    return contact
+            seen += len(payload)
+            if not payload or seen >= ((data.get("meta") or {}).get("count") or 0):
+                return None
+        logger.warning("Busca de contatos por %s sem correspondência exata nas primeiras %s páginas.", query,
+                       CONTACT_SEARCH_MAX_PAGES)
+        return None
+
+    async def ping(self) -> bool:
+        """A caixa de entrada responde (valida também o token)."""
+        return await self._ping(f"/inboxes/{self.inbox_id}")
+
+    async def search_contact(self, phone_number: str):
+        """Busca um contato no Chatwoot pelo número de telefone."""
+        # Remove o '+' se já existir para a busca
+        search_phone = phone_number.replace('+', '')
+        try:
+            # Procura a correspondência exata, pois a busca é ampla
+            contact = await self._search_contacts(
+                search_phone, lambda contact: (contact.get("phone_number") or "").endswith(search_phone))
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error("Erro ao buscar contato com número %s: %s", phone_number, e)
+            raise
+        if contact:
+            logger.debug("Contato encontrado: ID %s para o número %s", contact['id'], phone_number)
+        else:
+            logger.debug("Nenhum contato encontrado para o número %s", phone_number)
+        return contact
+
+    async def search_contact_by_identifier(self, identifier: str):
+        """Busca um contato pelo identificador exato (grupos: o JID do grupo)."""
+        try:
+            return await self._search_contacts(identifier, lambda contact: contact.get("identifier") == identifier)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error("Erro ao buscar contato com identificador %s: %s", identifier, e)
+            raise
+
+    async def create_contact(self, name: str, phone_number: str | None, avatar_url: str | None = None,
+                             identifier: str | None = None):
+        """Cria um novo contato no Chatwoot. Grupos não têm telefone: apenas o identificador (JID)."""
+        payload = {
+            "inbox_id": self.inbox_id,
+            "name": name,
+        }
+        if phone_number:
+            if '@' not in phone_number and not phone_number.startswith('+'):
+                phone_number = f"+{phone_number}"
+            payload["phone_number"] = phone_number
+        if identifier:
+            payload["identifier"] = identifier
+        if avatar_url:
+            payload["avatar_url"] = avatar_url
+        try:
+            response = await self._request("create_contact", "POST", "/contacts", json=payload)
+            response.raise_for_status()
+            contact = response.json()["payload"]["contact"]
+            logger.info("Contato criado: ID %s para %s (%s)", contact['id'], name, phone_number or identifier)
+            return contact
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error("Erro ao criar contato para %s (%s): %s", name, phone_number or identifier, e)
+            return None
+
+    async def find_or_create_conversation(self, contact_id: int):
+        """Busca uma conversa existente para o contato ou cria uma nova.
+        Levanta ChatwootNotFoundError se o contato não existir mais (apagado ou mesclado)."""
+        try:
+            response = await self._request("list_conversations", "GET", f"/contacts/{contact_id}/conversations")
+            if response.status_code == 404:
+                raise ChatwootNotFoundError(f"contato {contact_id} não encontrado")
+            response.raise_for_status()
+            conversations = response.json()["payload"]
+            if conversations:
+                conv_id = conversations[0]['id']
+                logger.debug("Conversa encontrada: ID %s para o contato %s", conv_id, contact_id)
+                return conv_id
+
+            logger.info("Nenhuma conversa encontrada para o contato %s. Criando uma nova...", contact_id)
+            payload = {"inbox_id": self.inbox_id, "contact_id": contact_id}
+            create_response = await self._request("create_conversation", "POST", "/conversations", json=payload)
+            if create_response.status_code == 404:
+                raise ChatwootNotFoundError(f"contato {contact_id} não encontrado")
+            create_response.raise_for_status()
+            new_conv_id = create_response.json()['id']
+            logger.info("Conversa criada: ID %s para o contato %s", new_conv_id, contact_id)
+            return new_conv_id
+
+        except (ChatwootNotFoundError, CircuitOpenError):
+            raise
+        except Exception as e:
+            logger.error("Erro ao buscar ou criar conversa para o contato %s: %s", contact_id, e)
+            return None
+
+    async def send_message_to_conversation(self, conversation_id: int, message_content: str,
+                                           message_type: str = "incoming", content_attributes: dict | None = None):
+        """Envia uma mensagem para uma conversa específica no Chatwoot.
+        Levanta ChatwootNotFoundError se a conversa não existir mais (permite invalidar o cache)."""
+        payload = {"content": message_content, "message_type": message_type}
+        if content_attributes:
+            payload["content_attributes"] = content_attributes
+        try:
+            response = await self._request("send_message", "POST", f"/conversations/{conversation_id}/messages",
+                                           json=payload)
+            if response.status_code == 404:
+                raise ChatwootNotFoundError(f"conversa {conversation_id} não encontrada")
+            response.raise_for_status()
+            logger.debug("Mensagem enviada com sucesso para a conversa %s", conversation_id)
+            return response.json()
+        except (ChatwootNotFoundError, CircuitOpenError):
+            raise
+        except Exception as e:
+            logger.error("Erro ao enviar mensagem para a conversa %s: %s", conversation_id, e)
+            return None
+
+    async def send_attachment(self, conversation_id: int, content: str | None, file, filename: str,
+                              mimetype: str | None, message_type: str = "incoming",
+                              content_attributes: dict | None = None):
+        """Envia uma mensagem com anexo (multipart) para a conversa. O arquivo é transmitido em blocos.
+        Levanta ChatwootNotFoundError se a conversa não existir mais."""
+        data = {"message_type": message_type}
+        if content:
+            data["content"] = content
+        # Campos aninhados no formato de formulário do Rails: content_attributes[chave]=valor
+        for key, value in (content_attributes or {}).items():
+            data[f"content_attributes[{key}]"] = json.dumps(value) if not isinstance(value, str) else value
+        files = {"attachments[]": (filename, file, mimetype or "application/octet-stream")}
+        try:
+            response = await self._request("upload_attachment", "POST", f"/conversations/{conversation_id}/messages",
+                                           data=data, files=files, adaptive=False)
+            if response.status_code == 404:
+                raise ChatwootNotFoundError(f"conversa {conversation_id} não encontrada")
+            response.raise_for_status()
+            logger.debug("Anexo %s enviado com sucesso para a conversa %s", filename, conversation_id)
+            return response.json()
+        except (ChatwootNotFoundError, CircuitOpenError):
+            raise
+        except Exception as e:
+            logger.error("Erro ao enviar anexo para a conversa %s: %s", conversation_id, e)
+            return None
+
+    async def update_message_status(self, conversation_id: int, message_id: int, status: str,
+                                    external_error: str | None = None) -> bool:
+        """Atualiza o status (sent, delivered, read, failed) de uma mensagem da caixa de API."""
+        payload = {"status": status}
+        if external_error:
+            payload["external_error"] = external_error
+        try:
+            response = await self._request("update_message", "PATCH",
+                                           f"/conversations/{conversation_id}/messages/{message_id}", json=payload)
+            response.raise_for_status()
+            logger.debug("Mensagem %s da conversa %s marcada como %s", message_id, conversation_id, status)
+            return True
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error("Erro ao atualizar o status da mensagem %s (conversa %s): %s", message_id, conversation_id, e)
+            return False
+
+    async def get_conversation_phone_number(self, conversation_id: int) -> str | None:
+        """Telefone do contato da conversa ou, nas conversas de grupo, o JID do grupo."""
+        try:
+            response = await self._request("get_conversation", "GET", f"/conversations/{conversation_id}")
+            response.raise_for_status()
+            data = response.json()
+
+            meta_sender = data.get("meta", {}).get("sender", {}) or {}
+            identifier = meta_sender.get("identifier") or ""
+            if identifier.endswith("@g.us"):
+                logger.debug("Grupo encontrado em meta.sender para a conversa %s: %s", conversation_id, identifier)
+                return identifier
+            phone = meta_sender.get("phone_number")
+            if phone:
+                logger.debug("Telefone encontrado em meta.sender para a conversa %s: %s", conversation_id, phone)
+                return phone
+
+            meta_contact = data.get("meta", {}).get("contact", {}) or {}
+            phone = meta_contact.get("phone_number")
+            if phone:
+                logger.debug("Telefone encontrado em meta.contact para a conversa %s: %s", conversation_id, phone)
+                return phone
+
+            contact = data.get("contact") or {}
+            if isinstance(contact, dict):
+                phone = contact.get("phone_number")
+                if phone:
+                    logger.debug("Telefone encontrado em contact para a conversa %s: %s", conversation_id, phone)
+                    return phone
+
+            logger.warning("Não foi possível encontrar phone_number na conversa %s.", conversation_id)
+            return None
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error("Erro ao buscar telefone da conversa %s: %s", conversation_id, e)
+            return None
+
+    async def update_contact_avatar(self, contact_id: int, avatar_url: str) -> bool:
+        if not avatar_url:
+            logger.debug("Contato %s: Nenhuma URL de avatar fornecida.", contact_id)
+            return False
+        try:
+            payload = {"avatar_url": avatar_url}
+            response = await self._request("update_contact", "PUT", f"/contacts/{contact_id}", json=payload)
+            response.raise_for_status()
+            logger.info("Contato %s: Avatar atualizado com sucesso!", contact_id)
+            return True
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error("Erro ao atualizar avatar para o contato %s: %s", contact_id, e)
+            return False
+
+
+class WuzAPIClient(UpstreamClient):
+    """Cliente assíncrono da WuzAPI (Sistema de API WhatsApp). A autenticação é feita pelo header 'token'."""
+
+    upstream = "wuzapi"
+    timeouts = WUZAPI_TIMEOUTS
+
+    def __init__(self, base_url: str, api_token: str,
+                 limits: httpx.Limits = DEFAULT_LIMITS, http2: bool = True):
+        super().__init__(base_url.rstrip('/'), {"token": api_token}, limits, http2)
+
+    async def ping(self) -> bool:
+        """A instância responde em /session/status (valida também o token)."""
+        return await self._ping("/session/status")
+
+    async def send_text(self, phone_number: str, message: str) -> str | bool:
+        """Envia uma mensagem de texto para um número de telefone usando a WuzAPI. Retorna o ID da mensagem
+        no WhatsApp (ou True, se a WuzAPI não o informar); False se o envio falhou."""
+        # A documentação indica que o endpoint é /chat/send/text e é um POST
+        payload = {
+            "number": phone_number,
+            "text": message
+        }
+        try:
+            logger.debug("Enviando mensagem para %s via POST em /chat/send/text", phone_number)
+            response = await self._request("send_text", "POST", "/chat/send/text", json=payload)
+            response.raise_for_status()
+            logger.debug("Mensagem enviada com sucesso para %s.", phone_number)
+            return sent_message_id(response)
+        except httpx.HTTPStatusError as e:
+            logger.error("Erro ao enviar mensagem via WuzAPI para %s: %s", phone_number, e,
+                         extra={"status_code": e.response.status_code, "response_body": e.response.text[:500]})
+            return False
+        except httpx.HTTPError as e:
+            logger.error("Erro ao enviar mensagem via WuzAPI para %s: %s", phone_number, e)
+            return False
+
+    async def send_media(self, phone_number: str, media_type: str, file, mimetype: str,
+                         caption: str | None = None, filename: str | None = None) -> str | bool:
+        """Envia uma mídia via /chat/send/<tipo>. O corpo JSON com o data URL base64 é gerado em blocos.
+        Retorna o ID da mensagem no WhatsApp (ou True), como send_text; False se o envio falhou."""
+        fields = {"number": phone_number}
+        if caption and media_type != "audio":
+            fields["caption"] = caption
+        if filename and media_type == "document":
+            fields["filename"] = filename
+        body = media.data_url_json_body(fields, WUZAPI_MEDIA_FIELDS[media_type], file, mimetype)
+        try:
+            logger.debug("Enviando %s para %s via POST em /chat/send/%s", media_type, phone_number, media_type)
+            response = await self._request("send_media", "POST", f"/chat/send/{media_type}", content=body,
+                                           headers={"Content-Type": "application/json"}, adaptive=False)
+            response.raise_for_status()
+            logger.debug("Mídia enviada com sucesso para %s.", phone_number)
+            return sent_message_id(response)
+        except httpx.HTTPStatusError as e:
+            logger.error("Erro ao enviar mídia via WuzAPI para %s: %s", phone_number, e,
+                         extra={"status_code": e.response.status_code, "response_body": e.response.text[:500]})
+            return False
+        except httpx.HTTPError as e:
+            logger.error("Erro ao enviar mídia via WuzAPI para %s: %s", phone_number, e)
+            return False
+
+    async def download_media(self, media_type: str, message_media: dict) -> tuple[str | None, object]:
+        """Baixa a mídia de uma mensagem via /chat/download<tipo>. A resposta (JSON com data URL base64)
+        é gravada em disco em blocos e decodificada uma única vez. Retorna (mimetype, arquivo)."""
+        payload = {
+            "Url": message_media.get("URL") or message_media.get("url"),
+            "DirectPath": message_media.get("directPath") or message_media.get("DirectPath"),
+            "MediaKey": message_media.get("mediaKey") or message_media.get("MediaKey"),
+            "Mimetype": message_media.get("mimetype") or message_media.get("Mimetype"),
+            "FileEncSHA256": message_media.get("fileEncSHA256") or message_media.get("FileEncSHA256"),
+            "FileSHA256": message_media.get("fileSHA256") or message_media.get("FileSHA256"),
+            "FileLength": message_media.get("fileLength") or message_media.get("FileLength"),
+        }
+        # A WuzAPI devolve a base64 do arquivo inteiro: até 4/3 do tamanho original
+        max_raw = media.MEDIA_MAX_BYTES * 4 // 3 + media.MEDIA_CHUNK_SIZE
+        async with self._stream("download_media", "POST", f"/chat/download{media_type}", json=payload) as response:
+            response.raise_for_status()
+            raw = await media.spool_stream(response.aiter_bytes(media.MEDIA_CHUNK_SIZE), max_raw)
+        try:
+            return await asyncio.to_thread(media.decode_data_url, raw)
+        finally:
+            raw.close()
+
+    async def get_group_info(self, group_jid: str) -> dict | None:
+        """Metadados de um grupo (GET /group/info): nome, participantes etc. Retorna None em caso de erro."""
+        try:
+            response = await self._request("group_info", "GET", "/group/info", params={"groupJID": group_jid})
+            response.raise_for_status()
+            data = response.json()
+            return data.get("data") or data.get("results") or None
+        except httpx.HTTPError as e:
+            logger.error("Erro ao buscar metadados do grupo %s na WuzAPI: %s", group_jid, e)
+            return None
+
+    async def get_profile_pic(self, phone_number_raw: str) -> dict | None:
+        """Busca a foto de perfil de um contato na WuzAPI usando o número completo (com @s.whatsapp.net).
+        Retorna {"url": ..., "id": ...}; o "id" da foto no WhatsApp pode vir vazio. Retorna None se o
+        contato não tem foto; levanta httpx.HTTPError (erro de rede ou 5xx) ou CircuitOpenError se a
+        consulta falhou, para que a conferência seja repetida."""
+        base_number = phone_number_raw.split("@")[0].replace("+", "")
+        avatar_url = None
+        picture_id = None
+
+        logger.debug("Buscando foto de perfil via /user/avatar para: %s", base_number)
+        response = await self._request("user_avatar", "POST", "/user/avatar", json={"phone": base_number})
+        if response.status_code >= 500:
+            response.raise_for_status()
+        if response.status_code == 200:
+            data = response.json()
+            results = data.get("results") or data.get("data") or {}
+            avatar_url = results.get("url") or results.get("URL") or data.get("profileImage")
+            picture_id = results.get("id") or results.get("ID")
+
+        if not avatar_url:
+            logger.debug("Buscando foto de perfil via /chat/getProfilePic para: %s", phone_number_raw)
+            legacy_response = await self._request("legacy_profile_pic", "GET", "/chat/getProfilePic",
+                                                  headers={"Accept": "application/json"},
+                                                  params={"number": phone_number_raw})
+            if legacy_response.status_code >= 500:
+                legacy_response.raise_for_status()
+            if legacy_response.status_code == 200:
+                legacy_data = legacy_response.json()
+                avatar_url = legacy_data.get("profileImage") or legacy_data.get("url")
+
+        if avatar_url:
+            logger.debug("URL do avatar encontrada: %s", avatar_url)
+            return {"url": avatar_url, "id": picture_id}
+
+        logger.debug("Foto de perfil não encontrada na resposta da WuzAPI.")
+        return None
+
+
+class MediaClient(UpstreamClient):
+    """Download de arquivos por URL absoluta (anexos do Chatwoot, mídia no S3), sem cabeçalhos de autenticação."""
+
+    upstream = "media"
+    timeouts = MEDIA_TIMEOUTS
+
+    def __init__(self, limits: httpx.Limits = DEFAULT_LIMITS, http2: bool = True):
+        super().__init__("", {}, limits, http2, follow_redirects=True)
+
+    async def download(self, url: str):
+        """Baixa o arquivo em blocos para um arquivo temporário. Retorna (content-type, arquivo)."""
+        async with self._stream("download", "GET", url) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type")
+            return content_type, await media.spool_stream(response.aiter_bytes(media.MEDIA_CHUNK_SIZE))
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+
+# --- Índice de deduplicação de mensagens ---
+# A WuzAPI reentrega eventos e o Chatwoot repete webhooks. Cada ID de mensagem é registrado
+# em um LRU exato em memória (tamanho limitado) e, opcionalmente, em uma tabela SQLite
+# particionada por janela de tempo, que sobrevive a reinícios e é podada continuamente.
+# Com um backend de estado compartilhado (Redis), a tabela SQLite dá lugar ao backend, e uma
+# mensagem reentregue a outra réplica também é reconhecida.
+
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "86400"))
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "100000"))
+DEDUP_PERSIST = os.getenv("DEDUP_PERSIST", "true").lower() in ("1", "true", "yes")
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH", os.getenv("QUEUE_DB_PATH", "data/queue.db"))
+# Intervalo entre podas da tabela persistente
+DEDUP_PRUNE_INTERVAL = 600.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_messages (
+    key TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seen_messages_seen_at ON seen_messages (seen_at);
+"""
+
+
+class DedupIndex:
+    """Registra IDs de mensagens já recebidas dentro da janela de deduplicação."""
+
+    def __init__(self, window: float = DEDUP_WINDOW, maxsize: int = DEDUP_CACHE_SIZE,
+                 path: str | None = DEDUP_DB_PATH if DEDUP_PERSIST else None, state=None):
+        self.window = window
+        self.state = state if state is not None and state.shared else None
+        self.path = path if self.state is None else None
+        self._recent = TTLCache(maxsize=maxsize, ttl=window)
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def open(self):
+        if self.path is None:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def seen(self, key: str) -> bool:
+        """Registra a chave e retorna True se ela já tinha sido vista dentro da janela."""
+        if key in self._recent:
+            return True
+        # Marca antes de qualquer await: entregas simultâneas da mesma mensagem também são barradas
+        self._recent.set(key, True)
+        if self.state is not None:
+            return not await self.state.add(f"dedup:{key}", self.window)
+        if self._conn is None:
+            return False
+        return not await asyncio.to_thread(self._insert, key, time.time())
+
+    async def contains(self, key: str) -> bool:
+        """Se a chave foi vista dentro da janela, sem registrá-la."""
+        if key in self._recent:
+            return True
+        if self.state is not None:
+            return await self.state.get(f"dedup:{key}") is not None
+        if self._conn is None:
+            return False
+        return await asyncio.to_thread(self._exists, key, time.time())
+
+    async def forget(self, key: str):
+        """Desfaz o registro da chave: o evento não chegou à fila, e a reentrega deve ser aceita."""
+        self._recent.pop(key)
+        if self.state is not None:
+            await self.state.delete(f"dedup:{key}")
+        elif self._conn is not None:
+            await asyncio.to_thread(self._delete, key)
+
+    def _exists(self, key: str, now: float) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT seen_at FROM seen_messages WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] >= now - self.window
+
+    def _delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM seen_messages WHERE key = ?", (key,))
+
+    def _insert(self, key: str, now: float) -> bool:
+        with self._lock:
+            if now - self._last_prune > DEDUP_PRUNE_INTERVAL:
+                self._conn.execute("DELETE FROM seen_messages WHERE seen_at < ?", (now - self.window,))
+                self._last_prune = now
+            row = self._conn.execute("SELECT seen_at FROM seen_messages WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] >= now - self.window:
+                return False
+            self._conn.execute("INSERT OR REPLACE INTO seen_messages (key, seen_at) VALUES (?, ?)", (key, now))
+            return True
+
+    def __len__(self) -> int:
+        return len(self._recent)
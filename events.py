@@ -0,0 +1,173 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional: sem ele, o json da biblioteca padrão
+    orjson = None
+
+# --- Eventos dos webhooks: pré-filtro, decodificação e modelos tipados ---
+# A maior parte dos webhooks da WuzAPI (presença, histórico, ...) e do Chatwoot (message_updated,
+# digitação, as próprias mensagens que a ponte cria) é ignorada. O pré-filtro descarta esses
+# eventos olhando só os bytes do corpo, sem decodificar o JSON. Os demais são decodificados uma
+# única vez e lidos por modelos com __slots__, sem percorrer cadeias de .get a cada uso.
+
+# Tipos de evento da WuzAPI e eventos do Chatwoot tratados pela ponte
+WUZAPI_EVENT_TYPES = ("Message", "ReadReceipt", "ChatPresence")
+CHATWOOT_CACHE_EVENTS = ("contact_updated", "conversation_created", "conversation_status_changed")
+CHATWOOT_EVENTS = ("message_created",) + CHATWOOT_CACHE_EVENTS
+
+# Marca (content_attributes) das mensagens criadas no Chatwoot pela importação de histórico
+BACKFILL_ATTRIBUTE = "ricard_zap_backfill"
+
+
+def loads(body: bytes | str):
+    """Decodifica JSON (orjson quando instalado). Levanta ValueError se o JSON for inválido."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def _field_pattern(field: str, values: tuple[str, ...]) -> re.Pattern:
+    # Aspas dentro de strings JSON vêm escapadas (\"), então o padrão só casa com chaves reais
+    names = "|".join(re.escape(value) for value in values)
+    return re.compile(rf'"{field}"\s*:\s*"(?:{names})"'.encode())
+
+
+_WUZAPI_TYPE = _field_pattern("type", WUZAPI_EVENT_TYPES)
+_WUZAPI_PRESENCE = _field_pattern("type", ("ChatPresence",))
+# De presença, só "paused" interessa (fecha a janela de agrupamento de textos); "composing" é descartado
+_WUZAPI_PAUSED = _field_pattern("State", ("paused",))
+_CHATWOOT_EVENT = _field_pattern("event", CHATWOOT_EVENTS)
+_CHATWOOT_ANY_EVENT = re.compile(rb'"event"\s*:\s*"')
+
+
+def wuzapi_prefilter(body: bytes) -> bool:
+    """False se o corpo certamente não é um evento tratado (nenhum "type" de WUZAPI_EVENT_TYPES, ou
+    presença que não seja "paused")."""
+    if _WUZAPI_TYPE.search(body) is None:
+        return False
+    return _WUZAPI_PRESENCE.search(body) is None or _WUZAPI_PAUSED.search(body) is not None
+
+
+def chatwoot_prefilter(body: bytes) -> bool:
+    """False se o corpo traz um "event" fora de CHATWOOT_EVENTS. Payloads sem "event" passam."""
+    return _CHATWOOT_EVENT.search(body) is not None or _CHATWOOT_ANY_EVENT.search(body) is None
+
+
+class WuzAPIEvent:
+    """Evento da WuzAPI, nos formatos direto e aninhado em 'jsonData'."""
+
+    __slots__ = ("data", "raw", "type", "info", "message", "message_id", "sender", "chat", "is_group",
+                 "is_from_me", "push_name", "message_type", "instance_name", "receipt_ids", "receipt_state", "presence")
+
+    def __init__(self, data: dict):
+        self.data = data
+        # Compatibilidade com formatos aninhados em 'jsonData'
+        raw = data.get("jsonData", data)
+        self.raw = raw
+        self.type = raw.get("type")
+        event = raw.get("event") or {}
+        info = event.get("Info", event)  # Fallback para o próprio evento
+        self.info = info
+        self.message = event.get("Message", event)
+        self.message_id = info.get("ID") or info.get("Id")
+        self.sender = info.get("SenderAlt") or info.get("Sender")
+        self.chat = info.get("Chat") or info.get("ChatJid") or event.get("Chat") or self.sender
+        self.is_group = bool(self.chat and "@g.us" in self.chat) or info.get("IsGroup") is True \
+            or info.get("isGroup") is True
+        self.is_from_me = info.get("IsFromMe") is True or info.get("isFromMe") is True
+        self.push_name = info.get("PushName") or info.get("pushName")
+        self.message_type = info.get("Type", "text")
+        self.instance_name = data.get("instanceName") or data.get("instance_name")
+        # Recibos (ReadReceipt): IDs das mensagens confirmadas e o estado ("Delivered" ou "Read")
+        self.receipt_ids = event.get("MessageIDs") or []
+        self.receipt_state = raw.get("state")
+        # Presença (ChatPresence): "composing" ou "paused"
+        self.presence = event.get("State")
+
+    @property
+    def is_receipt(self) -> bool:
+        return self.type == "ReadReceipt"
+
+    @property
+    def is_presence(self) -> bool:
+        return self.type == "ChatPresence"
+
+    def ignore_reason(self) -> str | None:
+        """Motivo para ignorar o evento antes de qualquer chamada aos upstreams, ou None."""
+        if self.is_receipt:
+            if self.is_from_me:
+                # Leitura feita no próprio aparelho (mensagens recebidas, não as enviadas pela ponte)
+                return "own read receipt"
+            if not self.receipt_ids or not self.chat:
+                return "receipt without message ids"
+            return None
+        if self.is_presence:
+            return None if self.presence == "paused" and self.sender else "presence not paused"
+        if self.type != "Message":
+            return f"Event type is {self.type}"
+        if not self.sender:
+            return "Could not determine sender"
+        # Status (stories) chegam com Chat = status@broadcast e o autor em Sender
+        if "@broadcast" in self.sender or "@broadcast" in (self.chat or ""):
+            return "status broadcast"
+        return None
+
+
+class ChatwootEvent:
+    """Evento do webhook de uma caixa de entrada do Chatwoot."""
+
+    __slots__ = ("data", "event", "id", "message_type", "private", "sender_type", "content", "attachments",
+                 "content_attributes", "conversation", "conversation_id", "contact_phone", "contact_identifier",
+                 "account_id", "inbox_id")
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.event = data.get("event")
+        self.id = data.get("id")
+        self.message_type = data.get("message_type")
+        self.private = bool(data.get("private"))
+        sender = data.get("sender") or {}
+        self.sender_type = sender.get("type")
+        self.content = data.get("content")
+        self.attachments = data.get("attachments") or []
+        self.content_attributes = data.get("content_attributes")
+        conversation = data.get("conversation") or {}
+        self.conversation = conversation
+        if (self.event or "").startswith("conversation_"):
+            self.conversation_id = self.id
+        else:
+            self.conversation_id = conversation.get("id") or data.get("conversation_id")
+        meta_sender = (conversation.get("meta") or {}).get("sender") or {}
+        contact = conversation.get("contact") or {}
+        self.contact_phone = meta_sender.get("phone_number") or contact.get("phone_number") or sender.get("phone_number")
+        # Contatos de grupo não têm telefone: o identificador é o JID do grupo
+        self.contact_identifier = meta_sender.get("identifier") or contact.get("identifier")
+        self.account_id = (data.get("account") or {}).get("id") or data.get("account_id") \
+            or conversation.get("account_id")
+        self.inbox_id = (data.get("inbox") or {}).get("id") or data.get("inbox_id") or conversation.get("inbox_id")
+
+    @property
+    def is_backfill(self) -> bool:
+        return isinstance(self.content_attributes, dict) and bool(self.content_attributes.get(BACKFILL_ATTRIBUTE))
+
+    def ignore_reason(self) -> str | None:
+        """Motivo para ignorar o evento antes de qualquer chamada aos upstreams, ou None.
+        Eventos de contato/conversa (cache de resolução) nunca são ignorados aqui."""
+        if self.event in CHATWOOT_CACHE_EVENTS:
+            return None
+        if self.event and self.event != "message_created":
+            return f"event is {self.event}"
+        # Mensagens privadas ou que não sejam de saída (inclui as que a própria ponte cria)
+        if self.private or self.message_type != "outgoing":
+            return "private or not outgoing message"
+        # Mensagens importadas do histórico já foram entregues no WhatsApp
+        if self.is_backfill:
+            return "backfilled message"
+        # Apenas mensagens de agentes (evita loops)
+        if self.sender_type not in ("agent_bot", "user"):
+            return "sender is not an agent"
+        if not self.content and not self.attachments:
+            return "empty content"
+        return None
@@ -0,0 +1,64 @@
+import os
+
+import metrics
+from cache import TTLCache
+from logs import get_logger
+from state import StateBackend
+
+logger = get_logger("groups")
+
+# --- Grupos do WhatsApp ---
+# Cada grupo vira um contato do Chatwoot (identificado pelo JID do grupo, sem telefone) com uma
+# conversa própria; as mensagens levam o nome de quem enviou. O nome do grupo vem dos metadados
+# da WuzAPI e os nomes dos participantes, dos push names das próprias mensagens, ambos em cache:
+# um grupo de 500 membros não gera uma consulta de metadados por mensagem.
+
+GROUP_CACHE_TTL = float(os.getenv("GROUP_CACHE_TTL", "3600"))
+# Se a consulta de metadados falhar, o JID é usado como nome e a consulta só é refeita após este prazo
+GROUP_ERROR_TTL = 60.0
+PARTICIPANT_CACHE_SIZE = int(os.getenv("PARTICIPANT_CACHE_SIZE", "50000"))
+
+
+def is_group_jid(jid: str | None) -> bool:
+    return bool(jid) and jid.endswith("@g.us")
+
+
+class GroupDirectory:
+    """Nomes dos grupos (no backend de estado, compartilhado entre processos) e dos participantes
+    (em memória, realimentados a cada mensagem)."""
+
+    def __init__(self, wuzapi, state: StateBackend, key_prefix: str = "group:"):
+        self.wuzapi = wuzapi
+        self.state = state
+        self.key_prefix = key_prefix
+        self._participants = TTLCache(maxsize=PARTICIPANT_CACHE_SIZE, ttl=GROUP_CACHE_TTL)
+
+    async def name(self, group_jid: str) -> str:
+        """Nome (assunto) do grupo. Single-flight: uma única consulta à WuzAPI por grupo e TTL."""
+        key = f"{self.key_prefix}{group_jid}"
+        cached = await self.state.get(key)
+        metrics.cache_lookup("group", cached is not None)
+        if cached is None:
+            async with self.state.lock(key):
+                cached = await self.state.get(key)
+                if cached is None:
+                    cached = await self._fetch(group_jid)
+                    await self.state.set(key, cached, GROUP_CACHE_TTL if cached["found"] else GROUP_ERROR_TTL)
+        return cached["name"]
+
+    async def _fetch(self, group_jid: str) -> dict:
+        info = await self.wuzapi.get_group_info(group_jid)
+        if not info:
+            logger.warning("Metadados do grupo %s indisponíveis; usando o JID como nome.", group_jid)
+            return {"name": group_jid.split("@")[0], "found": False}
+        for participant in info.get("Participants") or []:
+            if participant.get("DisplayName") and participant.get("JID"):
+                self._participants.set(participant["JID"], participant["DisplayName"])
+        return {"name": info.get("Name") or group_jid.split("@")[0], "found": True}
+
+    def participant_name(self, jid: str, push_name: str | None = None) -> str:
+        """Nome de quem enviou a mensagem: o push name da mensagem, o último conhecido ou o número."""
+        if push_name:
+            self._participants.set(jid, push_name)
+            return push_name
+        return self._participants.get(jid) or jid.split("@")[0]
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import time
+
+from logs import get_logger
+
+logger = get_logger("health")
+
+# --- Prontidão (GET /readyz) ---
+# /healthz só diz que o processo está vivo. /readyz diz se este worker deve receber tráfego:
+# o aquecimento do lifespan terminou, há tenants carregados e a fila durável não está acumulando
+# além do limite. A queda de um upstream não tira o worker do balanceamento (os webhooks continuam
+# indo para a fila durável); o resultado das sondagens dos upstreams vai no corpo, como informação,
+# e só entra na decisão com READY_REQUIRE_UPSTREAMS=true. As sondagens ficam em cache por
+# READY_PROBE_TTL segundos e chamadas simultâneas compartilham a mesma sondagem.
+
+READY_PROBE_TTL = float(os.getenv("READY_PROBE_TTL", "5"))
+READY_MAX_QUEUE_DEPTH = int(os.getenv("READY_MAX_QUEUE_DEPTH", "10000"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+READY_REQUIRE_UPSTREAMS = os.getenv("READY_REQUIRE_UPSTREAMS", "false").lower() in ("1", "true", "yes")
+
+
+class Readiness:
+    """Aquecimento concluído e resultado (em cache) das sondagens dos upstreams e da fila."""
+
+    def __init__(self, tenants, queue, ttl: float = READY_PROBE_TTL, max_queue_depth: int = READY_MAX_QUEUE_DEPTH,
+                 require_upstreams: bool = READY_REQUIRE_UPSTREAMS):
+        self.tenants = tenants
+        self.queue = queue
+        self.ttl = ttl
+        self.max_queue_depth = max_queue_depth
+        self.require_upstreams = require_upstreams
+        self.warm = False
+        self._result: dict | None = None
+        self._checked_at = 0.0
+        self._probing: asyncio.Task | None = None
+
+    async def check(self) -> dict:
+        """{"ready": bool, ...}: falso enquanto o worker aquece, sem tenants ou com a fila acima do limite."""
+        if not self.warm:
+            return {"ready": False, "reason": "warming up"}
+        if self._result is None or time.monotonic() - self._checked_at >= self.ttl:
+            return await self.refresh()
+        return self._result
+
+    async def refresh(self) -> dict:
+        """Sonda agora (single-flight: chamadas simultâneas aguardam a mesma sondagem)."""
+        if self._probing is None or self._probing.done():
+            self._probing = asyncio.create_task(self._probe())
+        return await asyncio.shield(self._probing)
+
+    async def _probe(self) -> dict:
+        tenants = list(self.tenants)
+        probes = await asyncio.gather(*(self._probe_tenant(tenant) for tenant in tenants))
+        upstreams = {tenant.id: probe for tenant, probe in zip(tenants, probes)}
+        try:
+            depth = await self.queue.depth()
+        except Exception as e:
+            logger.error("Erro ao consultar a profundidade da fila: %s", e)
+            depth = None
+        reachable = all(all(probe.values()) for probe in probes)
+        queue_ok = depth is not None and depth <= self.max_queue_depth
+        ready = bool(tenants) and queue_ok and (reachable or not self.require_upstreams)
+        result = {"ready": ready, "upstreams": upstreams, "queue_depth": depth}
+        if not reachable and (self._result is None or self._result["upstreams"] != upstreams):
+            logger.warning("Upstreams inacessíveis: %s", upstreams)
+        if not ready and (self._result is None or self._result["ready"]):
+            logger.warning("Worker não está pronto: upstreams %s, fila %s", upstreams, depth)
+        self._result = result
+        self._checked_at = time.monotonic()
+        return result
+
+    async def _probe_tenant(self, tenant) -> dict:
+        chatwoot, wuzapi = await asyncio.gather(tenant.chatwoot.ping(), tenant.wuzapi.ping(), return_exceptions=True)
+        return {"chatwoot": chatwoot is True, "wuzapi": wuzapi is True}
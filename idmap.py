@@ -0,0 +1,331 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from logs import get_logger
+
+logger = get_logger("idmap")
+
+# --- Índice local de IDs (telefone/JID -> contato e conversa no Chatwoot, avatar) ---
+# O cache de resolução vive em memória (ou no Redis, com TTL): depois de um deploy ou de uma queda,
+# cada chat ativo pagaria de novo a busca de contatos e a listagem de conversas. Este índice guarda
+# os mesmos IDs em uma tabela SQLite: é lido sob demanda, uma linha por chat, só no cache miss, e
+# as gravações são enfileiradas e feitas em lote por uma tarefa em segundo plano, fora do caminho
+# da mensagem. Os IDs de contato não expiram; os de conversa, após IDMAP_CONVERSATION_TTL.
+# Os vínculos dos recibos (ID da mensagem no WhatsApp -> mensagem do Chatwoot, com o status já
+# aplicado) também ficam aqui, para que os recibos que chegam depois de um reinício ainda sejam
+# aplicados, e apagados após RECEIPT_LINK_TTL.
+
+IDMAP_PERSIST = os.getenv("IDMAP_PERSIST", "true").lower() in ("1", "true", "yes")
+IDMAP_DB_PATH = os.getenv("IDMAP_DB_PATH", os.getenv("QUEUE_DB_PATH", "data/queue.db"))
+IDMAP_CONVERSATION_TTL = float(os.getenv("IDMAP_CONVERSATION_TTL", "604800"))
+IDMAP_RECEIPT_LINK_TTL = float(os.getenv("RECEIPT_LINK_TTL", "604800"))
+# Entradas mais recentes carregadas no cache de resolução na inicialização (aquecimento)
+IDMAP_WARM_ENTRIES = int(os.getenv("IDMAP_WARM_ENTRIES", "1000"))
+# Janela de agrupamento das gravações
+IDMAP_FLUSH_INTERVAL = 0.5
+# Intervalo entre as limpezas dos vínculos de recibos expirados
+IDMAP_PRUNE_INTERVAL = 3600.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS id_map (
+    tenant TEXT NOT NULL,
+    key TEXT NOT NULL,
+    contact_id INTEGER,
+    conversation_id INTEGER,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (tenant, key)
+);
+CREATE INDEX IF NOT EXISTS id_map_updated_at ON id_map (tenant, updated_at);
+CREATE TABLE IF NOT EXISTS contact_avatars (
+    tenant TEXT NOT NULL,
+    contact_id INTEGER NOT NULL,
+    avatar_id TEXT,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (tenant, contact_id)
+);
+CREATE TABLE IF NOT EXISTS receipt_links (
+    tenant TEXT NOT NULL,
+    whatsapp_id TEXT NOT NULL,
+    conversation_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    status INTEGER NOT NULL DEFAULT 0,
+    linked_at REAL NOT NULL,
+    PRIMARY KEY (tenant, whatsapp_id, conversation_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS receipt_links_linked_at ON receipt_links (linked_at);
+"""
+
+# Operações pendentes sobre uma chave
+_SET = "set"
+_CLEAR_CONVERSATION = "clear_conversation"
+_DELETE = "delete"
+
+
+class IdMap:
+    """Tabelas id_map, contact_avatars e receipt_links, com gravação assíncrona em lote (write-through)."""
+
+    def __init__(self, path: str | None = IDMAP_DB_PATH if IDMAP_PERSIST else None,
+                 conversation_ttl: float = IDMAP_CONVERSATION_TTL, link_ttl: float = IDMAP_RECEIPT_LINK_TTL):
+        self.path = path
+        self.conversation_ttl = conversation_ttl
+        self.link_ttl = link_ttl
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        # Última operação pendente por chave: gravações repetidas da mesma chave viram uma só
+        self._pending: dict[tuple[str, str], tuple] = {}
+        self._pending_avatars: dict[tuple[str, int], tuple[str | None, float]] = {}
+        # (tenant, ID no WhatsApp) -> (mensagens do Chatwoot vinculadas, status mais avançado)
+        self._pending_links: dict[tuple[str, str], tuple[frozenset, int]] = {}
+        self._last_prune = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def open(self):
+        if self.path is None:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+
+    def start(self):
+        if self._conn is not None and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Para a tarefa de gravação e grava o que estiver pendente."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._conn is not None:
+            await self._flush()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def bind(self, tenant: str) -> "TenantIdMap | None":
+        """Visão do índice restrita a um tenant (None se o índice estiver desativado)."""
+        return TenantIdMap(self, tenant) if self.path is not None else None
+
+    async def get(self, tenant: str, key: str) -> dict | None:
+        """{"contact_id", "conversation_id"} da chave; sem "conversation_id" se ela estiver expirada."""
+        if self._conn is None:
+            return None
+        pending = self._pending.get((tenant, key))
+        if pending is not None:
+            operation, value = pending
+            if operation == _SET:
+                return value
+            if operation == _DELETE:
+                return None
+        row = await asyncio.to_thread(self._select, "SELECT contact_id, conversation_id, updated_at FROM id_map"
+                                      " WHERE tenant = ? AND key = ?", (tenant, key))
+        metrics.cache_lookup("idmap", row is not None and row[0] is not None)
+        if row is None:
+            return None
+        if pending is not None and pending[0] == _CLEAR_CONVERSATION:
+            return self._entry(row[0], None, row[2])
+        return self._entry(*row)
+
+    async def recent(self, tenant: str, limit: int = IDMAP_WARM_ENTRIES) -> list[tuple[str, dict]]:
+        """As `limit` chaves atualizadas mais recentemente, para aquecer o cache de resolução."""
+        if self._conn is None or limit <= 0:
+            return []
+        rows = await asyncio.to_thread(self._select_all, "SELECT key, contact_id, conversation_id, updated_at"
+                                       " FROM id_map WHERE tenant = ? ORDER BY updated_at DESC LIMIT ?",
+                                       (tenant, limit))
+        entries = [(key, self._entry(*values)) for key, *values in rows]
+        return [(key, entry) for key, entry in entries if entry is not None]
+
+    def _entry(self, contact_id: int | None, conversation_id: int | None, updated_at: float) -> dict | None:
+        if contact_id is None:
+            return None
+        if conversation_id is None or time.time() - updated_at > self.conversation_ttl:
+            return {"contact_id": contact_id}
+        return {"contact_id": contact_id, "conversation_id": conversation_id}
+
+    def put(self, tenant: str, key: str, value: dict):
+        self._enqueue((tenant, key), (_SET, {field: value[field] for field in ("contact_id", "conversation_id")
+                                             if value.get(field) is not None}))
+
+    def forget(self, tenant: str, key: str, keep_contact: bool = False):
+        """Remove a chave ou, com `keep_contact`, apenas a conversa (o contato continua valendo)."""
+        self._enqueue((tenant, key), (_CLEAR_CONVERSATION if keep_contact else _DELETE, None))
+
+    async def avatar(self, tenant: str, contact_id: int) -> dict | None:
+        """{"avatar_id", "checked_at"} da última conferência do avatar do contato."""
+        if self._conn is None:
+            return None
+        pending = self._pending_avatars.get((tenant, contact_id))
+        if pending is not None:
+            return {"avatar_id": pending[0], "checked_at": pending[1]}
+        row = await asyncio.to_thread(self._select, "SELECT avatar_id, checked_at FROM contact_avatars"
+                                      " WHERE tenant = ? AND contact_id = ?", (tenant, contact_id))
+        return {"avatar_id": row[0], "checked_at": row[1]} if row is not None else None
+
+    def set_avatar(self, tenant: str, contact_id: int, avatar_id: str | None, checked_at: float | None = None):
+        if self._conn is None:
+            return
+        self._pending_avatars[(tenant, contact_id)] = (avatar_id, checked_at or time.time())
+        self._wakeup.set()
+
+    async def receipt_link(self, tenant: str, whatsapp_id: str) -> dict | None:
+        """{"messages": [(conversa, mensagem), ...], "status": posição do status} do vínculo, ou None."""
+        if self._conn is None:
+            return None
+        rows = await asyncio.to_thread(self._select_all, "SELECT conversation_id, message_id, status FROM receipt_links"
+                                       " WHERE tenant = ? AND whatsapp_id = ? AND linked_at > ?",
+                                       (tenant, whatsapp_id, time.time() - self.link_ttl))
+        messages, status = self._pending_links.get((tenant, whatsapp_id), (frozenset(), 0))
+        messages = messages | {(conversation_id, message_id) for conversation_id, message_id, _ in rows}
+        if not messages:
+            return None
+        return {"messages": sorted(messages), "status": max([status] + [row[2] for row in rows])}
+
+    def link_receipt(self, tenant: str, whatsapp_id: str, conversation_id: int, message_id: int):
+        self._enqueue_link((tenant, whatsapp_id), frozenset({(conversation_id, message_id)}), 0)
+
+    def set_receipt_status(self, tenant: str, whatsapp_id: str, status: int):
+        """Registra o status aplicado (só avança: um status menor que o gravado é ignorado)."""
+        self._enqueue_link((tenant, whatsapp_id), frozenset(), status)
+
+    def _enqueue_link(self, key: tuple[str, str], messages: frozenset, status: int):
+        if self._conn is None:
+            return
+        self._pending_links[key] = self._merge_link(self._pending_links.get(key), (messages, status))
+        self._wakeup.set()
+
+    @staticmethod
+    def _merge_link(current: tuple | None, new: tuple) -> tuple[frozenset, int]:
+        if current is None:
+            return new
+        return current[0] | new[0], max(current[1], new[1])
+
+    def _enqueue(self, key: tuple[str, str], operation: tuple):
+        if self._conn is None:
+            return
+        self._pending[key] = operation
+        self._wakeup.set()
+
+    def _select(self, sql: str, params: tuple):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _select_all(self, sql: str, params: tuple):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(IDMAP_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error("Erro ao gravar o índice de IDs: %s", e)
+
+    async def _flush(self):
+        if not self._pending and not self._pending_avatars and not self._pending_links:
+            return
+        pending, self._pending = self._pending, {}
+        avatars, self._pending_avatars = self._pending_avatars, {}
+        links, self._pending_links = self._pending_links, {}
+        try:
+            await asyncio.to_thread(self._write, pending, avatars, time.time(), links)
+        except Exception:
+            # Devolve o lote, sem sobrescrever operações mais novas das mesmas chaves
+            self._pending = {**pending, **self._pending}
+            self._pending_avatars = {**avatars, **self._pending_avatars}
+            for key, link in links.items():
+                self._pending_links[key] = self._merge_link(self._pending_links.get(key), link)
+            raise
+
+    def _write(self, pending: dict, avatars: dict, now: float, links: dict | None = None):
+        upserts, clears, deletes = [], [], []
+        for (tenant, key), (operation, value) in pending.items():
+            if operation == _SET:
+                upserts.append((tenant, key, value.get("contact_id"), value.get("conversation_id"), now))
+            elif operation == _CLEAR_CONVERSATION:
+                clears.append((now, tenant, key))
+            else:
+                deletes.append((tenant, key))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO id_map (tenant, key, contact_id, conversation_id, updated_at) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (tenant, key) DO UPDATE SET contact_id = excluded.contact_id,"
+                    " conversation_id = excluded.conversation_id, updated_at = excluded.updated_at", upserts)
+                self._conn.executemany(
+                    "UPDATE id_map SET conversation_id = NULL, updated_at = ? WHERE tenant = ? AND key = ?", clears)
+                self._conn.executemany("DELETE FROM id_map WHERE tenant = ? AND key = ?", deletes)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO contact_avatars (tenant, contact_id, avatar_id, checked_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    [(tenant, contact_id, avatar_id, checked_at)
+                     for (tenant, contact_id), (avatar_id, checked_at) in avatars.items()])
+                for (tenant, whatsapp_id), (messages, status) in (links or {}).items():
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO receipt_links (tenant, whatsapp_id, conversation_id, message_id, status,"
+                        " linked_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(tenant, whatsapp_id, conversation_id, message_id, status, now)
+                         for conversation_id, message_id in messages])
+                    if status:
+                        self._conn.execute("UPDATE receipt_links SET status = ? WHERE tenant = ? AND whatsapp_id = ?"
+                                           " AND status < ?", (status, tenant, whatsapp_id, status))
+                if now - self._last_prune > IDMAP_PRUNE_INTERVAL:
+                    self._conn.execute("DELETE FROM receipt_links WHERE linked_at < ?", (now - self.link_ttl,))
+                    self._last_prune = now
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class TenantIdMap:
+    """IdMap de um tenant (mesma interface, sem o parâmetro `tenant`)."""
+
+    __slots__ = ("ids", "tenant")
+
+    def __init__(self, ids: IdMap, tenant: str):
+        self.ids = ids
+        self.tenant = tenant
+
+    async def get(self, key: str) -> dict | None:
+        return await self.ids.get(self.tenant, key)
+
+    async def recent(self, limit: int = IDMAP_WARM_ENTRIES) -> list[tuple[str, dict]]:
+        return await self.ids.recent(self.tenant, limit)
+
+    def put(self, key: str, value: dict):
+        self.ids.put(self.tenant, key, value)
+
+    def forget(self, key: str, keep_contact: bool = False):
+        self.ids.forget(self.tenant, key, keep_contact)
+
+    async def avatar(self, contact_id: int) -> dict | None:
+        return await self.ids.avatar(self.tenant, contact_id)
+
+    def set_avatar(self, contact_id: int, avatar_id: str | None):
+        self.ids.set_avatar(self.tenant, contact_id, avatar_id)
+
+    async def receipt_link(self, whatsapp_id: str) -> dict | None:
+        return await self.ids.receipt_link(self.tenant, whatsapp_id)
+
+    def link_receipt(self, whatsapp_id: str, conversation_id: int, message_id: int):
+        self.ids.link_receipt(self.tenant, whatsapp_id, conversation_id, message_id)
+
+    def set_receipt_status(self, whatsapp_id: str, status: int):
+        self.ids.set_receipt_status(self.tenant, whatsapp_id, status)
@@ -0,0 +1,353 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import metrics
+from breaker import CircuitOpenError
+from logs import get_logger
+
+logger = get_logger("jobqueue")
+
+# --- Fila durável de eventos recebidos (SQLite em modo WAL) ---
+# Os webhooks apenas gravam o evento e respondem 202; um pool de workers assíncronos
+# consome a fila com novas tentativas, backoff exponencial e tabela de dead-letter.
+# Cada job pode ter uma chave de shard (ex.: o JID do remetente): jobs do mesmo shard são
+# executados um de cada vez, em ordem FIFO; shards diferentes rodam em paralelo.
+# Cada job registra também o tenant (instância WuzAPI + caixa do Chatwoot) a que pertence.
+# Jobs com chave de agrupamento (textos recebidos em rajada, com INBOUND_COALESCE_MS) podem ser
+# adiados por uma janela curta: o primeiro job do shard leva junto os seguintes com a mesma chave,
+# e todos são confirmados (ou repetidos) juntos, sem perder a durabilidade da fila.
+
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", "data/queue.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "8"))
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "2"))
+JOB_RETRY_MAX = 300.0
+# Tempo em que um job fica reservado para um worker antes de voltar para a fila
+JOB_LOCK_TIMEOUT = 300.0
+# Janela de agrupamento de textos recebidos em rajada (0 desativa) e máximo de jobs por grupo
+INBOUND_COALESCE_MS = float(os.getenv("INBOUND_COALESCE_MS", "0"))
+INBOUND_COALESCE_MAX = int(os.getenv("INBOUND_COALESCE_MAX", "10"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    shard_key TEXT,
+    tenant TEXT,
+    coalesce_key TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at REAL NOT NULL,
+    locked_until REAL NOT NULL DEFAULT 0,
+    locked_by TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_next_run_at ON jobs (next_run_at);
+CREATE INDEX IF NOT EXISTS jobs_shard_key ON jobs (shard_key, id);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    tenant TEXT,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+def _owner_gone(owner: str) -> bool:
+    """O processo dono da reserva (`host:pid`) não existe mais. Só é possível saber no mesmo host."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # Reserva deste mesmo processo, feita antes de a fila ser reaberta
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+class Job:
+    __slots__ = ("id", "source", "payload", "attempts", "tenant", "followers")
+
+    def __init__(self, id: int, source: str, payload: str, attempts: int, tenant: str | None = None):
+        self.id = id
+        self.source = source
+        self.payload = payload
+        self.attempts = attempts
+        self.tenant = tenant
+        # Jobs seguintes do mesmo shard, agrupados com este (mesma chave de agrupamento)
+        self.followers: list[Job] = []
+
+    @property
+    def batch(self) -> list["Job"]:
+        """Este job e os agrupados com ele: confirmados, repetidos ou descartados juntos."""
+        return [self] + self.followers
+
+
+def _placeholders(jobs: list[Job]) -> str:
+    return ", ".join("?" * len(jobs))
+
+
+class JobQueue:
+    """Fila persistente em SQLite. As operações rodam em thread para não bloquear o event loop."""
+
+    def __init__(self, path: str = QUEUE_DB_PATH, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        # Dono das reservas: vários workers do uvicorn (ou réplicas) podem compartilhar o mesmo banco
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def open(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Evento do event loop em que a fila é aberta
+        self._wakeup = asyncio.Event()
+        # Bancos criados antes das colunas shard_key e tenant
+        for table, column in (("jobs", "shard_key"), ("jobs", "tenant"), ("jobs", "coalesce_key"),
+                              ("jobs", "locked_by"), ("dead_letters", "tenant")):
+            if self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone():
+                columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+        self._conn.executescript(SCHEMA)
+        # Jobs reservados por um processo que caiu, neste mesmo host, voltam imediatamente para a fila.
+        # Os de processos vivos (outros workers) continuam reservados; os de outros hosts voltam
+        # quando a reserva expira (JOB_LOCK_TIMEOUT).
+        owners = self._conn.execute("SELECT DISTINCT locked_by FROM jobs WHERE locked_until > ?",
+                                    (time.time(),)).fetchall()
+        for (owner,) in owners:
+            if owner is None or _owner_gone(owner):
+                self._conn.execute("UPDATE jobs SET locked_until = 0 WHERE locked_by IS ?", (owner,))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def put(self, source: str, payload: str, shard_key: str | None = None, tenant: str | None = None,
+                  delay: float = 0.0, coalesce_key: str | None = None) -> int:
+        """Grava o job. Com `delay`, ele só fica disponível depois desse prazo (segundos)."""
+        now = time.time()
+        def insert():
+            with self._lock:
+                return self._conn.execute(
+                    "INSERT INTO jobs (source, payload, shard_key, tenant, coalesce_key, next_run_at, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (source, payload, shard_key, tenant, coalesce_key, now + delay, now),
+                ).lastrowid
+        job_id = await asyncio.to_thread(insert)
+        self._wakeup.set()
+        if delay:
+            # Acorda os workers quando o job adiado ficar disponível (sem esperar a próxima varredura)
+            asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+        return job_id
+
+    async def release(self, shard_key: str):
+        """Fecha a janela de agrupamento do shard: os jobs adiados ficam disponíveis agora."""
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET next_run_at = ? WHERE shard_key = ? AND next_run_at > ? AND attempts = 0",
+            (now, shard_key, now),
+        )
+        self._wakeup.set()
+
+    async def claim(self, coalesce_max: int = 1) -> Job | None:
+        """Reserva o próximo job disponível: o mais antigo cujo horário de execução já chegou e que
+        não tenha nenhum job anterior do mesmo shard pendente (em execução ou aguardando nova tentativa).
+        Com `coalesce_max` > 1, leva junto (em job.followers) os jobs seguintes do mesmo shard com a
+        mesma chave de agrupamento, até o primeiro que não a tenha."""
+        now = time.time()
+        rows = await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET locked_until = ?, locked_by = ? WHERE id = ("
+            " SELECT j.id FROM jobs j WHERE j.next_run_at <= ? AND j.locked_until <= ?"
+            " AND NOT EXISTS (SELECT 1 FROM jobs k WHERE k.shard_key = j.shard_key AND k.id < j.id)"
+            " ORDER BY j.id LIMIT 1"
+            ") RETURNING id, source, payload, attempts, tenant, shard_key, coalesce_key",
+            (now + JOB_LOCK_TIMEOUT, self.owner, now, now),
+        )
+        if not rows:
+            return None
+        *fields, shard_key, coalesce_key = rows[0]
+        job = Job(*fields)
+        if coalesce_key is not None and shard_key is not None and coalesce_max > 1:
+            # Os seguintes não podem ser reservados por outro worker: este job ainda está na frente do shard
+            following = await asyncio.to_thread(
+                self._execute,
+                "SELECT id, source, payload, attempts, tenant, coalesce_key FROM jobs"
+                " WHERE shard_key = ? AND id > ? ORDER BY id LIMIT ?",
+                (shard_key, job.id, coalesce_max - 1),
+            )
+            for *fields, key in following:
+                if key != coalesce_key:
+                    break
+                job.followers.append(Job(*fields))
+        return job
+
+    async def ack(self, job: Job):
+        batch = job.batch
+        await asyncio.to_thread(self._execute, f"DELETE FROM jobs WHERE id IN ({_placeholders(batch)})",
+                                tuple(item.id for item in batch))
+        # Libera o próximo job do mesmo shard para os workers ociosos
+        self._wakeup.set()
+
+    async def retry(self, job: Job, error: str) -> bool:
+        """Reagenda o job (com os agrupados a ele) com backoff exponencial ou o move para a dead-letter
+        após o limite de tentativas. O grupo falhou junto e passa a contar as tentativas do mais tentado.
+        Retorna True se os jobs foram para a dead-letter."""
+        batch = job.batch
+        ids = tuple(item.id for item in batch)
+        previous = max(item.attempts for item in batch)
+        attempts = previous + 1
+        if attempts >= self.max_attempts:
+            def move_to_dead_letter():
+                with self._lock:
+                    self._conn.execute("BEGIN")
+                    self._conn.execute(
+                        "INSERT INTO dead_letters (id, source, payload, tenant, attempts, error, created_at, failed_at)"
+                        f" SELECT id, source, payload, tenant, ?, ?, created_at, ? FROM jobs WHERE id IN ({_placeholders(batch)})",
+                        (attempts, error, time.time()) + ids,
+                    )
+                    self._conn.execute(f"DELETE FROM jobs WHERE id IN ({_placeholders(batch)})", ids)
+                    self._conn.execute("COMMIT")
+            await asyncio.to_thread(move_to_dead_letter)
+            metrics.EVENTS_DEAD_LETTERED.labels(job.source).inc(len(batch))
+            logger.error("Job %s (%s) movido para a dead-letter após %s tentativas: %s", ", ".join(map(str, ids)),
+                         job.source, attempts, error)
+            return True
+
+        delay = min(JOB_RETRY_BASE * 2 ** previous, JOB_RETRY_MAX)
+        await asyncio.to_thread(
+            self._execute,
+            f"UPDATE jobs SET attempts = ?, next_run_at = ?, locked_until = 0 WHERE id IN ({_placeholders(batch)})",
+            (attempts, time.time() + delay) + ids,
+        )
+        logger.warning("Job %s (%s) falhou (tentativa %s). Nova tentativa em %.0fs: %s", ", ".join(map(str, ids)),
+                       job.source, attempts, delay, error)
+        return False
+
+    async def postpone(self, job: Job, delay: float, reason: str):
+        """Reagenda o job sem contar tentativa: a chamada nem chegou ao upstream (circuito aberto)."""
+        batch = job.batch
+        await asyncio.to_thread(
+            self._execute,
+            f"UPDATE jobs SET next_run_at = ?, locked_until = 0 WHERE id IN ({_placeholders(batch)})",
+            (time.time() + delay,) + tuple(item.id for item in batch),
+        )
+        logger.debug("Job %s (%s) adiado por %.0fs: %s", job.id, job.source, delay, reason)
+
+    async def depth(self) -> int:
+        rows = await asyncio.to_thread(self._execute, "SELECT COUNT(*) FROM jobs")
+        return rows[0][0]
+
+    async def dead_letter_count(self) -> int:
+        rows = await asyncio.to_thread(self._execute, "SELECT COUNT(*) FROM dead_letters")
+        return rows[0][0]
+
+    async def wait(self, timeout: float):
+        """Aguarda um novo job ou o fim do timeout (para reavaliar jobs agendados)."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+
+def record_result(source: str, result: dict):
+    """Contabiliza o resultado devolvido pelo handler ({"status": ..., "reason": ...})."""
+    status = result.get("status")
+    if status == "ignored":
+        metrics.EVENTS_IGNORED.labels(source, result.get("reason", "")).inc()
+    elif status == "error":
+        metrics.EVENTS_FAILED.labels(source).inc()
+    else:
+        metrics.EVENTS_SUCCEEDED.labels(source).inc()
+
+
+class WorkerPool:
+    """Workers assíncronos que consomem a fila e despacham cada job para o handler da sua origem.
+    `dead_letter_handlers` (por origem) são avisados quando um job desiste: (payload, tenant, erro).
+    `batch_handlers` (por origem) recebem os payloads de um grupo de jobs agrupados: (payloads, tenant)."""
+
+    def __init__(self, queue: JobQueue, handlers: dict, size: int = JOB_WORKERS,
+                 dead_letter_handlers: dict | None = None, batch_handlers: dict | None = None,
+                 coalesce_max: int = INBOUND_COALESCE_MAX):
+        self.queue = queue
+        self.handlers = handlers
+        self.dead_letter_handlers = dead_letter_handlers or {}
+        self.batch_handlers = batch_handlers or {}
+        self.coalesce_max = coalesce_max if self.batch_handlers else 1
+        self.size = size
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.size)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, worker_id: int):
+        while True:
+            try:
+                job = await self.queue.claim(self.coalesce_max)
+            except Exception as e:
+                logger.error("Erro no worker %s ao ler a fila: %s", worker_id, e)
+                await asyncio.sleep(1)
+                continue
+            if job is None:
+                await self.queue.wait(1.0)
+                continue
+            if job.followers and job.source not in self.batch_handlers:
+                job.followers = []
+            try:
+                with metrics.JOBS_IN_FLIGHT.track_inprogress(), \
+                        metrics.STAGE_LATENCY.labels(f"process_{job.source}").time():
+                    if job.followers:
+                        payloads = [job.payload] + [follower.payload for follower in job.followers]
+                        result = await self.batch_handlers[job.source](payloads, job.tenant) or {}
+                    else:
+                        result = await self.handlers[job.source](job.payload, job.tenant) or {}
+                await self.queue.ack(job)
+                for _ in range(1 + len(job.followers)):
+                    record_result(job.source, result)
+            except asyncio.CancelledError:
+                raise
+            except CircuitOpenError as e:
+                await self.queue.postpone(job, e.retry_after, str(e))
+            except Exception as e:
+                metrics.EVENTS_FAILED.labels(job.source).inc(len(job.batch))
+                if await self.queue.retry(job, str(e)) and job.source in self.dead_letter_handlers:
+                    for item in job.batch:
+                        await self._dead_lettered(item, str(e))
+
+    async def _dead_lettered(self, job: Job, error: str):
+        try:
+            await self.dead_letter_handlers[job.source](job.payload, job.tenant, error)
+        except Exception as e:
+            logger.error("Erro ao tratar o job %s (%s) movido para a dead-letter: %s", job.id, job.source, e)
@@ -0,0 +1,31 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+# --- Locks por chave (single-flight) ---
+
+
+class KeyedLock:
+    """Um asyncio.Lock por chave, criado sob demanda e descartado quando ninguém mais o usa.
+    Garante que apenas uma tarefa por chave (ex.: um número de telefone) execute o trecho protegido."""
+
+    def __init__(self):
+        self._locks: dict = {}
+        self._waiters: dict = {}
+
+    @asynccontextmanager
+    async def hold(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
@@ -0,0 +1,73 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# --- Logging estruturado (JSON por linha) e não bloqueante ---
+# Os handlers da aplicação apenas enfileiram o registro (QueueHandler); a formatação e a
+# escrita em stdout acontecem em uma thread separada (QueueListener), fora do event loop.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fração dos payloads de webhook registrados em nível DEBUG (0 = nenhum, 1 = todos)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+
+# Atributos padrão de LogRecord, que não devem ser repetidos como campos extras
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Uma linha JSON por registro; campos passados em `extra=` viram chaves do objeto."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Configura o logger 'ricard_zap' uma única vez (chamadas repetidas são ignoradas)."""
+    global _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JSONFormatter())
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger("ricard_zap")
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(f"ricard_zap.{name}")
+
+
+def log_payload(logger: logging.Logger, label: str, payload: str):
+    """Registra o payload bruto de um webhook em DEBUG, por amostragem e truncado."""
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    truncated = len(payload) > LOG_PAYLOAD_MAX_CHARS
+    logger.debug("%s", label, extra={"payload": payload[:LOG_PAYLOAD_MAX_CHARS], "truncated": truncated})
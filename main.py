@@ -1,451 +1,739 @@
-import os
-import sys
-from fastapi import FastAPI, Request, HTTPException
-import requests
-import json
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from dotenv import load_dotenv
 import re
+import io
+import json
+from datetime import datetime
+from urllib.parse import unquote, urlsplit
 
 # Carrega as variáveis de ambiente do arquivo .env no início de tudo
+# (antes dos módulos da ponte, que leem suas configurações na importação)
 load_dotenv()
 
-# --- Diagnóstico e Validação das Variáveis de Ambiente ---
-print("--- Verificando Variáveis de Ambiente na Inicialização ---")
-
-VARS_TO_CHECK = {
-    "CHATWOOT_URL": os.getenv("CHATWOOT_URL"),
-    "CHATWOOT_ACCOUNT_ID": os.getenv("CHATWOOT_ACCOUNT_ID"),
-    "CHATWOOT_INBOX_ID": os.getenv("CHATWOOT_INBOX_ID"),
-    "CHATWOOT_API_TOKEN": os.getenv("CHATWOOT_API_TOKEN"),
-    "WUZAPI_API_URL": os.getenv("WUZAPI_API_URL"),
-    "WUZAPI_API_TOKEN": os.getenv("WUZAPI_API_TOKEN"),
-    "WUZAPI_INSTANCE_NAME": os.getenv("WUZAPI_INSTANCE_NAME"),
-}
-
-missing_vars = []
-for var_name, value in VARS_TO_CHECK.items():
-    if not value:
-        print(f"❌ ERRO: Variável de ambiente '{var_name}' NÃO ENCONTRADA.")
-        missing_vars.append(var_name)
-    else:
-        if "TOKEN" in var_name:
-            print(f"✅ OK: Variável '{var_name}' carregada (termina com '...{value[-4:]}').")
-        else:
-            print(f"✅ OK: Variável '{var_name}' carregada com o valor: {value}")
-
-print("----------------------------------------------------")
-
-if missing_vars:
-    print(f"ERRO CRÍTICO: A aplicação não pode iniciar porque as seguintes variáveis de ambiente obrigatórias estão faltando: {', '.join(missing_vars)}")
-    print("Por favor, configure-as no seu ambiente (EasyPanel, arquivo .env, etc.) e reinicie a aplicação.")
-    sys.exit(1)
-
-# Atribuição das variáveis após a validação bem-sucedida
-CHATWOOT_URL = VARS_TO_CHECK["CHATWOOT_URL"]
-CHATWOOT_ACCOUNT_ID = VARS_TO_CHECK["CHATWOOT_ACCOUNT_ID"]
-CHATWOOT_INBOX_ID = VARS_TO_CHECK["CHATWOOT_INBOX_ID"]
-CHATWOOT_API_TOKEN = VARS_TO_CHECK["CHATWOOT_API_TOKEN"]
-WUZAPI_API_URL = VARS_TO_CHECK["WUZAPI_API_URL"]
-WUZAPI_API_TOKEN = VARS_TO_CHECK["WUZAPI_API_TOKEN"]
-WUZAPI_INSTANCE_NAME = VARS_TO_CHECK["WUZAPI_INSTANCE_NAME"]
-
-def get_chatwoot_headers(is_file_upload: bool = False) -> dict:
-    """Gera os cabeçalhos padrão para as requisições à API do Chatwoot."""
-    headers = {
-        'api_access_token': CHATWOOT_API_TOKEN
-    }
-    if not is_file_upload:
-        headers['Content-Type'] = 'application/json'
-    return headers
-
-# Cria a aplicação FastAPI
-app = FastAPI(title="Ponte Ricard-ZAP", version="1.0.0")
-
-# --- Variáveis e Funções para WuzAPI (Envio) ---
-WUZAPI_INSTANCE_NAME = os.getenv("WUZAPI_INSTANCE_NAME")
-WUZAPI_API_URL = os.getenv("WUZAPI_API_URL")
-WUZAPI_API_TOKEN = os.getenv("WUZAPI_API_TOKEN")
-
-# Função para enviar mensagens de texto via WuzAPI (CORRIGIDO CONFORME DOCUMENTAÇÃO)
-def send_message_via_wuzapi(phone_number: str, message: str):
-    """Envia uma mensagem de texto para um número de telefone usando a WuzAPI."""
-    if not all([WUZAPI_API_URL, WUZAPI_API_TOKEN]):
-        print("ERRO: Variáveis da WuzAPI não configuradas para enviar mensagem.")
-        return
+import events
+import media
+import metrics
+from clients import ChatwootNotFoundError, MediaClient
+from dedup import DedupIndex
+from events import BACKFILL_ATTRIBUTE, ChatwootEvent, WuzAPIEvent
+from groups import is_group_jid
+from health import WARMUP_TIMEOUT, Readiness
+from idmap import IdMap
+from jobqueue import INBOUND_COALESCE_MS, JobQueue, WorkerPool
+from logs import get_logger, log_payload
+from scheduler import PRIORITY_BOT, PRIORITY_HUMAN
+from state import create_backend
+from tenants import TENANTS_FILE, Tenant, TenantConfigError, TenantRegistry
+
+logger = get_logger("main")
+
+# Estado compartilhado entre workers/réplicas (memory:// por padrão, ou redis://)
+state = create_backend()
+
+# Índice local de IDs (telefone/JID -> contato e conversa), preservado entre reinícios
+id_map = IdMap()
+
+# --- Tenants: cada um com seus clientes HTTP, caches e limites de envio ---
+tenants = TenantRegistry(state=state, ids=id_map)
+# Downloads por URL absoluta não levam credenciais: um pool compartilhado por todos os tenants
+media_client = MediaClient()
+
+# --- Fila durável de eventos e pool de workers ---
+job_queue = JobQueue()
+# IDs de mensagens já recebidas (WuzAPI e Chatwoot reentregam eventos)
+dedup_index = DedupIndex(state=state)
+# Prontidão do worker (GET /readyz)
+readiness = Readiness(tenants, job_queue)
+
+# Nada é validado nem conectado na importação: a configuração é conferida, e as conexões e caches
+# aquecidos, no lifespan. Só depois do aquecimento o /readyz passa a responder 200.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        tenants.load()
+    except TenantConfigError as e:
+        logger.error("A aplicação não pode iniciar: %s. Configure-as no seu ambiente (EasyPanel, arquivo .env, "
+                     "etc.) ou em TENANTS_FILE e reinicie a aplicação.", e)
+        raise
+    logger.info("Tenants configurados %s: %s", f"pelo arquivo {TENANTS_FILE}" if TENANTS_FILE
+                else "pelas variáveis de ambiente", ", ".join(tenant.id for tenant in tenants))
+    job_queue.open()
+    dedup_index.open()
+    id_map.open()
+    id_map.start()
+    workers = WorkerPool(job_queue, {"wuzapi": process_wuzapi_event, "chatwoot": process_chatwoot_event},
+                         dead_letter_handlers={"chatwoot": report_chatwoot_failure, "wuzapi": discard_wuzapi_media},
+                         batch_handlers={"wuzapi": process_wuzapi_batch})
+    tenants.start()
+    workers.start()
+    await warm_up()
+    readiness.warm = True
+    yield
+    readiness.warm = False
+    await workers.stop()
+    # Para agendadores e avatares, aplica os recibos pendentes e fecha as conexões keep-alive de cada tenant
+    await tenants.stop()
+    await id_map.stop()
+    id_map.close()
+    dedup_index.close()
+    job_queue.close()
+    await media_client.aclose()
+    await state.close()
+
+async def warm_up():
+    """Abre as conexões keep-alive com os upstreams (pela sondagem de prontidão) e carrega no cache
+    de resolução as entradas recentes do índice de IDs. Falhas não impedem a inicialização: o
+    /readyz continua refletindo os upstreams inacessíveis."""
+    try:
+        with metrics.STAGE_LATENCY.labels("warmup").time():
+            result, *_ = await asyncio.wait_for(
+                asyncio.gather(readiness.refresh(), *(tenant.warm() for tenant in tenants)), WARMUP_TIMEOUT)
+        logger.info("Aquecimento concluído: upstreams %s, fila %s", result["upstreams"], result["queue_depth"])
+    except Exception as e:
+        logger.warning("Aquecimento incompleto: %s", repr(e))
 
-    # A documentação indica que o endpoint é /chat/send/text e é um POST
-    send_url = f"{WUZAPI_API_URL}/chat/send/text"
-    payload = {
-        "number": phone_number,
-        "text": message
-    }
-    # A autenticação é feita pelo header 'token'
-    headers = {
-        "Content-Type": "application/json",
-        "token": WUZAPI_API_TOKEN
-    }
 
-    try:
-        print(f"Enviando mensagem para {phone_number} via POST em {send_url}")
-        response = requests.post(send_url, headers=headers, json=payload, timeout=15)
-        response.raise_for_status()
-        print(f"Mensagem enviada com sucesso para {phone_number}.")
-    except requests.exceptions.RequestException as e:
-        print(f"ERRO ao enviar mensagem via WuzAPI para {phone_number}: {e}")
-        if e.response is not None:
-            print(f"Status da Resposta: {e.response.status_code}")
-            print(f"Corpo da Resposta: {e.response.text}")
+def create_app() -> FastAPI:
+    """Cria a aplicação FastAPI (usada por `uvicorn main:app` e `uvicorn --factory main:create_app`)."""
+    app = FastAPI(title="Ponte Ricard-ZAP", version="1.0.0", lifespan=lifespan)
+    app.include_router(router)
+    return app
 
-# --- FUNÇÕES DE INTERAÇÃO COM O CHATWOOT ---
 
-def search_contact(phone_number: str):
-    """Busca um contato no Chatwoot pelo número de telefone."""
-    # Remove o '+' se já existir para a busca
-    search_phone = phone_number.replace('+', '')
-    search_endpoint = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/contacts/search"
-    params = {'q': search_phone}
-    try:
-        print("--- Depuração da Requisição para o Chatwoot ---")
-        print(f"URL da Requisição: {search_endpoint}")
-        print(f"Cabeçalhos (Headers): {get_chatwoot_headers()}")
-        print(f"Parâmetros (Params): {params}")
-        print("---------------------------------------------")
-        response = requests.get(search_endpoint, headers=get_chatwoot_headers(), params=params)
-        response.raise_for_status()
-        data = response.json()
-        if data["meta"]["count"] > 0:
-            # Itera para encontrar a correspondência exata, pois a busca é ampla
-            for contact in data["payload"]:
-                if contact.get("phone_number", "").endswith(search_phone):
-                    print(f"Contato encontrado: ID {contact['id']} para o número {phone_number}")
-                    return contact
-        print(f"Nenhum contato encontrado para o número {phone_number}")
-        return None
-    except Exception as e:
-        print(f"Erro ao buscar contato com número {phone_number}: {e}")
-        return None
+router = APIRouter()
 
-def create_contact(name: str, phone_number: str, avatar_url: str | None = None):
-    """Cria um novo contato no Chatwoot."""
-    contact_endpoint = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/contacts"
-    if '@' not in phone_number and not phone_number.startswith('+'):
-        phone_number = f"+{phone_number}"
-        
-    payload = {
-        "inbox_id": CHATWOOT_INBOX_ID,
-        "name": name,
-        "phone_number": phone_number,
-    }
-    if avatar_url:
-        payload["avatar_url"] = avatar_url
-    try:
-        response = requests.post(contact_endpoint, headers=get_chatwoot_headers(), json=payload)
-        response.raise_for_status()
-        contact = response.json()["payload"]["contact"]
-        print(f"Contato criado: ID {contact['id']} para {name} ({phone_number})")
-        return contact
-    except Exception as e:
-        print(f"Erro ao criar contato para {name} ({phone_number}): {e}")
-        return None
+# --- FUNÇÕES DE INTERAÇÃO COM O CHATWOOT ---
 
-def search_or_create_contact(name: str, phone_number: str, avatar_url: str | None = None) -> int | None:
-    """Busca um contato e, se não encontrar, cria um novo. Atualiza o avatar se necessário. Retorna o ID."""
-    contact = search_contact(phone_number)
+async def search_or_create_contact(tenant: Tenant, name: str, phone_number: str | None,
+                                   group_jid: str | None = None) -> int | None:
+    """Busca um contato e, se não encontrar, cria um novo. Retorna o ID.
+    Grupos são contatos sem telefone, identificados pelo JID do grupo."""
+    if group_jid:
+        contact = await tenant.chatwoot.search_contact_by_identifier(group_jid)
+    else:
+        contact = await tenant.chatwoot.search_contact(phone_number)
     if contact:
-        contact_id = contact['id']
-        if avatar_url and contact.get("avatar_url") != avatar_url:
-            print(f"Contato {contact_id}: Avatar desatualizado. Atualizando...")
-            update_contact_avatar(contact_id, avatar_url)
-        return contact_id
+        return contact['id']
     
-    new_contact = create_contact(name, phone_number, avatar_url)
+    new_contact = await tenant.chatwoot.create_contact(name, phone_number, identifier=group_jid)
     if new_contact:
-        contact_id = new_contact['id']
-        if avatar_url:
-             update_contact_avatar(contact_id, avatar_url)
-        return contact_id
+        return new_contact['id']
     
     return None
 
-def find_or_create_conversation(contact_id: int):
-    """Busca uma conversa existente para o contato ou cria uma nova."""
-    conv_endpoint = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/contacts/{contact_id}/conversations"
-    try:
-        response = requests.get(conv_endpoint, headers=get_chatwoot_headers())
-        response.raise_for_status()
-        conversations = response.json()["payload"]
-        if conversations:
-            conv_id = conversations[0]['id']
-            print(f"Conversa encontrada: ID {conv_id} para o contato {contact_id}")
-            return conv_id
-        
-        print(f"Nenhuma conversa encontrada para o contato {contact_id}. Criando uma nova...")
-        create_conv_endpoint = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations"
-        payload = { "inbox_id": CHATWOOT_INBOX_ID, "contact_id": contact_id }
-        create_response = requests.post(create_conv_endpoint, headers=get_chatwoot_headers(), json=payload)
-        create_response.raise_for_status()
-        new_conv_id = create_response.json()['id']
-        print(f"Conversa criada: ID {new_conv_id} para o contato {contact_id}")
-        return new_conv_id
-        
-    except Exception as e:
-        print(f"Erro ao buscar ou criar conversa para o contato {contact_id}: {e}")
-        return None
-
-def send_message_to_conversation(conversation_id: int, message_content: str):
-    """Envia uma mensagem para uma conversa específica no Chatwoot."""
-    message_endpoint = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations/{conversation_id}/messages"
-    payload = {"content": message_content, "message_type": "incoming"}
-    try:
-        response = requests.post(message_endpoint, headers=get_chatwoot_headers(), json=payload)
-        response.raise_for_status()
-        print(f"Mensagem enviada com sucesso para a conversa {conversation_id}")
-        return response.json()
-    except Exception as e:
-        print(f"Erro ao enviar mensagem para a conversa {conversation_id}: {e}")
-        return None
-
-def get_conversation_phone_number(conversation_id: int) -> str | None:
-    conv_endpoint = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations/{conversation_id}"
-    try:
-        response = requests.get(conv_endpoint, headers=get_chatwoot_headers())
-        response.raise_for_status()
-        data = response.json()
-
-        meta_sender = data.get("meta", {}).get("sender", {}) or {}
-        phone = meta_sender.get("phone_number")
-        if phone:
-            print(f"Telefone encontrado em meta.sender para a conversa {conversation_id}: {phone}")
-            return phone
-
-        meta_contact = data.get("meta", {}).get("contact", {}) or {}
-        phone = meta_contact.get("phone_number")
-        if phone:
-            print(f"Telefone encontrado em meta.contact para a conversa {conversation_id}: {phone}")
-            return phone
-
-        contact = data.get("contact") or {}
-        if isinstance(contact, dict):
-            phone = contact.get("phone_number")
-            if phone:
-                print(f"Telefone encontrado em contact para a conversa {conversation_id}: {phone}")
-                return phone
-
-        print(f"Não foi possível encontrar phone_number na conversa {conversation_id}.")
-        return None
-    except Exception as e:
-        print(f"Erro ao buscar telefone da conversa {conversation_id}: {e}")
-        return None
+# --- Cache de resolução (um por tenant): telefone/JID -> contato e conversa no Chatwoot ---
+# Evita a busca ampla de contatos e a listagem de conversas a cada mensagem recebida.
+
+def phone_key(phone_number: str) -> str:
+    """Chave do cache: apenas os dígitos do número (sem '+', sufixo '@...' ou máscara)."""
+    return re.sub(r"\D", "", phone_number.split("@")[0])
+
+def group_key(group_jid: str) -> str:
+    """Chave do cache de um grupo (não colide com números de telefone)."""
+    return f"group:{group_jid.split('@')[0]}"
+
+def contact_key(phone_number: str | None, identifier: str | None = None) -> str | None:
+    """Chave do cache de um contato do Chatwoot: o JID do grupo (identifier) ou o número."""
+    if is_group_jid(identifier):
+        return group_key(identifier)
+    return phone_key(phone_number) if phone_number else None
+
+async def resolve_conversation(tenant: Tenant, name: str, phone_number: str | None, sender_raw: str,
+                               group_jid: str | None = None) -> tuple[int | None, int | None]:
+    """Retorna (contact_id, conversation_id) usando o cache; só consulta o Chatwoot no cache miss.
+    O avatar do contato é apenas agendado para o worker em segundo plano. Com `group_jid`, a
+    conversa é a do grupo."""
+    key = contact_key(phone_number, group_jid)
+    async with tenant.resolution_lock(key):
+        return await _resolve_conversation(tenant, key, name, phone_number, sender_raw, group_jid)
+
+async def _resolve_conversation(tenant: Tenant, key: str, name: str, phone_number: str | None, sender_raw: str,
+                                group_jid: str | None) -> tuple[int | None, int | None]:
+    cached = await tenant.get_resolution(key) or {}
+    contact_id = cached.get("contact_id")
+    conversation_id = cached.get("conversation_id")
+    metrics.cache_lookup("resolution", bool(contact_id and conversation_id))
+    if contact_id and conversation_id:
+        logger.debug("Cache: contato %s / conversa %s para %s", contact_id, conversation_id, key)
+        if not group_jid:
+            tenant.avatar_refresher.schedule(contact_id, sender_raw)
+        return contact_id, conversation_id
+
+    if contact_id:
+        try:
+            conversation_id = await tenant.chatwoot.find_or_create_conversation(contact_id)
+        except ChatwootNotFoundError:
+            # Contato do cache apagado ou mesclado no Chatwoot: descarta a entrada inteira e busca de novo
+            logger.debug("Cache: contato %s não existe mais. Resolvendo novamente...", contact_id)
+            await tenant.drop_resolution(key)
+            contact_id = None
+    if not contact_id:
+        contact_id = await search_or_create_contact(tenant, name, phone_number, group_jid)
+        if not contact_id:
+            return None, None
+        conversation_id = await tenant.chatwoot.find_or_create_conversation(contact_id)
+    if not group_jid:
+        tenant.avatar_refresher.schedule(contact_id, sender_raw)
+
+    resolution = {"contact_id": contact_id}
+    if conversation_id:
+        resolution["conversation_id"] = conversation_id
+    await tenant.set_resolution(key, resolution)
+    return contact_id, conversation_id
+
+async def update_resolution_cache(tenant: Tenant, event_name: str, data: dict) -> bool:
+    """Aquece ou invalida o cache a partir dos webhooks de contato/conversa do Chatwoot.
+    Retorna True se o evento foi tratado aqui."""
+    if event_name == "contact_updated":
+        key = contact_key(data.get("phone_number"), data.get("identifier"))
+        if key and data.get("id"):
+            cached = await tenant.get_resolution(key) or {}
+            if cached.get("contact_id") != data["id"]:
+                cached = {}
+            await tenant.set_resolution(key, {**cached, "contact_id": data["id"]})
+        return True
+
+    if event_name in ("conversation_created", "conversation_status_changed"):
+        sender = (data.get("meta") or {}).get("sender") or {}
+        key = contact_key(sender.get("phone_number"), sender.get("identifier"))
+        if not key or str(data.get("inbox_id")) != str(tenant.inbox_id):
+            return True
+        if data.get("status") == "resolved":
+            logger.debug("Cache: conversa %s resolvida, removendo a conversa da entrada %s", data.get('id'), key)
+            await tenant.drop_resolution(key, keep_contact=True)
+        elif sender.get("id") and data.get("id"):
+            await tenant.set_resolution(key, {"contact_id": sender["id"], "conversation_id": data["id"]})
+        return True
+
+    return False
 
-def update_contact_avatar(contact_id: int, avatar_url: str):
-    if not avatar_url:
-        print(f"Contato {contact_id}: Nenhuma URL de avatar fornecida.")
-        return
+# --- ENDPOINT DO WEBHOOK ---
+def parse_webhook_body(body: bytes) -> dict:
+    """Decodifica o corpo do webhook, que deve ser um objeto JSON."""
     try:
-        avatar_endpoint = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/contacts/{contact_id}"
-        payload = {"avatar_url": avatar_url}
-        upload_response = requests.put(avatar_endpoint, headers=get_chatwoot_headers(), json=payload)
-        upload_response.raise_for_status()
-        print(f"Contato {contact_id}: Avatar atualizado com sucesso!")
-    except Exception as e:
-        print(f"Erro ao atualizar avatar para o contato {contact_id}: {e}")
+        data = events.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Corpo do webhook não é um JSON válido.")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Corpo do webhook deve ser um objeto JSON.")
+    return data
+
+def ignored(source: str, reason: str) -> JSONResponse:
+    """Resposta (e métrica) de um webhook descartado antes da fila."""
+    logger.debug("Ignorando webhook (%s): %s", source, reason)
+    metrics.EVENTS_IGNORED.labels(source, reason).inc()
+    return JSONResponse({"status": "ignored", "reason": reason})
+
+def tenant_key(tenant: Tenant, key: str | None) -> str | None:
+    """Prefixa chaves de shard e de deduplicação com o tenant (IDs do Chatwoot se repetem entre contas)."""
+    return f"{tenant.id}:{key}" if key else None
+
+def unknown_tenant(source: str):
+    """Webhook sem tenant correspondente (com vários tenants, não há um padrão): recusado com 404."""
+    logger.warning("Webhook (%s) recusado: nenhum tenant corresponde ao evento.", source)
+    metrics.EVENTS_IGNORED.labels(source, "unknown tenant").inc()
+    raise HTTPException(status_code=404, detail="Tenant não encontrado para este webhook.")
+
+def wuzapi_tenant(request: Request, event: WuzAPIEvent, tenant_id: str | None = None) -> Tenant:
+    """Tenant de um webhook da WuzAPI: pelo caminho (/webhook/wuzapi/<tenant>) ou, sem ele,
+    pelo nome da instância no evento ou pelo token enviado no header/query 'token'."""
+    if tenant_id is not None:
+        tenant = tenants.get(tenant_id)
+    else:
+        token = request.headers.get("token") or request.query_params.get("token")
+        tenant = tenants.for_wuzapi(event.instance_name, token)
+    if tenant is None:
+        unknown_tenant("wuzapi")
+    return tenant
+
+def chatwoot_tenant(event: ChatwootEvent, tenant_id: str | None = None) -> Tenant:
+    """Tenant de um webhook do Chatwoot: pelo caminho (/webhook/chatwoot/<tenant>) ou pela conta/caixa do evento."""
+    if tenant_id is not None:
+        tenant = tenants.get(tenant_id)
+    else:
+        tenant = tenants.for_chatwoot(event.account_id, event.inbox_id)
+    if tenant is None:
+        unknown_tenant("chatwoot")
+    return tenant
+
+def wuzapi_shard_key(event: WuzAPIEvent) -> str | None:
+    """Shard de um evento da WuzAPI: o JID do remetente ou, em grupos, o do grupo (mensagens do
+    mesmo chat ficam em ordem)."""
+    jid = event.chat if event.is_group else event.sender
+    return f"wuzapi:{jid}" if jid else None
+
+def coalescible(event: WuzAPIEvent) -> bool:
+    """Texto simples (sem mídia), que pode ser agrupado com os seguintes do mesmo remetente."""
+    message = event.message
+    return bool(message.get("conversation") or message.get("body")) \
+        and not any(message.get(media_key) for media_key in media.WHATSAPP_MEDIA_TYPES)
+
+def wuzapi_message_id(event: WuzAPIEvent) -> str | None:
+    """ID da mensagem do WhatsApp (Info.ID), usado na deduplicação."""
+    return f"wuzapi:{event.message_id}" if event.message_id else None
+
+def chatwoot_message_id(event: ChatwootEvent) -> str | None:
+    """ID da mensagem do Chatwoot (apenas em message_created), usado na deduplicação."""
+    if event.event == "message_created" and event.id:
+        return f"chatwoot:{event.id}"
+    return None
 
-# --- ENDPOINT DO WEBHOOK ---
-# Função para buscar a foto do perfil na WuzAPI (CORRIGIDO CONFORME DOCUMENTAÇÃO)
-def get_wuzapi_profile_pic(phone_number_raw: str) -> str | None:
-    """Busca a URL da foto de perfil de um contato na WuzAPI usando o número completo (com @s.whatsapp.net)."""
-    if not all([WUZAPI_API_URL, WUZAPI_API_TOKEN]):
-        print("AVISO: Variáveis da WuzAPI não configuradas para buscar foto de perfil.")
-        return None
-    
+async def is_duplicate(message_id: str | None, source: str) -> bool:
+    """Consulta (e alimenta) o índice de deduplicação com o ID da mensagem, quando houver."""
+    if not message_id:
+        return False
+    with metrics.STAGE_LATENCY.labels("dedup").time():
+        duplicate = await dedup_index.seen(message_id)
+    metrics.cache_lookup("dedup", duplicate)
+    if duplicate:
+        logger.debug("Ignorando evento duplicado (%s): %s", source, message_id)
+        metrics.EVENTS_IGNORED.labels(source, "duplicate").inc()
+    return duplicate
+
+@asynccontextmanager
+async def forget_on_failure(message_id: str | None):
+    """Se o evento não chegar à fila (disco cheio, banco ocupado), desfaz a marca de deduplicação:
+    a reentrega do remetente é aceita em vez de descartada como duplicada."""
     try:
-        base_number = phone_number_raw.split("@")[0].replace("+", "")
-        headers = {"Content-Type": "application/json", "token": WUZAPI_API_TOKEN}
-        avatar_url = None
-
-        user_avatar_url = f"{WUZAPI_API_URL}/user/avatar"
-        print(f"Buscando foto de perfil via /user/avatar para: {base_number}")
-        response = requests.post(user_avatar_url, headers=headers, json={"phone": base_number})
-        if response.status_code == 200:
-            data = response.json()
-            results = data.get("results") or {}
-            avatar_url = results.get("url") or data.get("profileImage")
-
-        if not avatar_url:
-            legacy_url = f"{WUZAPI_API_URL}/chat/getProfilePic"
-            legacy_headers = {"Accept": "application/json", "token": WUZAPI_API_TOKEN}
-            print(f"Buscando foto de perfil via /chat/getProfilePic para: {phone_number_raw}")
-            legacy_response = requests.get(legacy_url, headers=legacy_headers, params={"number": phone_number_raw})
-            if legacy_response.status_code == 200:
-                legacy_data = legacy_response.json()
-                avatar_url = legacy_data.get("profileImage") or legacy_data.get("url")
-
-        if avatar_url:
-            print(f"URL do avatar encontrada: {avatar_url}")
-            return avatar_url
-
-        print("Foto de perfil não encontrada na resposta da WuzAPI.")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"ERRO ao buscar foto de perfil na WuzAPI: {e}")
-        if e.response is not None:
-            if e.response.status_code != 404:
-                 print(f"Status da Resposta: {e.response.status_code}")
-                 print(f"Corpo da Resposta: {e.response.text}")
+        yield
+    except Exception:
+        if message_id:
+            await dedup_index.forget(message_id)
+        raise
+
+def chatwoot_shard_key(event: ChatwootEvent) -> str | None:
+    """Shard de um evento do Chatwoot: o ID da conversa (respostas da mesma conversa ficam em ordem)."""
+    return f"chatwoot:{event.conversation_id}" if event.conversation_id else None
+
+@router.post("/webhook/wuzapi", status_code=202)
+@router.post("/webhook/wuzapi/{tenant_id}", status_code=202)
+async def handle_wuzapi_webhook(request: Request, tenant_id: str | None = None):
+    """Grava o evento da WuzAPI na fila durável e responde imediatamente. Eventos que a ponte
+    não trata são descartados aqui, sem passar pela fila."""
+    with metrics.WEBHOOKS_IN_FLIGHT.track_inprogress():
+        body = await request.body()
+        # Presença, histórico etc.: descartados sem decodificar o JSON
+        if not events.wuzapi_prefilter(body):
+            return ignored("wuzapi", "event type not handled")
+        event = WuzAPIEvent(parse_webhook_body(body))
+        tenant = wuzapi_tenant(request, event, tenant_id)
+        reason = event.ignore_reason()
+        if reason:
+            return ignored("wuzapi", reason)
+        if event.is_receipt:
+            # Recibos não passam pela fila: são agrupados por chat e aplicados a cada janela
+            if not tenant.receipts.add(event.chat, event.receipt_ids, event.receipt_state):
+                return ignored("wuzapi", "receipt state not handled")
+            metrics.EVENTS_RECEIVED.labels("wuzapi_receipt").inc()
+            return {"status": "accepted"}
+        shard_key = tenant_key(tenant, wuzapi_shard_key(event))
+        if event.is_presence:
+            # O cliente parou de digitar: fecha a janela de agrupamento do chat
+            if not INBOUND_COALESCE_MS:
+                return ignored("wuzapi", "presence without coalescing")
+            await job_queue.release(shard_key)
+            return {"status": "accepted"}
+        message_id = tenant_key(tenant, wuzapi_message_id(event))
+        if await is_duplicate(message_id, "wuzapi"):
+            return JSONResponse({"status": "ignored", "reason": "duplicate"})
+        # Rajadas de textos do mesmo remetente: o primeiro espera a janela e leva os seguintes junto;
+        # uma mídia fecha a janela na hora
+        delay, coalesce_key = 0.0, None
+        if INBOUND_COALESCE_MS:
+            if coalescible(event):
+                delay, coalesce_key = INBOUND_COALESCE_MS / 1000, event.sender
+            else:
+                await job_queue.release(shard_key)
+        async with forget_on_failure(message_id):
+            with metrics.STAGE_LATENCY.labels("enqueue").time():
+                payload = await spool_inline_media(event, body)
+                try:
+                    job_id = await job_queue.put("wuzapi", payload, shard_key, tenant.id, delay=delay,
+                                                 coalesce_key=coalesce_key)
+                except Exception:
+                    media.discard_inline_base64(event.raw.get("base64_file"))
+                    raise
+    metrics.EVENTS_RECEIVED.labels("wuzapi").inc()
+    return {"status": "queued", "job_id": job_id}
+
+
+async def spool_inline_media(event: WuzAPIEvent, body: bytes) -> str:
+    """Payload do job. A mídia em base64 no próprio webhook vai para um arquivo em MEDIA_INLINE_DIR e
+    sai do payload: a fila guarda só o caminho, e o arquivo é decodificado em blocos no processamento."""
+    inline = event.raw.get("base64")
+    if not inline or not isinstance(inline, str):
+        return body.decode("utf-8")
+    event.raw["base64_file"] = await asyncio.to_thread(media.save_inline_base64, inline)
+    del event.raw["base64"]
+    return json.dumps(event.data)
+
+
+def job_tenant(tenant_id: str | None) -> Tenant:
+    """Tenant de um job. Se ele foi removido da configuração, o job falha e acaba na dead-letter."""
+    tenant = tenants.get(tenant_id)
+    if tenant is None:
+        raise RuntimeError(f"Tenant '{tenant_id}' não está configurado.")
+    return tenant
+
+
+async def process_wuzapi_event(payload: str, tenant_id: str | None = None) -> dict:
+    """Processa um evento da WuzAPI retirado da fila. Levanta exceção em falhas recuperáveis (nova tentativa)."""
+    tenant = job_tenant(tenant_id)
+    event = WuzAPIEvent(events.loads(payload))
+    log_payload(logger, "Webhook recebido da WuzAPI", payload)
+    result = await forward_wuzapi_message(tenant, event)
+    if result["status"] == "ignored":
+        # Nada foi enviado ao Chatwoot: o arquivo da mídia gravado na entrada não será mais lido
+        media.discard_inline_base64(event.raw.get("base64_file"))
+    return result
+
+
+async def discard_wuzapi_media(payload: str, tenant_id: str | None, error: str):
+    """Evento da WuzAPI na dead-letter: apaga o arquivo da mídia gravado na entrada. Se o job for
+    reenfileirado, a mídia é baixada pela WuzAPI."""
+    media.discard_inline_base64(WuzAPIEvent(events.loads(payload)).raw.get("base64_file"))
+
+
+async def process_wuzapi_batch(payloads: list[str], tenant_id: str | None = None) -> dict:
+    """Processa uma rajada de textos do mesmo remetente (jobs agrupados) como uma única mensagem
+    no Chatwoot, uma linha por texto."""
+    tenant = job_tenant(tenant_id)
+    batch = [WuzAPIEvent(events.loads(payload)) for payload in payloads]
+    texts = [event.message.get("conversation") or event.message.get("body") for event in batch]
+    metrics.INBOUND_COALESCED.inc(len(batch) - 1)
+    return await forward_wuzapi_message(tenant, batch[0], content="\n".join(text for text in texts if text))
+
+
+def backfill_timestamp(info: dict) -> str | None:
+    """Data original da mensagem (Info.Timestamp) no formato dd/mm/aaaa hh:mm, para mensagens importadas."""
+    timestamp = info.get("Timestamp") or info.get("timestamp")
+    if not timestamp:
         return None
-
-@app.post("/webhook/wuzapi")
-async def handle_wuzapi_webhook(request: Request):
     try:
-        data = await request.json()
-        print("--- Webhook Recebido do Wuzapi ---")
-        print(json.dumps(data, indent=2))
-        print("------------------------------------")
-
-        # Compatibilidade com formatos aninhados em 'jsonData'
-        raw_data = data
-        if "jsonData" in data:
-            raw_data = data.get("jsonData", {})
-
-        event_type = raw_data.get("type")
-        event_data = raw_data.get("event", {})
-
-        # Processar apenas eventos de "Message"
-        if event_type != "Message":
-            print(f"Ignorando evento: tipo '{event_type}' não é 'Message'.")
-            return {"status": "ignored", "reason": f"Event type is {event_type}"}
-
-        info = event_data.get("Info", event_data) # Fallback para o próprio event_data
-        
-        sender_raw = info.get('SenderAlt') or info.get('Sender')
-        if not sender_raw:
-            print("Ignorando mensagem: Não foi possível determinar o remetente ('SenderAlt' ou 'Sender').")
-            return {"status": "ignored", "reason": "Could not determine sender"}
-
-        # Ignora atualizações de status
-        if "@broadcast" in sender_raw:
-            print("Ignorando evento de status broadcast.")
-            return {"status": "ignored", "reason": "status broadcast"}
-
-        chat_jid = info.get("Chat") or info.get("ChatJid") or event_data.get("Chat") or sender_raw
-        is_group = "@g.us" in chat_jid or info.get("IsGroup") is True or info.get("isGroup") is True
-
-        if is_group:
-            print("Ignorando mensagem: Chat de grupo não é suportado.")
-            return {"status": "ignored", "reason": "group chats not supported"}
-
+        if isinstance(timestamp, (int, float)):
+            return datetime.fromtimestamp(timestamp).strftime("%d/%m/%Y %H:%M")
+        return datetime.fromisoformat(str(timestamp).replace("Z", "+00:00")).strftime("%d/%m/%Y %H:%M")
+    except ValueError:
+        return str(timestamp)
+
+
+async def forward_wuzapi_message(tenant: Tenant, event: WuzAPIEvent, backfill: bool = False,
+                                 content: str | None = None) -> dict:
+    """Encaminha uma mensagem da WuzAPI para o Chatwoot. Com `backfill` (importação de histórico),
+    mensagens enviadas pelo próprio número entram como saída na conversa do destinatário, o conteúdo
+    leva a data original e a mensagem é marcada para não voltar ao WhatsApp pelo webhook do Chatwoot.
+    `content` substitui o texto da mensagem (textos agrupados)."""
+    # Eventos que não são mensagens, sem remetente e status (broadcast)
+    reason = event.type if event.is_receipt or event.is_presence else event.ignore_reason()
+    if reason:
+        logger.debug("Ignorando evento da WuzAPI: %s", reason)
+        return {"status": "ignored", "reason": reason}
+
+    raw_data = event.raw
+    info = event.info
+    sender_raw = event.sender
+    chat_jid = event.chat
+    is_group = event.is_group
+
+    from_me = backfill and event.is_from_me
+    group_jid = chat_jid if is_group else None
+    if is_group:
+        # Grupo: uma conversa por grupo, e cada mensagem leva o nome de quem enviou
+        contact_name = await tenant.groups.name(group_jid)
+        contact_identifier = None
+        sender_name = tenant.groups.participant_name(sender_raw, event.push_name)
+    else:
+        if from_me:
+            # Enviada pelo próprio número: a conversa é a do destinatário
+            sender_raw = chat_jid
         sender_phone = sender_raw.split('@')[0]
-        sender_name = info.get("PushName") or info.get("pushName", sender_phone)
+        sender_name = sender_phone if from_me else event.push_name or sender_phone
         contact_name = sender_name
         contact_identifier = sender_phone
-        
-        message_data = event_data.get("Message", event_data)
-        message_content = message_data.get("conversation") or message_data.get("body")
-        message_type = info.get("Type", "text")
-
-        if not message_content:
-            if message_type != "text":
-                message_content = f"[{message_type.capitalize()} recebida]"
-            else:
-                print("Ignorando mensagem: Conteúdo vazio.")
-                return {"status": "ignored", "reason": "empty message content"}
-
-        avatar_url = get_wuzapi_profile_pic(sender_raw)
-
-        contact_id = search_or_create_contact(contact_name, contact_identifier, avatar_url)
-        if not contact_id:
-            raise HTTPException(status_code=500, detail="Falha ao buscar ou criar contato no Chatwoot.")
+    
+    message_data = event.message
+    message_content = content or message_data.get("conversation") or message_data.get("body")
+    message_type = event.message_type
+
+    # Mídia (imagem, áudio, vídeo, documento, figurinha) é encaminhada como anexo
+    media_type, message_media = None, None
+    for media_key, whatsapp_media_type in media.WHATSAPP_MEDIA_TYPES.items():
+        if message_data.get(media_key):
+            media_type, message_media = whatsapp_media_type, message_data[media_key]
+            message_content = message_content or message_media.get("caption")
+            break
+
+    if not message_content and not message_media:
+        if message_type != "text":
+            message_content = f"[{message_type.capitalize()} recebida]"
+        else:
+            logger.debug("Ignorando mensagem: Conteúdo vazio.")
+            return {"status": "ignored", "reason": "empty message content"}
+
+    with metrics.STAGE_LATENCY.labels("resolve_conversation").time():
+        contact_id, conversation_id = await resolve_conversation(tenant, contact_name, contact_identifier,
+                                                                sender_raw, group_jid)
+    if not contact_id:
+        raise RuntimeError("Falha ao buscar ou criar contato no Chatwoot.")
+    if not conversation_id:
+        raise RuntimeError("Falha ao buscar ou criar conversa no Chatwoot.")
+
+    display_message_content = message_content
+    if is_group and not from_me:
+        display_message_content = f"{sender_name}: {message_content}" if message_content else sender_name
+    message_direction = "outgoing" if from_me else "incoming"
+    content_attributes = None
+    if backfill:
+        content_attributes = {BACKFILL_ATTRIBUTE: True}
+        original_date = backfill_timestamp(info)
+        if original_date:
+            display_message_content = f"[{original_date}] {display_message_content or ''}".rstrip()
+
+    async def deliver(conversation_id: int):
+        if message_media:
+            return await send_media_to_chatwoot(tenant, conversation_id, media_type, message_media, raw_data,
+                                                display_message_content, message_direction, content_attributes)
+        return await tenant.chatwoot.send_message_to_conversation(conversation_id, display_message_content,
+                                                                  message_direction, content_attributes)
 
-        conversation_id = find_or_create_conversation(contact_id)
+    try:
+        with metrics.STAGE_LATENCY.labels("send_to_chatwoot").time():
+            sent = await deliver(conversation_id)
+    except ChatwootNotFoundError:
+        # Conversa (ou contato) apagada no Chatwoot: invalida o cache e resolve novamente uma vez
+        logger.debug("Cache: conversa %s não existe mais. Resolvendo novamente...", conversation_id)
+        await tenant.drop_resolution(contact_key(contact_identifier, group_jid))
+        contact_id, conversation_id = await resolve_conversation(tenant, contact_name, contact_identifier, sender_raw,
+                                                                 group_jid)
         if not conversation_id:
-            raise HTTPException(status_code=500, detail="Falha ao buscar ou criar conversa no Chatwoot.")
-
-        display_message_content = f"{sender_name}: {message_content}" if is_group else message_content
-        send_message_to_conversation(conversation_id, display_message_content)
-        
-        print("Webhook processado com sucesso.")
-        return {"status": "success"}
-
-    except Exception as e:
-        print(f"Erro fatal ao processar o webhook: {e}")
-        raise HTTPException(status_code=500, detail=f"Erro interno no servidor da ponte: {e}")
+            raise RuntimeError("Falha ao buscar ou criar conversa no Chatwoot.")
+        sent = await deliver(conversation_id)
+    if sent is None:
+        raise RuntimeError(f"Falha ao enviar mensagem para a conversa {conversation_id} no Chatwoot.")
+    
+    if not backfill:
+        logger.info("Webhook processado com sucesso.", extra={"tenant": tenant.id, "conversation_id": conversation_id})
+    return {"status": "success"}
+
+
+async def fetch_whatsapp_media(tenant: Tenant, media_type: str, message_media: dict, raw_data: dict):
+    """Obtém o arquivo de uma mídia recebida: URL do S3 (quando a WuzAPI está configurada para isso),
+    base64 do webhook (gravado em disco na entrada, ou ainda no evento, na importação de histórico) ou,
+    por fim, o endpoint /chat/download<tipo>. Retorna (mimetype, arquivo)."""
+    mimetype = message_media.get("mimetype")
+    s3_url = (raw_data.get("s3") or {}).get("url")
+    if s3_url:
+        content_type, file = await media_client.download(s3_url)
+        return mimetype or content_type, file
+    inline_path = raw_data.get("base64_file")
+    if inline_path:
+        try:
+            file = await asyncio.to_thread(media.decode_inline_base64, inline_path)
+            return mimetype or raw_data.get("mimeType"), file
+        except FileNotFoundError:
+            logger.warning("Arquivo da mídia %s não encontrado; baixando pela WuzAPI.", inline_path)
+    elif raw_data.get("base64"):
+        inline = io.BytesIO(media.strip_data_url(raw_data["base64"]).encode("ascii"))
+        file = await asyncio.to_thread(media.decode_base64, inline)
+        return mimetype or raw_data.get("mimeType"), file
+    downloaded_mimetype, file = await tenant.wuzapi.download_media(media_type, message_media)
+    return mimetype or downloaded_mimetype, file
+
+async def send_media_to_chatwoot(tenant: Tenant, conversation_id: int, media_type: str, message_media: dict, raw_data: dict,
+                                 caption: str | None, message_type: str = "incoming",
+                                 content_attributes: dict | None = None):
+    """Baixa a mídia recebida e a envia como anexo para a conversa, sem carregá-la inteira na memória."""
+    try:
+        mimetype, file = await fetch_whatsapp_media(tenant, media_type, message_media, raw_data)
+    except media.MediaTooLargeError as e:
+        logger.warning("Mídia (%s) não encaminhada para a conversa %s: %s", media_type, conversation_id, e)
+        sent = await tenant.chatwoot.send_message_to_conversation(
+            conversation_id, caption or f"[{media_type.capitalize()} recebida (arquivo muito grande)]",
+            message_type, content_attributes)
+    else:
+        with file:
+            filename = media.attachment_filename(media_type, mimetype, message_media.get("fileName"))
+            sent = await tenant.chatwoot.send_attachment(conversation_id, caption, file, filename, mimetype,
+                                                         message_type, content_attributes)
+    if sent is not None:
+        # Entregue: o arquivo gravado na entrada não é mais necessário (nas novas tentativas, continua lá)
+        media.discard_inline_base64(raw_data.get("base64_file"))
+    return sent
 
 
-@app.post("/webhook-wuzapi")
+@router.post("/webhook-wuzapi", status_code=202)
 async def handle_wuzapi_webhook_compat(request: Request):
     return await handle_wuzapi_webhook(request)
 
 
 # Endpoint de teste
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"message": "Ponte Ricard-ZAP -> Chatwoot está no ar!"}
 
 
-# --- Webhook para Receber Mensagens do Chatwoot (para enviar ao WhatsApp) ---
-@app.post("/webhook/chatwoot")
-async def handle_chatwoot_webhook(request: Request):
-    """Recebe webhooks do Chatwoot e envia a mensagem para o cliente via WuzAPI."""
-    try:
-        data = await request.json()
-        print("--- Webhook Recebido do Chatwoot ---")
-        print(json.dumps(data, indent=2))
-
-        event_name = data.get("event")
-        if event_name and event_name != "message_created":
-            print(f"Ignorando webhook: Evento '{event_name}' diferente de 'message_created'.")
-            return {"status": "ignored", "reason": f"event is {event_name}"}
-
-        # Ignora mensagens privadas ou que não sejam de saída
-        if data.get("private") or data.get("message_type") != "outgoing":
-            print("Ignorando webhook: Mensagem privada ou não é de saída.")
-            return {"status": "ignored", "reason": "private or not outgoing message"}
-
-        # Ignora se não for uma mensagem de um agente (para evitar loops)
-        sender_type = data.get("sender", {}).get("type")
-        if sender_type not in ["agent_bot", "user"]:
-             print(f"Ignorando webhook: Remetente não é um agente (tipo: {sender_type}).")
-             return {"status": "ignored", "reason": "sender is not an agent"}
-
-        content = data.get("content")
-        conversation = data.get("conversation") or {}
-        conversation_id = conversation.get("id") or data.get("conversation_id")
-        contact_meta = conversation.get("meta", {}) or {}
-        sender_meta = contact_meta.get("sender", {}) or {}
-        contact = conversation.get("contact") or {}
-
-        contact_phone = (
-            sender_meta.get("phone_number")
-            or contact.get("phone_number")
-            or data.get("sender", {}).get("phone_number")
-        )
-
-        if not contact_phone and conversation_id:
-            contact_phone = get_conversation_phone_number(conversation_id)
-        
-        if not contact_phone:
-            print("ERRO: Não foi possível encontrar o número de telefone do contato no webhook do Chatwoot.")
-            return {"status": "error", "reason": "phone number not found"}
-
-        if "@" in contact_phone:
-            print("Ignorando webhook: Número do contato indica grupo e grupos não são suportados.")
-            return {"status": "ignored", "reason": "group chats not supported"}
+# Liveness: o processo responde (não consulta upstreams; reiniciar não resolveria uma queda deles)
+@router.get("/healthz")
+def healthz():
+    return {"status": "ok"}
 
-        destination = re.sub(r"\\D", "", contact_phone)
 
-        if not content:
-            print("Ignorando webhook: Conteúdo da mensagem está vazio.")
-            return {"status": "ignored", "reason": "empty content"}
+# Readiness: aquecido, upstreams acessíveis e fila abaixo do limite; 503 tira o worker do balanceamento
+@router.get("/readyz")
+async def readyz():
+    result = await readiness.check()
+    return JSONResponse(result, status_code=200 if result["ready"] else 503)
 
-        send_message_via_wuzapi(phone_number=destination, message=content)
 
-        return {"status": "success"}
+@router.get("/metrics")
+async def read_metrics():
+    """Métricas no formato de exposição do Prometheus."""
+    metrics.QUEUE_DEPTH.set(await job_queue.depth())
+    metrics.DEAD_LETTER_DEPTH.set(await job_queue.dead_letter_count())
+    metrics.set_outbound_state({tenant.id: tenant.outbound.state() for tenant in tenants})
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-    except Exception as e:
-        print(f"ERRO CRÍTICO ao processar webhook do Chatwoot: {e}")
-        return {"status": "error", "detail": str(e)}
 
+# --- Webhook para Receber Mensagens do Chatwoot (para enviar ao WhatsApp) ---
+@router.post("/webhook/chatwoot", status_code=202)
+@router.post("/webhook/chatwoot/{tenant_id}", status_code=202)
+async def handle_chatwoot_webhook(request: Request, tenant_id: str | None = None):
+    """Grava o evento do Chatwoot na fila durável e responde imediatamente. Eventos que a ponte
+    não trata (inclusive as mensagens que ela mesma cria no Chatwoot) são descartados aqui."""
+    with metrics.WEBHOOKS_IN_FLIGHT.track_inprogress():
+        body = await request.body()
+        # message_updated, digitação etc.: descartados sem decodificar o JSON
+        if not events.chatwoot_prefilter(body):
+            return ignored("chatwoot", "event not handled")
+        event = ChatwootEvent(parse_webhook_body(body))
+        tenant = chatwoot_tenant(event, tenant_id)
+        reason = event.ignore_reason()
+        if reason:
+            return ignored("chatwoot", reason)
+        message_id = tenant_key(tenant, chatwoot_message_id(event))
+        if await is_duplicate(message_id, "chatwoot"):
+            return JSONResponse({"status": "ignored", "reason": "duplicate"})
+        async with forget_on_failure(message_id):
+            with metrics.STAGE_LATENCY.labels("enqueue").time():
+                job_id = await job_queue.put("chatwoot", body.decode("utf-8"),
+                                             tenant_key(tenant, chatwoot_shard_key(event)), tenant.id)
+    metrics.EVENTS_RECEIVED.labels("chatwoot").inc()
+    return {"status": "queued", "job_id": job_id}
+
+
+async def process_chatwoot_event(payload: str, tenant_id: str | None = None) -> dict:
+    """Processa um evento do Chatwoot retirado da fila e envia a mensagem para o cliente via WuzAPI."""
+    tenant = job_tenant(tenant_id)
+    event = ChatwootEvent(events.loads(payload))
+    log_payload(logger, "Webhook recebido do Chatwoot", payload)
+
+    if await update_resolution_cache(tenant, event.event, event.data):
+        return {"status": "success", "reason": f"cache updated from {event.event}"}
+
+    # Outros eventos, mensagens privadas ou de entrada, importadas do histórico, de não agentes ou vazias
+    reason = event.ignore_reason()
+    if reason:
+        logger.debug("Ignorando webhook do Chatwoot: %s", reason)
+        return {"status": "ignored", "reason": reason}
+
+    content = event.content
+    attachments = event.attachments
+    sender_type = event.sender_type
+    conversation_id = event.conversation_id
+    # Conversas de grupo: o contato não tem telefone e a resposta vai para o JID do grupo
+    contact_phone = event.contact_identifier if is_group_jid(event.contact_identifier) else event.contact_phone
+
+    if not contact_phone and conversation_id:
+        contact_phone = await tenant.chatwoot.get_conversation_phone_number(conversation_id)
+    
+    if not contact_phone:
+        logger.error("Não foi possível encontrar o número de telefone do contato no webhook do Chatwoot.")
+        return {"status": "error", "reason": "phone number not found"}
+
+    if is_group_jid(contact_phone):
+        destination = contact_phone
+    elif "@" in contact_phone:
+        logger.debug("Ignorando webhook: JID do contato (%s) não é um número nem um grupo.", contact_phone)
+        return {"status": "ignored", "reason": "unsupported jid"}
+    else:
+        destination = re.sub(r"\\D", "", contact_phone)
 
-@app.post("/webhook-chatwoot")
+    # Respostas de agentes humanos passam na frente das de bots
+    priority = PRIORITY_HUMAN if sender_type == "user" else PRIORITY_BOT
+    with metrics.STAGE_LATENCY.labels("send_to_wuzapi").time():
+        if attachments:
+            sent = await tenant.outbound.submit(
+                destination, lambda: send_attachments_to_whatsapp(tenant, destination, content, attachments),
+                priority=priority, cost=len(attachments))
+        else:
+            sent = await tenant.outbound.submit(
+                destination, lambda: tenant.wuzapi.send_text(phone_number=destination, message=content),
+                priority=priority)
+    if not sent:
+        raise RuntimeError(f"Falha ao enviar mensagem via WuzAPI para {destination}.")
+
+    # Vínculo com as mensagens do WhatsApp, para os recibos de entrega e leitura
+    whatsapp_ids = whatsapp_message_ids(sent)
+    if whatsapp_ids and event.id and conversation_id:
+        await tenant.receipts.link(whatsapp_ids, conversation_id, event.id)
+    return {"status": "success"}
+
+
+def whatsapp_message_ids(sent) -> list[str]:
+    """IDs das mensagens no WhatsApp devolvidos por um envio (texto, ou a lista de envios dos anexos)."""
+    results = sent if isinstance(sent, list) else [sent]
+    return [result for result in results if isinstance(result, str)]
+
+
+async def report_chatwoot_failure(payload: str, tenant_id: str | None, error: str):
+    """Resposta de agente que não pôde ser entregue ao WhatsApp (job na dead-letter): marca a
+    mensagem como falha no Chatwoot."""
+    tenant = tenants.get(tenant_id)
+    event = ChatwootEvent(events.loads(payload))
+    if tenant is None or event.event not in (None, "message_created") or not event.id or not event.conversation_id:
+        return
+    await tenant.receipts.mark_failed(event.conversation_id, event.id, error)
+
+
+async def send_attachments_to_whatsapp(tenant: Tenant, destination: str, content: str | None,
+                                       attachments: list) -> list | bool:
+    """Envia os anexos de uma resposta do Chatwoot via WuzAPI. O texto vai como legenda do primeiro anexo
+    que aceita legenda; se o primeiro anexo for um áudio, o texto é enviado antes, separadamente.
+    Retorna o resultado de cada envio (IDs das mensagens no WhatsApp) ou False se algum falhou."""
+    results = []
+    first_type = media.CHATWOOT_MEDIA_TYPES.get(attachments[0].get("file_type"), "document")
+    if content and first_type == "audio":
+        sent = await tenant.wuzapi.send_text(phone_number=destination, message=content)
+        if not sent:
+            return False
+        results.append(sent)
+        content = None
+
+    for attachment in attachments:
+        media_type = media.CHATWOOT_MEDIA_TYPES.get(attachment.get("file_type"), "document")
+        data_url = attachment.get("data_url")
+        if not data_url:
+            continue
+        content_type, file = await media_client.download(data_url)
+        with file:
+            mimetype = (content_type or "application/octet-stream").split(";")[0]
+            filename = unquote(urlsplit(data_url).path.rsplit("/", 1)[-1]) or None
+            sent = await tenant.wuzapi.send_media(destination, media_type, file, mimetype, caption=content,
+                                                  filename=filename)
+            if not sent:
+                return False
+            results.append(sent)
+        content = None
+    return results or True
+
+
+@router.post("/webhook-chatwoot", status_code=202)
 async def handle_chatwoot_webhook_compat(request: Request):
     return await handle_chatwoot_webhook(request)
+
+
+app = create_app()
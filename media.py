@@ -0,0 +1,194 @@
+import base64
+import binascii
+import json
+import os
+import tempfile
+import uuid
+
+# --- Transferência de mídia em streaming ---
+# Os arquivos nunca ficam inteiros na memória: os bytes são lidos em blocos e gravados em um
+# SpooledTemporaryFile, que passa para o disco acima de MEDIA_SPOOL_MAX_MEMORY. O base64 exigido
+# pela WuzAPI é decodificado/codificado uma única vez, também em blocos.
+
+MEDIA_CHUNK_SIZE = 64 * 1024
+MEDIA_SPOOL_MAX_MEMORY = int(os.getenv("MEDIA_SPOOL_MAX_MEMORY", str(1024 * 1024)))
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(100 * 1024 * 1024)))
+# Mídias em base64 no próprio webhook da WuzAPI: gravadas aqui na entrada, a fila guarda só o caminho
+MEDIA_INLINE_DIR = os.getenv("MEDIA_INLINE_DIR", os.path.join(
+    os.path.dirname(os.getenv("QUEUE_DB_PATH", "data/queue.db")) or ".", "media"))
+
+# Tipos de mensagem de mídia do WhatsApp -> tipo usado nos endpoints da WuzAPI
+WHATSAPP_MEDIA_TYPES = {
+    "imageMessage": "image",
+    "stickerMessage": "image",
+    "audioMessage": "audio",
+    "videoMessage": "video",
+    "documentMessage": "document",
+}
+
+# file_type dos anexos do Chatwoot -> tipo usado nos endpoints da WuzAPI
+CHATWOOT_MEDIA_TYPES = {
+    "image": "image",
+    "audio": "audio",
+    "video": "video",
+    "file": "document",
+}
+
+DEFAULT_EXTENSIONS = {
+    "image": "jpg",
+    "audio": "ogg",
+    "video": "mp4",
+    "document": "bin",
+}
+
+
+# Bytes fora do alfabeto base64 (ex.: barras escapadas "\/" no JSON) são descartados antes de decodificar
+_BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+_NOT_BASE64 = bytes(b for b in range(256) if b not in _BASE64_ALPHABET)
+
+
+class MediaTooLargeError(Exception):
+    """O arquivo excede MEDIA_MAX_BYTES."""
+
+
+def new_spool():
+    return tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_MAX_MEMORY)
+
+
+def file_size(file) -> int:
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+async def spool_stream(chunks, max_bytes: int = MEDIA_MAX_BYTES):
+    """Grava um iterador assíncrono de bytes em um arquivo temporário e o devolve posicionado no início."""
+    spool = new_spool()
+    total = 0
+    try:
+        async for chunk in chunks:
+            total += len(chunk)
+            if total > max_bytes:
+                raise MediaTooLargeError(f"arquivo excede {max_bytes} bytes")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def decode_data_url(raw, max_bytes: int = MEDIA_MAX_BYTES) -> tuple[str | None, object]:
+    """Extrai o primeiro `data:<mime>;base64,<dados>` de um JSON já gravado em disco (resposta dos
+    endpoints /chat/download* da WuzAPI) e decodifica os dados em blocos para um novo arquivo temporário.
+    Retorna (mimetype, arquivo)."""
+    marker = b"data:"
+    buffer = b""
+    mimetype = None
+    # Localiza o prefixo data:<mime>;base64,
+    while True:
+        chunk = raw.read(MEDIA_CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("resposta sem data URL base64")
+        buffer += chunk
+        start = buffer.find(marker)
+        if start == -1:
+            buffer = buffer[-len(marker):]
+            continue
+        comma = buffer.find(b",", start)
+        if comma == -1:
+            buffer = buffer[start:]
+            continue
+        # O JSON pode escapar as barras ("image\/jpeg")
+        header = buffer[start + len(marker):comma].decode("ascii", "replace").replace("\\/", "/")
+        mimetype = header.split(";")[0] or None
+        buffer = buffer[comma + 1:]
+        break
+    return mimetype, decode_base64(raw, max_bytes, buffer)
+
+
+def decode_base64(raw, max_bytes: int = MEDIA_MAX_BYTES, buffer: bytes = b""):
+    """Decodifica em blocos, para um novo arquivo temporário, o base64 lido de `raw` (após `buffer`, já
+    lido) até o fim ou até a aspa que fecha a string JSON."""
+    decoded = new_spool()
+    total = 0
+    pending = b""
+    try:
+        while True:
+            end = buffer.find(b'"')
+            data = buffer if end == -1 else buffer[:end]
+            data = pending + data.translate(None, _NOT_BASE64)
+            usable = len(data) - len(data) % 4
+            if usable:
+                block = base64.b64decode(data[:usable])
+                total += len(block)
+                if total > max_bytes:
+                    raise MediaTooLargeError(f"arquivo excede {max_bytes} bytes")
+                decoded.write(block)
+            pending = data[usable:]
+            if end != -1:
+                break
+            buffer = raw.read(MEDIA_CHUNK_SIZE)
+            if not buffer:
+                break
+        if pending:
+            decoded.write(base64.b64decode(pending + b"=" * (-len(pending) % 4)))
+    except (binascii.Error, ValueError, MediaTooLargeError):
+        decoded.close()
+        raise
+    decoded.seek(0)
+    return decoded
+
+
+def strip_data_url(value: str) -> str:
+    """Só os dados de um base64 que pode vir como data URL completa (data:<mime>;base64,<dados>)."""
+    return value[value.find(",") + 1:] if value.startswith("data:") else value
+
+
+def save_inline_base64(value: str) -> str:
+    """Grava o base64 de uma mídia recebida no webhook em MEDIA_INLINE_DIR (sem decodificar).
+    Retorna o caminho do arquivo."""
+    value = strip_data_url(value)
+    os.makedirs(MEDIA_INLINE_DIR, exist_ok=True)
+    path = os.path.join(MEDIA_INLINE_DIR, f"{uuid.uuid4().hex}.b64")
+    with open(path, "w", encoding="ascii") as file:
+        file.write(value)
+    return path
+
+
+def decode_inline_base64(path: str, max_bytes: int = MEDIA_MAX_BYTES):
+    """Arquivo temporário com a mídia gravada por save_inline_base64, decodificada em blocos."""
+    with open(path, "rb") as raw:
+        return decode_base64(raw, max_bytes)
+
+
+def discard_inline_base64(path: str | None):
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def data_url_json_body(fields: dict, media_field: str, file, mimetype: str):
+    """Gera, em blocos, o corpo JSON `{...fields, media_field: "data:<mime>;base64,..."}` esperado pela WuzAPI.
+    O arquivo é codificado em base64 bloco a bloco (tamanho múltiplo de 3), sem montar o corpo inteiro."""
+    head = json.dumps(fields)[:-1]
+    separator = ", " if fields else ""
+    yield f'{head}{separator}"{media_field}": "data:{mimetype};base64,'.encode()
+    block_size = MEDIA_CHUNK_SIZE - MEDIA_CHUNK_SIZE % 3
+    while True:
+        block = file.read(block_size)
+        if not block:
+            break
+        yield base64.b64encode(block)
+    yield b'"}'
+
+
+def attachment_filename(media_type: str, mimetype: str | None, filename: str | None = None) -> str:
+    if filename:
+        return filename
+    extension = (mimetype or "").split("/")[-1].split(";")[0] or DEFAULT_EXTENSIONS[media_type]
+    return f"{media_type}.{extension}"
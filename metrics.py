@@ -0,0 +1,80 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# --- Métricas Prometheus da ponte (expostas em GET /metrics) ---
+
+# Buckets de latência (segundos): de chamadas rápidas em cache até timeouts de upstream
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+EVENTS_RECEIVED = Counter(
+    "bridge_events_received_total", "Webhooks recebidos e aceitos na fila", ["source"])
+EVENTS_IGNORED = Counter(
+    "bridge_events_ignored_total", "Eventos ignorados, por motivo", ["source", "reason"])
+EVENTS_SUCCEEDED = Counter(
+    "bridge_events_succeeded_total", "Eventos processados com sucesso", ["source"])
+EVENTS_FAILED = Counter(
+    "bridge_events_failed_total", "Tentativas de processamento que falharam", ["source"])
+EVENTS_DEAD_LETTERED = Counter(
+    "bridge_events_dead_lettered_total", "Eventos movidos para a dead-letter", ["source"])
+
+UPSTREAM_LATENCY = Histogram(
+    "bridge_upstream_request_seconds", "Latência das chamadas ao Chatwoot e à WuzAPI",
+    ["upstream", "endpoint"], buckets=LATENCY_BUCKETS)
+UPSTREAM_REQUESTS = Counter(
+    "bridge_upstream_requests_total", "Chamadas ao Chatwoot e à WuzAPI, por status HTTP",
+    ["upstream", "endpoint", "status"])
+UPSTREAM_IN_FLIGHT = Gauge(
+    "bridge_upstream_requests_in_flight", "Chamadas em andamento por upstream", ["upstream"])
+BREAKER_STATE = Gauge(
+    "bridge_circuit_breaker_state", "Estado do circuit breaker (0=fechado, 1=half-open, 2=aberto)",
+    ["upstream", "endpoint"])
+BREAKER_REJECTED = Counter(
+    "bridge_circuit_breaker_rejected_total", "Chamadas recusadas com o circuito aberto", ["upstream", "endpoint"])
+UPSTREAM_TIMEOUT = Gauge(
+    "bridge_upstream_timeout_seconds", "Timeout de leitura adaptativo em uso", ["upstream", "endpoint"])
+
+STAGE_LATENCY = Histogram(
+    "bridge_stage_seconds", "Latência de cada etapa do pipeline", ["stage"], buckets=LATENCY_BUCKETS)
+
+CACHE_LOOKUPS = Counter(
+    "bridge_cache_lookups_total", "Consultas aos caches (hit/miss); taxa de acerto = hit / total",
+    ["cache", "result"])
+
+QUEUE_DEPTH = Gauge("bridge_queue_depth", "Jobs pendentes na fila durável")
+DEAD_LETTER_DEPTH = Gauge("bridge_dead_letter_depth", "Jobs na tabela de dead-letter")
+JOBS_IN_FLIGHT = Gauge("bridge_jobs_in_flight", "Jobs em processamento pelos workers")
+WEBHOOKS_IN_FLIGHT = Gauge("bridge_webhooks_in_flight", "Requisições de webhook em andamento")
+TENANTS = Gauge("bridge_tenants", "Tenants (instâncias WuzAPI / caixas do Chatwoot) ativos")
+
+OUTBOUND_PENDING = Gauge(
+    "bridge_outbound_pending", "Envios para a WuzAPI aguardando o agendador, por prioridade", ["lane"])
+OUTBOUND_WAIT = Histogram(
+    "bridge_outbound_wait_seconds", "Tempo de espera no agendador de envios (limites de taxa)", ["lane"],
+    buckets=LATENCY_BUCKETS)
+OUTBOUND_SENDING = Gauge("bridge_outbound_sending", "Envios em andamento para a WuzAPI", ["tenant"])
+OUTBOUND_RECIPIENTS = Gauge(
+    "bridge_outbound_recipients", "Destinatários com token bucket ativo no agendador de envios", ["tenant"])
+OUTBOUND_GLOBAL_WAIT = Gauge(
+    "bridge_outbound_global_wait_seconds", "Espera até a próxima ficha do token bucket global", ["tenant"])
+INBOUND_COALESCED = Counter(
+    "bridge_inbound_coalesced_total", "Textos recebidos agrupados em uma única mensagem no Chatwoot")
+
+RECEIPT_UPDATES = Counter(
+    "bridge_receipt_updates_total", "Status de mensagens atualizados no Chatwoot (entregue, lida, falha)",
+    ["status"])
+RECEIPTS_COALESCED = Counter(
+    "bridge_receipts_coalesced_total", "Recibos absorvidos sem chamada ao Chatwoot (repetidos ou sem avanço)")
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def set_outbound_state(states: dict[str, dict]):
+    """Atualiza os gauges do agendador a partir de OutboundScheduler.state() de cada tenant
+    (tenants removidos deixam de aparecer)."""
+    for gauge in (OUTBOUND_SENDING, OUTBOUND_RECIPIENTS, OUTBOUND_GLOBAL_WAIT):
+        gauge.clear()
+    for tenant, state in states.items():
+        OUTBOUND_SENDING.labels(tenant).set(state["sending"])
+        OUTBOUND_RECIPIENTS.labels(tenant).set(state["recipients_tracked"])
+        OUTBOUND_GLOBAL_WAIT.labels(tenant).set(state["global_wait_seconds"])
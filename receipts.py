@@ -0,0 +1,160 @@
+import asyncio
+import os
+
+import metrics
+from breaker import CircuitOpenError
+from logs import get_logger
+from state import MemoryBackend, StateBackend
+
+logger = get_logger("receipts")
+
+# --- Recibos de entrega e leitura (WhatsApp -> status das mensagens no Chatwoot) ---
+# Cada resposta enviada pela ponte guarda o vínculo ID da mensagem no WhatsApp -> mensagem do
+# Chatwoot: um hash no backend de estado, com um campo por mensagem vinculada e um por status já
+# aplicado (processos diferentes gravam campos diferentes, sem ler e regravar o valor), e uma cópia
+# no índice local de IDs, que sobrevive a reinícios. Os recibos da WuzAPI (ReadReceipt) não passam pela fila: ficam em memória, agrupados
+# por chat, e a cada janela cada mensagem recebe no máximo uma atualização, com o status mais
+# avançado (entregue e lida na mesma janela viram uma única atualização "read"). Status que não
+# avançam (recibos repetidos, "delivered" depois de "read") não geram chamada ao Chatwoot.
+
+RECEIPT_WINDOW = float(os.getenv("RECEIPT_WINDOW", "3"))
+RECEIPT_LINK_TTL = float(os.getenv("RECEIPT_LINK_TTL", "604800"))
+RECEIPT_LINK_SIZE = int(os.getenv("RECEIPT_LINK_SIZE", "50000"))
+# Recibos pendentes (chats x mensagens) acima deste limite são descartados até a próxima janela
+RECEIPT_MAX_PENDING = 10000
+
+# Estado dos recibos da WuzAPI -> status da mensagem no Chatwoot, em ordem crescente
+RECEIPT_STATUSES = {"Delivered": "delivered", "Read": "read"}
+STATUS_RANK = {"sent": 0, "delivered": 1, "read": 2}
+RANK_STATUS = {rank: status for status, rank in STATUS_RANK.items()}
+
+
+class ReceiptTracker:
+    """Vínculos WhatsApp -> Chatwoot (no backend de estado, quando compartilhado, e no índice local
+    `ids`) e recibos pendentes por chat, aplicados em lote a cada `window` segundos."""
+
+    def __init__(self, chatwoot, state: StateBackend | None = None, key_prefix: str = "receipt:",
+                 window: float = RECEIPT_WINDOW, ids=None):
+        self.chatwoot = chatwoot
+        self.ids = ids
+        # Sem backend compartilhado, os vínculos têm seu próprio cache (não disputam espaço com o
+        # cache de resolução do tenant)
+        self.state = state if state is not None and state.shared else MemoryBackend(maxsize=RECEIPT_LINK_SIZE)
+        self.key_prefix = key_prefix
+        self.window = window
+        # chat -> {ID da mensagem no WhatsApp: status}
+        self._pending: dict[str, dict[str, str]] = {}
+        self._size = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Para a tarefa e aplica os recibos da janela em andamento (deploys não os descartam)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def link(self, whatsapp_ids: list[str], conversation_id: int, message_id: int):
+        """Registra que as mensagens do WhatsApp enviadas (uma por anexo) correspondem à mensagem do Chatwoot."""
+        for whatsapp_id in whatsapp_ids:
+            await self.state.set_fields(self._key(whatsapp_id), {f"m:{conversation_id}:{message_id}": "1"},
+                                        RECEIPT_LINK_TTL)
+            if self.ids is not None:
+                self.ids.link_receipt(whatsapp_id, conversation_id, message_id)
+
+    def _key(self, whatsapp_id: str) -> str:
+        return f"{self.key_prefix}link:{whatsapp_id}"
+
+    async def _linked(self, whatsapp_id: str) -> tuple[list[tuple[int, int]], str] | None:
+        """Mensagens do Chatwoot vinculadas e status mais avançado já aplicado; no miss, vêm do índice local."""
+        fields = await self.state.get_fields(self._key(whatsapp_id))
+        if not fields and self.ids is not None:
+            stored = await self.ids.receipt_link(whatsapp_id)
+            if stored is not None:
+                fields = {f"m:{conversation_id}:{message_id}": "1" for conversation_id, message_id in stored["messages"]}
+                fields[f"s:{RANK_STATUS[stored['status']]}"] = "1"
+                await self.state.set_fields(self._key(whatsapp_id), fields, RECEIPT_LINK_TTL)
+        messages = [tuple(int(part) for part in field[2:].split(":")) for field in fields if field.startswith("m:")]
+        if not messages:
+            return None
+        status = max((field[2:] for field in fields if field.startswith("s:")), key=STATUS_RANK.__getitem__,
+                     default="sent")
+        return messages, status
+
+    def add(self, chat: str, whatsapp_ids: list[str], state: str) -> bool:
+        """Acumula um recibo até o fim da janela. Retorna False se o estado não é tratado."""
+        status = RECEIPT_STATUSES.get(state)
+        if status is None:
+            return False
+        pending = self._pending.setdefault(chat, {})
+        for whatsapp_id in whatsapp_ids:
+            current = pending.get(whatsapp_id)
+            if current is not None:
+                metrics.RECEIPTS_COALESCED.inc()
+                if STATUS_RANK[status] <= STATUS_RANK[current]:
+                    continue
+            elif self._size >= RECEIPT_MAX_PENDING:
+                logger.warning("Recibos pendentes demais; recibo de %s descartado.", whatsapp_id)
+                continue
+            else:
+                self._size += 1
+            pending[whatsapp_id] = status
+        return True
+
+    async def mark_failed(self, conversation_id: int, message_id: int, error: str):
+        """Marca a mensagem do Chatwoot como não entregue (envio para o WhatsApp desistido)."""
+        if await self.chatwoot.update_message_status(conversation_id, message_id, "failed", error[:255]):
+            metrics.RECEIPT_UPDATES.labels("failed").inc()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            await self.flush()
+
+    async def flush(self):
+        """Aplica os recibos acumulados na janela."""
+        if not self._pending:
+            return
+        pending, self._pending, self._size = self._pending, {}, 0
+        with metrics.STAGE_LATENCY.labels("receipt_flush").time():
+            results = await asyncio.gather(*(self._flush(chat, receipts) for chat, receipts in pending.items()),
+                                           return_exceptions=True)
+        for chat, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.error("Erro ao aplicar os recibos do chat %s: %s", chat, result)
+
+    async def _flush(self, chat: str, receipts: dict[str, str]):
+        """Aplica os recibos de um chat: uma atualização por mensagem do Chatwoot, só se o status avançar."""
+        updates: dict[tuple[int, int], str] = {}
+        for whatsapp_id, status in receipts.items():
+            linked = await self._linked(whatsapp_id)
+            if linked is None:
+                # Mensagem que não saiu pela ponte (ou vínculo expirado)
+                continue
+            messages, applied = linked
+            if STATUS_RANK[status] <= STATUS_RANK[applied]:
+                metrics.RECEIPTS_COALESCED.inc()
+                continue
+            await self.state.set_fields(self._key(whatsapp_id), {f"s:{status}": "1"}, RECEIPT_LINK_TTL)
+            if self.ids is not None:
+                self.ids.set_receipt_status(whatsapp_id, STATUS_RANK[status])
+            for conversation_id, message_id in messages:
+                current = updates.get((conversation_id, message_id))
+                if current is None or STATUS_RANK[status] > STATUS_RANK[current]:
+                    updates[(conversation_id, message_id)] = status
+        for (conversation_id, message_id), status in updates.items():
+            try:
+                if await self.chatwoot.update_message_status(conversation_id, message_id, status):
+                    metrics.RECEIPT_UPDATES.labels(status).inc()
+            except CircuitOpenError as e:
+                # Recibos são informativos: com o Chatwoot fora do ar, não são repetidos
+                logger.debug("Recibos do chat %s descartados: %s", chat, e)
+                return
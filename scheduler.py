@@ -0,0 +1,219 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import metrics
+from cache import TTLCache
+from logs import get_logger
+
+logger = get_logger("scheduler")
+
+# --- Agendador de envios para a WuzAPI ---
+# Todo envio ao WhatsApp passa por dois token buckets: um global (limite da instância) e um por
+# destinatário. Respostas de agentes humanos têm prioridade sobre as de bots. Cada destinatário
+# tem no máximo um envio em andamento: o seguinte só sai quando o anterior termina, e as mensagens
+# chegam ao WhatsApp na ordem em que foram agendadas.
+# Com um backend de estado compartilhado, os mesmos limites também são conferidos no servidor,
+# para que vários processos somados não ultrapassem a taxa da instância. Um destinatário barrado
+# pelo limite compartilhado espera a sua vez sem atrasar os demais.
+
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "20"))
+OUTBOUND_BURST = float(os.getenv("OUTBOUND_BURST", "40"))
+OUTBOUND_RECIPIENT_RATE = float(os.getenv("OUTBOUND_RECIPIENT_RATE", "1"))
+OUTBOUND_RECIPIENT_BURST = float(os.getenv("OUTBOUND_RECIPIENT_BURST", "5"))
+OUTBOUND_MAX_PENDING = int(os.getenv("OUTBOUND_MAX_PENDING", "5000"))
+
+# Filas de prioridade, da mais para a menos prioritária
+PRIORITY_HUMAN = "human"
+PRIORITY_BOT = "bot"
+LANES = (PRIORITY_HUMAN, PRIORITY_BOT)
+
+
+class OutboundQueueFullError(Exception):
+    """Há envios pendentes demais; o job volta para a fila durável e é repetido depois."""
+
+
+class TokenBucket:
+    """Token bucket clássico: `rate` fichas por segundo, acumulando no máximo `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        # `now` pode ser anterior à criação do bucket (lido antes, pelo chamador)
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        """Segundos até haver `cost` fichas (0 se já houver)."""
+        self._refill(now)
+        cost = min(cost, self.burst)
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+
+    def consume(self, now: float, cost: float = 1):
+        self._refill(now)
+        self.tokens -= min(cost, self.burst)
+
+
+class OutboundMessage:
+    __slots__ = ("recipient", "send", "cost", "future", "enqueued_at")
+
+    def __init__(self, recipient: str, send, cost: float):
+        self.recipient = recipient
+        self.send = send
+        self.cost = cost
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class OutboundScheduler:
+    """Despacha envios respeitando os limites globais e por destinatário, em ordem FIFO e um de cada vez
+    por destinatário."""
+
+    def __init__(self, rate: float = OUTBOUND_RATE, burst: float = OUTBOUND_BURST,
+                 recipient_rate: float = OUTBOUND_RECIPIENT_RATE, recipient_burst: float = OUTBOUND_RECIPIENT_BURST,
+                 max_pending: int = OUTBOUND_MAX_PENDING, state=None, key_prefix: str = "outbound:"):
+        self.rate = rate
+        self.burst = burst
+        self.global_bucket = TokenBucket(rate, burst)
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.max_pending = max_pending
+        # Backend de estado compartilhado (apenas quando `state.shared`)
+        self.shared_state = state if state is not None and state.shared else None
+        self.key_prefix = key_prefix
+        self._recipient_buckets = TTLCache(maxsize=100000, ttl=3600)
+        self._lanes = {lane: deque() for lane in LANES}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._sending: set[asyncio.Task] = set()
+        # Destinatários com envio em andamento e os barrados pelo limite compartilhado (até quando)
+        self._in_flight: set[str] = set()
+        self._deferred: dict[str, float] = {}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._sending, return_exceptions=True)
+            self._task = None
+
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def state(self) -> dict:
+        """Estado das filas, exposto em /metrics."""
+        now = time.monotonic()
+        return {
+            "pending": {lane: len(queue) for lane, queue in self._lanes.items()},
+            "sending": len(self._sending),
+            "recipients_tracked": len(self._recipient_buckets),
+            "global_wait_seconds": round(self.global_bucket.wait_time(now), 3),
+        }
+
+    async def submit(self, recipient: str, send, priority: str = PRIORITY_HUMAN, cost: float = 1):
+        """Agenda um envio e aguarda o resultado. `send()` executa o envio."""
+        if self.pending() >= self.max_pending:
+            raise OutboundQueueFullError(f"{self.pending()} envios pendentes para a WuzAPI")
+        message = OutboundMessage(recipient, send, cost)
+        self._lanes[priority].append(message)
+        metrics.OUTBOUND_PENDING.labels(priority).inc()
+        self._wakeup.set()
+        return await message.future
+
+    def _next_ready(self, now: float) -> tuple[str | None, OutboundMessage | None, float | None]:
+        """Primeira mensagem liberada pelos buckets, respeitando prioridade e a ordem por destinatário.
+        Se nenhuma estiver liberada, retorna o tempo de espera até a próxima (None: só quando um envio
+        em andamento terminar ou chegar outra mensagem)."""
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, None, global_wait
+        wait = None
+        for lane in LANES:
+            blocked = set(self._in_flight)
+            for message in self._lanes[lane]:
+                if message.recipient in blocked:
+                    continue
+                recipient_wait = self._deferred.get(message.recipient, now) - now
+                if recipient_wait <= 0:
+                    self._deferred.pop(message.recipient, None)
+                    recipient_wait = self._bucket(message.recipient).wait_time(now, message.cost)
+                if recipient_wait == 0:
+                    return lane, message, None
+                blocked.add(message.recipient)
+                wait = recipient_wait if wait is None else min(wait, recipient_wait)
+        return None, None, wait
+
+    def _bucket(self, recipient: str) -> TokenBucket:
+        bucket = self._recipient_buckets.get(recipient)
+        if bucket is None:
+            bucket = TokenBucket(self.recipient_rate, self.recipient_burst)
+            self._recipient_buckets.set(recipient, bucket)
+        return bucket
+
+    def _take(self, lane: str, message: OutboundMessage):
+        self._lanes[lane].remove(message)
+        metrics.OUTBOUND_PENDING.labels(lane).dec()
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            lane, message, wait = self._next_ready(now)
+            if message is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if self.shared_state is not None:
+                shared_wait = await self._acquire_shared(message)
+                if shared_wait > 0:
+                    # Limite compartilhado esgotado por outros processos: o destinatário volta para a fila
+                    # até lá, e o laço segue com os demais
+                    self._deferred[message.recipient] = time.monotonic() + shared_wait
+                    continue
+                now = time.monotonic()
+            self._take(lane, message)
+            self.global_bucket.consume(now, message.cost)
+            self._bucket(message.recipient).consume(now, message.cost)
+            metrics.OUTBOUND_WAIT.labels(lane).observe(now - message.enqueued_at)
+            self._in_flight.add(message.recipient)
+            task = asyncio.create_task(self._deliver(message))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _acquire_shared(self, message: OutboundMessage) -> float:
+        """Consome as fichas nos buckets compartilhados; retorna a espera se ainda não houver."""
+        try:
+            return await self.shared_state.acquire_tokens([
+                (f"{self.key_prefix}global", self.rate, self.burst),
+                (f"{self.key_prefix}{message.recipient}", self.recipient_rate, self.recipient_burst),
+            ], message.cost)
+        except Exception as e:
+            # Backend indisponível: os limites locais continuam valendo
+            logger.warning("Erro ao consultar limites de envio compartilhados: %s", e)
+            return 0.0
+
+    async def _deliver(self, message: OutboundMessage):
+        try:
+            result = await message.send()
+        except Exception as e:
+            if not message.future.done():
+                message.future.set_exception(e)
+            return
+        finally:
+            # Libera o próximo envio do destinatário
+            self._in_flight.discard(message.recipient)
+            self._wakeup.set()
+        if not message.future.done():
+            message.future.set_result(result)
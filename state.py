@@ -0,0 +1,229 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from cache import TTLCache
+from locks import KeyedLock
+from logs import get_logger
+from scheduler import TokenBucket
+
+logger = get_logger("state")
+
+# --- Backend de estado compartilhado ---
+# Mapeamentos contato/conversa, chaves de deduplicação, vínculos dos recibos, locks de
+# single-flight e token buckets de envio ficam atrás desta interface. O padrão ("memory://") mantém tudo no processo, como
+# antes; com uma URL redis:// (Redis, Valkey, KeyDB ou qualquer servidor compatível) vários
+# workers do uvicorn e várias réplicas passam a compartilhar o mesmo estado.
+
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "memory://")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "ricard_zap:")
+# Tempo máximo de um lock de single-flight (se o processo cair, o lock expira sozinho)
+STATE_LOCK_TTL = float(os.getenv("STATE_LOCK_TTL", "30"))
+STATE_MEMORY_MAXSIZE = 100000
+
+
+class StateBackend:
+    """Interface dos backends. `shared` indica se o estado é visto por outros processos."""
+
+    shared = False
+
+    async def get(self, key: str):
+        """Valor (JSON) da chave, ou None."""
+        raise NotImplementedError
+
+    async def set(self, key: str, value, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def add(self, key: str, ttl: float) -> bool:
+        """Registra a chave se ela ainda não existir. Retorna True se foi registrada agora."""
+        raise NotImplementedError
+
+    async def get_fields(self, key: str) -> dict:
+        """Campos (texto) do hash da chave, ou {}."""
+        raise NotImplementedError
+
+    async def set_fields(self, key: str, fields: dict, ttl: float):
+        """Grava os campos no hash da chave, sem tocar nos demais, e renova o TTL. Escritas
+        simultâneas de campos diferentes não se sobrescrevem."""
+        raise NotImplementedError
+
+    def lock(self, key: str, ttl: float = STATE_LOCK_TTL):
+        """Context manager assíncrono: exclusão mútua por chave entre todos os que usam o backend."""
+        raise NotImplementedError
+
+    async def acquire_tokens(self, buckets: list[tuple[str, float, float]], cost: float = 1) -> float:
+        """Consome `cost` fichas de todos os token buckets (chave, taxa, rajada) ou de nenhum.
+        Retorna 0 se consumiu, ou os segundos até haver fichas em todos."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Estado no próprio processo (um único worker do uvicorn)."""
+
+    def __init__(self, maxsize: int = STATE_MEMORY_MAXSIZE):
+        self._values = TTLCache(maxsize=maxsize, ttl=3600)
+        self._locks = KeyedLock()
+        self._buckets = TTLCache(maxsize=maxsize, ttl=3600)
+
+    async def get(self, key: str):
+        return self._values.get(key)
+
+    async def set(self, key: str, value, ttl: float):
+        self._values.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str):
+        self._values.pop(key)
+
+    async def add(self, key: str, ttl: float) -> bool:
+        if key in self._values:
+            return False
+        self._values.set(key, True, ttl=ttl)
+        return True
+
+    async def get_fields(self, key: str) -> dict:
+        return dict(self._values.get(key) or {})
+
+    async def set_fields(self, key: str, fields: dict, ttl: float):
+        self._values.set(key, {**(self._values.get(key) or {}), **fields}, ttl=ttl)
+
+    def lock(self, key: str, ttl: float = STATE_LOCK_TTL):
+        return self._locks.hold(key)
+
+    async def acquire_tokens(self, buckets: list[tuple[str, float, float]], cost: float = 1) -> float:
+        now = time.monotonic()
+        states = []
+        for key, rate, burst in buckets:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+                self._buckets.set(key, bucket)
+            states.append(bucket)
+        wait = max(bucket.wait_time(now, cost) for bucket in states)
+        if wait == 0:
+            for bucket in states:
+                bucket.consume(now, cost)
+        return wait
+
+
+# Token buckets atômicos no servidor: consome de todos ou de nenhum. Cada bucket é um hash
+# {tokens, ts}; ARGV = agora, custo, depois taxa e rajada de cada chave.
+_ACQUIRE_TOKENS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[1 + i * 2])
+    local burst = tonumber(ARGV[2 + i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local current = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    current = math.min(burst, current + math.max(0, now - ts) * rate)
+    tokens[i] = current
+    local needed = math.min(cost, burst)
+    if current < needed then
+        wait = math.max(wait, (needed - current) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[1 + i * 2])
+    local burst = tonumber(ARGV[2 + i * 2])
+    redis.call('HSET', key, 'tokens', tokens[i] - math.min(cost, burst), 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+# Libera o lock apenas se ele ainda pertencer a quem o adquiriu
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBackend(StateBackend):
+    """Estado em um servidor compatível com o protocolo do Redis (requer o pacote `redis`)."""
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = STATE_KEY_PREFIX):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND_URL usa Redis, mas o pacote 'redis' não está instalado.")
+        self.prefix = prefix
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._acquire_tokens = self._redis.register_script(_ACQUIRE_TOKENS_SCRIPT)
+        self._release_lock = self._redis.register_script(_RELEASE_LOCK_SCRIPT)
+        # Tarefas do mesmo processo esperam localmente, sem disputar o lock no servidor
+        self._local_locks = KeyedLock()
+
+    async def get(self, key: str):
+        value = await self._redis.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    async def set(self, key: str, value, ttl: float):
+        await self._redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    async def delete(self, key: str):
+        await self._redis.delete(self.prefix + key)
+
+    async def add(self, key: str, ttl: float) -> bool:
+        return bool(await self._redis.set(self.prefix + key, "1", nx=True, px=int(ttl * 1000)))
+
+    async def get_fields(self, key: str) -> dict:
+        return await self._redis.hgetall(self.prefix + key)
+
+    async def set_fields(self, key: str, fields: dict, ttl: float):
+        async with self._redis.pipeline(transaction=True) as pipeline:
+            pipeline.hset(self.prefix + key, mapping=fields)
+            pipeline.pexpire(self.prefix + key, int(ttl * 1000))
+            await pipeline.execute()
+
+    @asynccontextmanager
+    async def lock(self, key: str, ttl: float = STATE_LOCK_TTL):
+        name = f"{self.prefix}lock:{key}"
+        token = uuid.uuid4().hex
+        async with self._local_locks.hold(key):
+            delay = 0.01
+            while not await self._redis.set(name, token, nx=True, px=int(ttl * 1000)):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+            try:
+                yield
+            finally:
+                await self._release_lock(keys=[name], args=[token])
+
+    async def acquire_tokens(self, buckets: list[tuple[str, float, float]], cost: float = 1) -> float:
+        keys = [f"{self.prefix}bucket:{key}" for key, _, _ in buckets]
+        args = [time.time(), cost]
+        for _, rate, burst in buckets:
+            args += [rate, burst]
+        return float(await self._acquire_tokens(keys=keys, args=args))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_backend(url: str = STATE_BACKEND_URL) -> StateBackend:
+    """Backend a partir da URL: memory:// (padrão) ou redis://, rediss://, unix://."""
+    if not url or url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        logger.info("Estado compartilhado em %s", url.split("@")[-1])
+        return RedisBackend(url)
+    raise ValueError(f"STATE_BACKEND_URL não suportada: {url}")
@@ -0,0 +1,298 @@
+import asyncio
+import json
+import os
+
+import metrics
+from avatars import AvatarRefresher
+from clients import ChatwootClient, WuzAPIClient
+from groups import GroupDirectory
+from idmap import IdMap
+from logs import get_logger
+from receipts import ReceiptTracker
+from scheduler import (OUTBOUND_BURST, OUTBOUND_RATE, OUTBOUND_RECIPIENT_BURST, OUTBOUND_RECIPIENT_RATE,
+                       OutboundScheduler)
+from state import MemoryBackend, StateBackend
+
+logger = get_logger("tenants")
+
+# --- Registro de tenants (várias instâncias WuzAPI / caixas do Chatwoot no mesmo processo) ---
+# Cada tenant liga uma instância da WuzAPI a uma conta/caixa do Chatwoot, com credenciais,
+# pools de conexão, caches e limites de envio próprios. Os tenants vêm de TENANTS_FILE (JSON),
+# relido automaticamente quando o arquivo muda; sem ele, as variáveis de ambiente de sempre
+# definem um único tenant "default".
+
+TENANTS_FILE = os.getenv("TENANTS_FILE")
+TENANTS_RELOAD_INTERVAL = float(os.getenv("TENANTS_RELOAD_INTERVAL", "10"))
+# Um tenant substituído ou removido só é fechado depois deste prazo (jobs em andamento terminam)
+TENANT_DRAIN_SECONDS = float(os.getenv("TENANT_DRAIN_SECONDS", "150"))
+DEFAULT_TENANT = "default"
+
+CONTACT_CACHE_TTL = float(os.getenv("CONTACT_CACHE_TTL", "3600"))
+CONTACT_CACHE_SIZE = int(os.getenv("CONTACT_CACHE_SIZE", "10000"))
+
+# Campos de cada tenant no arquivo (mesmos nomes das variáveis de ambiente, em minúsculas)
+REQUIRED_FIELDS = (
+    "chatwoot_url",
+    "chatwoot_account_id",
+    "chatwoot_inbox_id",
+    "chatwoot_api_token",
+    "wuzapi_api_url",
+    "wuzapi_api_token",
+    "wuzapi_instance_name",
+)
+OPTIONAL_FIELDS = {
+    "outbound_rate": OUTBOUND_RATE,
+    "outbound_burst": OUTBOUND_BURST,
+    "outbound_recipient_rate": OUTBOUND_RECIPIENT_RATE,
+    "outbound_recipient_burst": OUTBOUND_RECIPIENT_BURST,
+}
+
+
+class TenantConfigError(ValueError):
+    """Configuração de tenant inválida (campo obrigatório faltando, ID repetido, JSON malformado)."""
+
+
+def parse_tenant(raw: dict) -> dict:
+    tenant_id = str(raw.get("id") or "").strip()
+    if not tenant_id:
+        raise TenantConfigError("tenant sem 'id'")
+    missing = [field for field in REQUIRED_FIELDS if not raw.get(field)]
+    if missing:
+        raise TenantConfigError(f"tenant '{tenant_id}' sem os campos: {', '.join(missing)}")
+    config = {"id": tenant_id}
+    config.update({field: str(raw[field]) for field in REQUIRED_FIELDS})
+    config.update({field: float(raw.get(field, default)) for field, default in OPTIONAL_FIELDS.items()})
+    return config
+
+
+def load_tenants_file(path: str) -> dict[str, dict]:
+    """Lê o arquivo de tenants: {"tenants": [{...}, ...]} ou diretamente a lista."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise TenantConfigError(f"{path} não é um JSON válido: {e}")
+    entries = data.get("tenants", []) if isinstance(data, dict) else data
+    configs = {}
+    for raw in entries:
+        config = parse_tenant(raw)
+        if config["id"] in configs:
+            raise TenantConfigError(f"tenant '{config['id']}' repetido")
+        configs[config["id"]] = config
+    return configs
+
+
+def tenant_from_env() -> dict:
+    """Tenant único definido pelas variáveis de ambiente (modo de uma instância só)."""
+    missing = [field.upper() for field in REQUIRED_FIELDS if not os.getenv(field.upper())]
+    if missing:
+        raise TenantConfigError(f"variáveis de ambiente obrigatórias faltando: {', '.join(missing)}")
+    return parse_tenant({"id": DEFAULT_TENANT, **{field: os.getenv(field.upper()) for field in REQUIRED_FIELDS},
+                         **{field: os.getenv(field.upper(), default) for field, default in OPTIONAL_FIELDS.items()}})
+
+
+class Tenant:
+    """Recursos de um tenant: clientes HTTP, agendador de envios, avatares, grupos, recibos e cache de resolução.
+    Com um backend de estado compartilhado (Redis), o cache de resolução, os locks de single-flight
+    e os limites de envio valem para todos os processos; sem ele, cada tenant tem os seus em memória."""
+
+    def __init__(self, config: dict, state: StateBackend | None = None, ids: IdMap | None = None):
+        self.config = config
+        self.id = config["id"]
+        self.inbox_id = config["chatwoot_inbox_id"]
+        self.account_id = config["chatwoot_account_id"]
+        self.instance_name = config["wuzapi_instance_name"]
+        # Sem Content-Type fixo: o httpx define JSON ou multipart (anexos) conforme cada requisição
+        self.chatwoot = ChatwootClient(config["chatwoot_url"], self.account_id, self.inbox_id,
+                                       {"api_access_token": config["chatwoot_api_token"]})
+        self.wuzapi = WuzAPIClient(config["wuzapi_api_url"], config["wuzapi_api_token"])
+        # Telefone/JID -> contato e conversa no Chatwoot, locks de single-flight e token buckets
+        self.state = state if state is not None and state.shared else MemoryBackend(maxsize=CONTACT_CACHE_SIZE)
+        self.outbound = OutboundScheduler(config["outbound_rate"], config["outbound_burst"],
+                                          config["outbound_recipient_rate"], config["outbound_recipient_burst"],
+                                          state=self.state, key_prefix=f"{self.id}:outbound:")
+        # Índice local (SQLite) dos mesmos IDs, que sobrevive a reinícios
+        self.ids = ids.bind(self.id) if ids is not None else None
+        self.avatar_refresher = AvatarRefresher(self.chatwoot, self.wuzapi, ids=self.ids)
+        self.groups = GroupDirectory(self.wuzapi, self.state, key_prefix=f"{self.id}:group:")
+        self.receipts = ReceiptTracker(self.chatwoot, state, key_prefix=f"{self.id}:receipt:", ids=self.ids)
+
+    async def get_resolution(self, key: str) -> dict | None:
+        """Entrada do cache de resolução; no miss, vem do índice local e volta para o cache."""
+        value = await self.state.get(f"{self.id}:resolution:{key}")
+        if value is None and self.ids is not None:
+            value = await self.ids.get(key)
+            if value is not None:
+                await self.state.set(f"{self.id}:resolution:{key}", value, CONTACT_CACHE_TTL)
+        return value
+
+    async def set_resolution(self, key: str, value: dict):
+        await self.state.set(f"{self.id}:resolution:{key}", value, CONTACT_CACHE_TTL)
+        if self.ids is not None:
+            self.ids.put(key, value)
+
+    async def drop_resolution(self, key: str, keep_contact: bool = False):
+        """Remove a entrada (contato ou conversa apagados) ou, com `keep_contact`, só a conversa."""
+        value = await self.state.get(f"{self.id}:resolution:{key}") if keep_contact else None
+        if value and value.get("contact_id"):
+            await self.state.set(f"{self.id}:resolution:{key}", {"contact_id": value["contact_id"]},
+                                 CONTACT_CACHE_TTL)
+        else:
+            await self.state.delete(f"{self.id}:resolution:{key}")
+        if self.ids is not None:
+            self.ids.forget(key, keep_contact)
+
+    def resolution_lock(self, key: str):
+        """Single-flight: apenas uma resolução (e criação de contato/conversa) por número de cada vez."""
+        return self.state.lock(f"{self.id}:resolution:{key}")
+
+    async def warm(self):
+        """Carrega no cache de resolução as entradas mais recentes do índice local. Com backend
+        compartilhado, o cache já sobrevive a reinícios."""
+        if self.ids is None or self.state.shared:
+            return
+        for key, value in await self.ids.recent():
+            await self.state.set(f"{self.id}:resolution:{key}", value, CONTACT_CACHE_TTL)
+
+    def start(self):
+        self.outbound.start()
+        self.avatar_refresher.start()
+        self.receipts.start()
+
+    async def aclose(self):
+        await self.outbound.stop()
+        await self.avatar_refresher.stop()
+        await self.receipts.stop()
+        await self.chatwoot.aclose()
+        await self.wuzapi.aclose()
+
+
+class TenantRegistry:
+    """Tenants ativos, indexados por ID, nome da instância, token da WuzAPI e conta/caixa do Chatwoot."""
+
+    def __init__(self, path: str | None = TENANTS_FILE, reload_interval: float = TENANTS_RELOAD_INTERVAL,
+                 state: StateBackend | None = None, ids: IdMap | None = None):
+        self.path = path
+        self.state = state
+        self.ids = ids
+        self.reload_interval = reload_interval
+        self._tenants: dict[str, Tenant] = {}
+        self._by_instance: dict[str, Tenant] = {}
+        self._by_token: dict[str, Tenant] = {}
+        self._by_inbox: dict[tuple[str, str], Tenant] = {}
+        self._mtime: float | None = None
+        self._task: asyncio.Task | None = None
+        self._draining: set[asyncio.Task] = set()
+
+    def load(self):
+        """Carga inicial. Levanta TenantConfigError se a configuração for inválida."""
+        if self.path:
+            self._mtime = os.path.getmtime(self.path)
+            configs = load_tenants_file(self.path)
+        else:
+            configs = {DEFAULT_TENANT: tenant_from_env()}
+        self._apply(configs)
+
+    def start(self):
+        for tenant in self._tenants.values():
+            tenant.start()
+        if self.path and self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in self._draining:
+            task.cancel()
+        await asyncio.gather(*self._draining, return_exceptions=True)
+        await asyncio.gather(*(tenant.aclose() for tenant in self._tenants.values()), return_exceptions=True)
+        self._tenants = {}
+        self._index()
+
+    def __len__(self) -> int:
+        return len(self._tenants)
+
+    def __iter__(self):
+        return iter(list(self._tenants.values()))
+
+    def get(self, tenant_id: str | None) -> Tenant | None:
+        """Tenant pelo ID. Sem ID (webhooks antigos, jobs de antes dos tenants), vale o tenant único."""
+        if tenant_id is None:
+            return self.single()
+        return self._tenants.get(tenant_id)
+
+    def single(self) -> Tenant | None:
+        return self.only() or self._tenants.get(DEFAULT_TENANT)
+
+    def only(self) -> Tenant | None:
+        """O tenant, se houver um só."""
+        if len(self._tenants) == 1:
+            return next(iter(self._tenants.values()))
+        return None
+
+    def for_wuzapi(self, instance_name: str | None = None, token: str | None = None) -> Tenant | None:
+        """Tenant de um webhook da WuzAPI, pelo nome da instância ou pelo token enviado junto. Um webhook
+        sem correspondência só vai para o tenant único; com vários, não há tenant (o evento de outra
+        instância não pode cair no tenant padrão)."""
+        tenant = self._by_instance.get(instance_name) or self._by_token.get(token)
+        return tenant or self.only()
+
+    def for_chatwoot(self, account_id, inbox_id) -> Tenant | None:
+        """Tenant de um webhook do Chatwoot, pela conta e caixa de entrada do evento (sem correspondência,
+        só o tenant único)."""
+        tenant = self._by_inbox.get((str(account_id), str(inbox_id)))
+        return tenant or self.only()
+
+    def reload(self) -> bool:
+        """Relê o arquivo se ele mudou. Uma configuração inválida é registrada e ignorada."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return False
+            configs = load_tenants_file(self.path)
+        except (OSError, TenantConfigError) as e:
+            logger.error("Erro ao recarregar tenants de %s: %s", self.path, e)
+            return False
+        self._mtime = mtime
+        self._apply(configs, start=True)
+        return True
+
+    def _apply(self, configs: dict[str, dict], start: bool = False):
+        retired = []
+        for tenant_id, tenant in list(self._tenants.items()):
+            if configs.get(tenant_id) != tenant.config:
+                retired.append(self._tenants.pop(tenant_id))
+        for tenant_id, config in configs.items():
+            if tenant_id in self._tenants:
+                continue
+            tenant = self._tenants[tenant_id] = Tenant(config, self.state, self.ids)
+            if start:
+                tenant.start()
+            logger.info("Tenant '%s' carregado (instância %s, caixa %s).", tenant_id, tenant.instance_name,
+                        tenant.inbox_id)
+        for tenant in retired:
+            logger.info("Tenant '%s' removido ou alterado. Encerrando em %.0fs.", tenant.id, TENANT_DRAIN_SECONDS)
+            task = asyncio.create_task(self._drain(tenant))
+            self._draining.add(task)
+            task.add_done_callback(self._draining.discard)
+        self._index()
+
+    def _index(self):
+        self._by_instance = {tenant.instance_name: tenant for tenant in self._tenants.values()}
+        self._by_token = {tenant.config["wuzapi_api_token"]: tenant for tenant in self._tenants.values()}
+        self._by_inbox = {(tenant.account_id, tenant.inbox_id): tenant for tenant in self._tenants.values()}
+        metrics.TENANTS.set(len(self._tenants))
+
+    async def _drain(self, tenant: Tenant):
+        try:
+            await asyncio.sleep(TENANT_DRAIN_SECONDS)
+        finally:
+            await tenant.aclose()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if self.reload():
+                logger.info("Tenants recarregados de %s: %s ativos.", self.path, len(self._tenants))
@@ -0,0 +1,42 @@
+import functools
+import importlib
+import sys
+
+import pytest
+
+TENANT_ENV = {
+    "CHATWOOT_URL": "http://chatwoot.test",
+    "CHATWOOT_ACCOUNT_ID": "1",
+    "CHATWOOT_INBOX_ID": "1",
+    "CHATWOOT_API_TOKEN": "chatwoot-token",
+    "WUZAPI_API_URL": "http://wuzapi.test",
+    "WUZAPI_API_TOKEN": "wuzapi-token",
+    "WUZAPI_INSTANCE_NAME": "bench",
+}
+
+
+@pytest.fixture
+def redis_url(monkeypatch):
+    """Servidor local compatível com o protocolo do Redis (fakeredis, com os scripts Lua), no lugar
+    do servidor da URL. Todas as conexões abertas no teste veem o mesmo servidor."""
+    fakeredis = pytest.importorskip("fakeredis")
+    redis_asyncio = pytest.importorskip("redis.asyncio")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_asyncio, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs))
+    return "redis://stand-in:6379/0"
+
+
+@pytest.fixture
+def bridge(tmp_path, monkeypatch):
+    """Módulo main com um tenant definido pelas variáveis de ambiente e os bancos SQLite em tmp_path.
+    O lifespan roda dentro do `with TestClient(bridge.app)` do teste; os workers não consomem a fila."""
+    for name, value in TENANT_ENV.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.chdir(tmp_path)
+    # recarrega o módulo para cada teste ter fila, deduplicação e tenants novos
+    main = importlib.reload(sys.modules["main"]) if "main" in sys.modules else importlib.import_module("main")
+    from jobqueue import WorkerPool
+    monkeypatch.setattr(main, "WorkerPool", functools.partial(WorkerPool, size=0))
+    monkeypatch.setattr(main, "WARMUP_TIMEOUT", 0.01)
+    return main
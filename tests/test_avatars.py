@@ -0,0 +1,119 @@
+import asyncio
+
+import httpx
+
+from avatars import AvatarRefresher, avatar_identity
+from breaker import CircuitOpenError
+from clients import WuzAPIClient
+from idmap import IdMap
+
+
+class FakeWuzAPI:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    async def get_profile_pic(self, sender_raw):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class FakeChatwoot:
+    def __init__(self, ok: bool = True):
+        self.ok = ok
+        self.updates = []
+
+    async def update_contact_avatar(self, contact_id, url):
+        self.updates.append((contact_id, url))
+        return self.ok
+
+
+PICTURE = {"url": "https://pps.whatsapp.net/v/foto.jpg?oh=assinatura", "id": "123"}
+
+
+def refresh(refresher, contact_id=1):
+    asyncio.run(refresher._refresh(contact_id, "5511999@s.whatsapp.net"))
+
+
+def test_successful_refresh_is_checked():
+    chatwoot = FakeChatwoot()
+    refresher = AvatarRefresher(chatwoot, FakeWuzAPI(PICTURE))
+    refresh(refresher)
+    assert chatwoot.updates == [(1, PICTURE["url"])]
+    assert 1 in refresher._checked
+    assert refresher._avatar_ids.get(1) == "123"
+
+
+def test_contact_without_picture_is_checked():
+    refresher = AvatarRefresher(FakeChatwoot(), FakeWuzAPI(None))
+    refresh(refresher)
+    assert 1 in refresher._checked
+
+
+def test_failed_lookup_is_not_checked():
+    wuzapi = FakeWuzAPI(CircuitOpenError("wuzapi:user_avatar", 30), httpx.ConnectError("recusada"), PICTURE)
+    chatwoot = FakeChatwoot()
+    refresher = AvatarRefresher(chatwoot, wuzapi)
+    for _ in range(2):
+        refresh(refresher)
+        assert 1 not in refresher._checked and 1 not in refresher._pending
+    # a próxima mensagem do contato agenda a conferência de novo
+    refresh(refresher)
+    assert wuzapi.calls == 3 and chatwoot.updates == [(1, PICTURE["url"])]
+    assert 1 in refresher._checked
+
+
+def test_failed_chatwoot_update_is_not_checked(tmp_path):
+    ids = IdMap(path=str(tmp_path / "queue.db"))
+    ids.open()
+    try:
+        refresher = AvatarRefresher(FakeChatwoot(ok=False), FakeWuzAPI(PICTURE), ids=ids.bind("default"))
+        refresh(refresher)
+        assert 1 not in refresher._checked
+        assert refresher._avatar_ids.get(1) is None
+        assert asyncio.run(ids.avatar("default", 1)) is None
+    finally:
+        ids.close()
+
+
+def test_unchanged_picture_is_not_sent_again():
+    chatwoot = FakeChatwoot()
+    refresher = AvatarRefresher(chatwoot, FakeWuzAPI(PICTURE))
+    refresher._avatar_ids.set(1, avatar_identity(PICTURE))
+    refresh(refresher)
+    assert chatwoot.updates == [] and 1 in refresher._checked
+
+
+def test_profile_pic_lookup_raises_on_server_error():
+    def handler(request):
+        return httpx.Response(502)
+
+    async def scenario():
+        client = WuzAPIClient("http://wuzapi.test", "token")
+        client._client = httpx.AsyncClient(base_url="http://wuzapi.test", transport=httpx.MockTransport(handler))
+        try:
+            await client.get_profile_pic("5511999@s.whatsapp.net")
+        except httpx.HTTPStatusError:
+            return "raised"
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario()) == "raised"
+
+
+def test_profile_pic_lookup_without_picture_returns_none():
+    def handler(request):
+        return httpx.Response(404 if request.url.path == "/user/avatar" else 200, json={})
+
+    async def scenario():
+        client = WuzAPIClient("http://wuzapi.test", "token")
+        client._client = httpx.AsyncClient(base_url="http://wuzapi.test", transport=httpx.MockTransport(handler))
+        try:
+            return await client.get_profile_pic("5511999@s.whatsapp.net")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario()) is None
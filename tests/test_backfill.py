@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import pytest
+
+from backfill import Backfill, Checkpoint
+
+
+class FakeTenant:
+    id = "default"
+
+
+def message(message_id: str, chat: str) -> dict:
+    return {"type": "Message", "event": {"Info": {"ID": message_id, "Sender": chat, "Chat": chat},
+                                         "Message": {"conversation": f"texto {message_id}"}}}
+
+
+@pytest.fixture
+def history(tmp_path):
+    path = tmp_path / "historico.jsonl"
+    lines = [message("A", "5511111@s.whatsapp.net"), {"type": "ChatPresence"},
+             message("B", "5522222@s.whatsapp.net"), message("C", "5533333@s.whatsapp.net")]
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+    return path
+
+
+def test_checkpoint_keeps_lines_done_after_offset(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint"))
+    checkpoint.done_after = {120, 40, 300}
+    checkpoint.stats["imported"] = 3
+    checkpoint.save(100)
+    restored = Checkpoint(str(tmp_path / "checkpoint"))
+    restored.load()
+    # as linhas antes do offset saem de done_after
+    assert (restored.offset, restored.done_after) == (100, {120, 300})
+    assert restored.stats == {"imported": 3, "ignored": 0, "failed": 0}
+
+
+def test_missing_checkpoint_starts_from_zero(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint"))
+    checkpoint.load()
+    assert (checkpoint.offset, checkpoint.done_after) == (0, set())
+
+
+def test_interrupted_run_resumes_out_of_order_lines(bridge, history, monkeypatch):
+    imported = []
+    resuming = [False]
+
+    async def forward(tenant, event, backfill=False, content=None):
+        if event.message_id == "A" and not resuming[0]:
+            # a primeira linha fica pendente enquanto as seguintes terminam
+            await asyncio.sleep(3600)
+        imported.append(event.message_id)
+        return {"status": "success"}
+
+    monkeypatch.setattr(bridge, "forward_wuzapi_message", forward)
+    bridge.dedup_index.open()
+
+    async def interrupted():
+        backfill = Backfill(FakeTenant(), str(history), concurrency=4)
+        task = asyncio.create_task(backfill.run())
+        while len(imported) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return backfill.checkpoint
+
+    try:
+        checkpoint = asyncio.run(interrupted())
+        # a linha A (byte 0) ainda estava pendente: o checkpoint para nela e guarda as concluídas depois
+        assert checkpoint.offset == 0 and len(checkpoint.done_after) == 3
+        resuming[0] = True
+        asyncio.run(Backfill(FakeTenant(), str(history), concurrency=4).run())
+    finally:
+        bridge.dedup_index.close()
+    assert sorted(imported[:2]) == ["B", "C"] and imported[2:] == ["A"]
+    resumed = Checkpoint(f"{history}.checkpoint")
+    resumed.load()
+    assert resumed.offset == history.stat().st_size
+    assert resumed.stats == {"imported": 3, "ignored": 1, "failed": 0}
+
+
+def test_lines_lost_from_checkpoint_are_not_imported_twice(bridge, history, monkeypatch):
+    imported = []
+
+    async def forward(tenant, event, backfill=False, content=None):
+        imported.append(event.message_id)
+        return {"status": "success"}
+
+    monkeypatch.setattr(bridge, "forward_wuzapi_message", forward)
+    bridge.dedup_index.open()
+    try:
+        asyncio.run(Backfill(FakeTenant(), str(history)).run())
+        # interrupção antes do checkpoint seguinte: o progresso gravado se perdeu
+        (history.parent / "historico.jsonl.checkpoint").unlink()
+        asyncio.run(Backfill(FakeTenant(), str(history)).run())
+    finally:
+        bridge.dedup_index.close()
+    assert sorted(imported) == ["A", "B", "C"]
+
+
+def test_failed_import_is_not_marked_as_seen(bridge, history, monkeypatch):
+    monkeypatch.setattr("backfill.BACKFILL_MAX_ATTEMPTS", 1)
+    calls = []
+
+    async def forward(tenant, event, backfill=False, content=None):
+        calls.append(event.message_id)
+        if event.message_id == "B":
+            raise RuntimeError("Chatwoot fora do ar")
+        return {"status": "success"}
+
+    monkeypatch.setattr(bridge, "forward_wuzapi_message", forward)
+    bridge.dedup_index.open()
+    try:
+        asyncio.run(Backfill(FakeTenant(), str(history)).run())
+        assert not asyncio.run(bridge.dedup_index.contains("default:wuzapi:B"))
+        assert asyncio.run(bridge.dedup_index.contains("default:wuzapi:A"))
+    finally:
+        bridge.dedup_index.close()
+    failed = [json.loads(line) for line in (history.parent / "historico.jsonl.failed.jsonl").read_text().splitlines()]
+    assert [entry["error"] for entry in failed] == ["Chatwoot fora do ar"]
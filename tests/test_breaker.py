@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import breaker
+from breaker import AdaptiveTimeout, CircuitBreaker, CircuitOpenError
+from clients import WuzAPIClient
+from jobqueue import JobQueue, WorkerPool
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_threshold(clock):
+    circuit = CircuitBreaker("wuzapi", "send_text", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        circuit.before_call()
+        circuit.record_failure()
+    assert circuit.state == breaker.CLOSED
+    circuit.before_call()
+    circuit.record_failure()
+    assert circuit.state == breaker.OPEN
+    clock[0] += 10
+    with pytest.raises(CircuitOpenError) as error:
+        circuit.before_call()
+    assert error.value.retry_after == pytest.approx(20)
+
+
+def test_retry_after_is_at_least_one_second(clock):
+    circuit = CircuitBreaker("wuzapi", "send_text", failure_threshold=1, reset_timeout=30)
+    circuit.record_failure()
+    clock[0] += 29.9
+    with pytest.raises(CircuitOpenError) as error:
+        circuit.before_call()
+    assert error.value.retry_after == 1.0
+
+
+def test_half_open_allows_a_single_probe_then_closes(clock):
+    circuit = CircuitBreaker("wuzapi", "send_text", failure_threshold=1, reset_timeout=30)
+    circuit.record_failure()
+    clock[0] += 30
+    circuit.before_call()
+    assert circuit.state == breaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()
+    circuit.record_success()
+    assert (circuit.state, circuit.failures) == (breaker.CLOSED, 0)
+    circuit.before_call()
+
+
+def test_failed_probe_reopens(clock):
+    circuit = CircuitBreaker("wuzapi", "send_text", failure_threshold=5, reset_timeout=30)
+    circuit.state, circuit.opened_at = breaker.OPEN, clock[0]
+    clock[0] += 30
+    circuit.before_call()
+    circuit.record_failure()
+    assert circuit.state == breaker.OPEN and circuit.opened_at == clock[0]
+
+
+def test_adaptive_timeout_follows_p99():
+    timeout = AdaptiveTimeout(maximum=15.0, factor=3, minimum=1.0)
+    for _ in range(breaker.ADAPTIVE_TIMEOUT_MIN_SAMPLES - 1):
+        timeout.observe(0.5)
+    # poucas amostras: mantém o configurado
+    assert timeout.current == 15.0
+    timeout.observe(2.0)
+    assert timeout.current == pytest.approx(6.0)
+    for _ in range(200):
+        timeout.observe(0.1)
+    # limitado ao mínimo
+    assert timeout.current == 1.0
+
+
+def test_adaptive_timeout_is_capped_and_resets():
+    timeout = AdaptiveTimeout(maximum=5.0, factor=3, minimum=1.0)
+    for _ in range(breaker.ADAPTIVE_TIMEOUT_MIN_SAMPLES):
+        timeout.observe(0.5)
+    assert timeout.current == pytest.approx(1.5)
+    timeout.reset()
+    assert timeout.current == 5.0
+    timeout.observe(10.0)
+    assert timeout.current == 5.0
+
+
+def wuzapi_client(handler) -> WuzAPIClient:
+    client = WuzAPIClient("http://wuzapi.test", "token")
+    client._client = httpx.AsyncClient(base_url="http://wuzapi.test", transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_client_resets_adaptive_timeout_on_read_timeout():
+    slow = [False]
+
+    def handler(request):
+        if slow[0]:
+            raise httpx.ReadTimeout("timeout", request=request)
+        return httpx.Response(200, json={"data": {"Id": "1"}})
+
+    async def scenario():
+        client = wuzapi_client(handler)
+        for _ in range(breaker.ADAPTIVE_TIMEOUT_MIN_SAMPLES):
+            await client.send_text("5511999", "oi")
+        adapted = client._read_timeouts["send_text"].current
+        slow[0] = True
+        with pytest.raises(httpx.ReadTimeout):
+            await client._request("send_text", "POST", "/chat/send/text", json={})
+        await client.aclose()
+        return adapted, client._read_timeouts["send_text"].current
+
+    adapted, after_timeout = asyncio.run(scenario())
+    assert adapted == breaker.ADAPTIVE_TIMEOUT_MIN
+    assert after_timeout == 15.0
+
+
+def test_client_open_circuit_skips_network():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(503)
+
+    async def scenario():
+        client = wuzapi_client(handler)
+        for _ in range(breaker.BREAKER_FAILURE_THRESHOLD):
+            assert await client.send_text("5511999", "oi") is False
+        with pytest.raises(CircuitOpenError):
+            await client.send_text("5511999", "oi")
+        await client.aclose()
+        return client.breaker_states()["send_text"]
+
+    assert asyncio.run(scenario()) == breaker.OPEN
+    assert len(calls) == breaker.BREAKER_FAILURE_THRESHOLD
+
+
+def test_worker_postpones_job_on_open_circuit(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.db"), max_attempts=2)
+    queue.open()
+    handled = []
+
+    async def handler(payload, tenant):
+        handled.append(payload)
+        raise CircuitOpenError("wuzapi:send_text", 30)
+
+    async def scenario():
+        await queue.put("chatwoot", "resposta", shard_key="a")
+        pool = WorkerPool(queue, {"chatwoot": handler}, size=1)
+        pool.start()
+        while not handled:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        await pool.stop()
+        return queue._execute("SELECT attempts, next_run_at FROM jobs"), await queue.dead_letter_count()
+
+    try:
+        [(attempts, next_run_at)], dead = asyncio.run(asyncio.wait_for(scenario(), 5))
+    finally:
+        queue.close()
+    # o job não gastou tentativa e volta quando o circuito puder fechar
+    assert (attempts, dead, handled) == (0, 0, ["resposta"])
+    assert next_run_at == pytest.approx(time.time() + 30, abs=2)
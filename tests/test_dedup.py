@@ -0,0 +1,162 @@
+import asyncio
+import time
+
+import pytest
+
+import dedup
+from dedup import DedupIndex
+from state import MemoryBackend
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = DedupIndex(path=str(tmp_path / "queue.db"))
+    index.open()
+    yield index
+    index.close()
+
+
+def test_seen_marks_keys(index):
+    async def scenario():
+        return [await index.seen("a"), await index.seen("a"), await index.seen("b")]
+
+    assert run(scenario()) == [False, True, False]
+
+
+def test_concurrent_deliveries_are_caught(index):
+    async def scenario():
+        return await asyncio.gather(*(index.seen("a") for _ in range(5)))
+
+    assert sorted(run(scenario())) == [False, True, True, True, True]
+
+
+def test_persisted_keys_survive_restart(tmp_path):
+    path = str(tmp_path / "queue.db")
+
+    async def seen(key):
+        index = DedupIndex(path=path)
+        index.open()
+        try:
+            return await index.seen(key)
+        finally:
+            index.close()
+
+    assert run(seen("a")) is False
+    assert run(seen("a")) is True
+
+
+def test_keys_expire_after_window(tmp_path):
+    index = DedupIndex(window=0.05, path=str(tmp_path / "queue.db"))
+    index.open()
+
+    async def scenario():
+        first = await index.seen("a")
+        await asyncio.sleep(0.1)
+        return first, await index.seen("a")
+
+    try:
+        assert run(scenario()) == (False, False)
+    finally:
+        index.close()
+
+
+def test_lru_eviction_falls_back_to_table(tmp_path):
+    small = DedupIndex(maxsize=2, path=str(tmp_path / "small.db"))
+    small.open()
+
+    async def scenario():
+        for key in ("a", "b", "c"):
+            await small.seen(key)
+        # "a" saiu do LRU, mas continua na tabela
+        return len(small), await small.seen("a")
+
+    try:
+        assert run(scenario()) == (2, True)
+    finally:
+        small.close()
+
+
+def test_prune_removes_old_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_PRUNE_INTERVAL", 0)
+    index = DedupIndex(window=60, path=str(tmp_path / "queue.db"))
+    index.open()
+    try:
+        index._insert("old", time.time() - 120)
+        index._insert("new", time.time())
+        rows = index._conn.execute("SELECT key FROM seen_messages").fetchall()
+        assert rows == [("new",)]
+    finally:
+        index.close()
+
+
+def test_shared_state_replaces_table():
+    class Shared(MemoryBackend):
+        shared = True
+
+    state = Shared()
+    first, second = DedupIndex(path=None, state=state), DedupIndex(path=None, state=state)
+
+    async def scenario():
+        # Outra réplica (outro índice em memória) reconhece a mesma mensagem pelo backend
+        return await first.seen("a"), await second.seen("a")
+
+    assert first.path is None
+    assert run(scenario()) == (False, True)
+
+
+def test_forget_accepts_the_key_again(tmp_path):
+    path = str(tmp_path / "queue.db")
+
+    async def scenario():
+        index = DedupIndex(path=path)
+        index.open()
+        try:
+            await index.seen("a")
+            await index.forget("a")
+            return await index.seen("a")
+        finally:
+            index.close()
+
+    # nem o LRU nem a tabela guardam a chave esquecida
+    assert run(scenario()) is False
+
+
+def test_forget_clears_shared_state():
+    class Shared(MemoryBackend):
+        shared = True
+
+    state = Shared()
+    first, second = DedupIndex(path=None, state=state), DedupIndex(path=None, state=state)
+
+    async def scenario():
+        await first.seen("a")
+        await first.forget("a")
+        return await second.seen("a")
+
+    assert run(scenario()) is False
+
+
+def test_contains_does_not_mark(tmp_path):
+    path = str(tmp_path / "queue.db")
+
+    async def scenario():
+        index = DedupIndex(path=path)
+        index.open()
+        try:
+            before = await index.contains("a")
+            seen = await index.seen("a")
+        finally:
+            index.close()
+        # outro processo: só a tabela
+        restarted = DedupIndex(path=path)
+        restarted.open()
+        try:
+            return before, seen, await restarted.contains("a"), await restarted.contains("b")
+        finally:
+            restarted.close()
+
+    assert run(scenario()) == (False, False, True, False)
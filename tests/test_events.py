@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from events import ChatwootEvent, WuzAPIEvent, chatwoot_prefilter, wuzapi_prefilter
+
+
+def message(**info) -> dict:
+    return {"type": "Message", "event": {"Info": {"ID": "ABC", "Sender": "5511999@s.whatsapp.net", **info},
+                                         "Message": {"conversation": "oi"}}}
+
+
+@pytest.mark.parametrize("body, expected", [
+    (message(), True),
+    ({"jsonData": message(), "instanceName": "x"}, True),
+    ({"type": "ReadReceipt", "state": "Read", "event": {"MessageIDs": ["ABC"]}}, True),
+    ({"type": "ChatPresence", "event": {"State": "paused"}}, True),
+    ({"type": "ChatPresence", "event": {"State": "composing"}}, False),
+    ({"type": "Presence", "event": {}}, False),
+    ({"type": "HistorySync", "event": {}}, False),
+    ({"event": {}}, False),
+])
+def test_wuzapi_prefilter(body, expected):
+    assert wuzapi_prefilter(json.dumps(body).encode()) is expected
+
+
+def test_wuzapi_prefilter_accepts_compact_and_spaced_json():
+    assert wuzapi_prefilter(b'{"type":"Message"}')
+    assert wuzapi_prefilter(b'{"type" :  "Message"}')
+
+
+def test_wuzapi_prefilter_ignores_type_inside_strings():
+    # O texto da mensagem cita o campo, mas o evento é de outro tipo
+    body = {"type": "HistorySync", "event": {"text": '"type": "Message"'}}
+    assert not wuzapi_prefilter(json.dumps(body).encode())
+
+
+@pytest.mark.parametrize("body, expected", [
+    ({"event": "message_created", "id": 1}, True),
+    ({"event": "conversation_status_changed"}, True),
+    ({"event": "message_updated"}, False),
+    ({"event": "webwidget_triggered"}, False),
+    ({"id": 1, "content": "sem event"}, True),
+])
+def test_chatwoot_prefilter(body, expected):
+    assert chatwoot_prefilter(json.dumps(body).encode()) is expected
+
+
+def test_wuzapi_event_parses_nested_json_data():
+    event = WuzAPIEvent({"jsonData": message(Chat="123@g.us", PushName="Ana"), "instanceName": "x"})
+    assert (event.type, event.message_id, event.chat, event.is_group, event.push_name, event.instance_name) == \
+        ("Message", "ABC", "123@g.us", True, "Ana", "x")
+    assert event.ignore_reason() is None
+
+
+@pytest.mark.parametrize("body, reason", [
+    (message(Chat="status@broadcast"), "status broadcast"),
+    ({"type": "Message", "event": {"Info": {}}}, "Could not determine sender"),
+    ({"type": "ReadReceipt", "state": "Read", "event": {"MessageIDs": []}}, "receipt without message ids"),
+    ({"type": "ChatPresence", "event": {"State": "composing", "Sender": "5511@s.whatsapp.net"}},
+     "presence not paused"),
+])
+def test_wuzapi_event_ignore_reason(body, reason):
+    assert WuzAPIEvent(body).ignore_reason() == reason
+
+
+def test_chatwoot_event_slots():
+    event = ChatwootEvent({"event": "message_created", "id": 7, "message_type": "outgoing", "content": "oi"})
+    assert (event.event, event.id, event.message_type, event.content) == ("message_created", 7, "outgoing", "oi")
+    with pytest.raises(AttributeError):
+        event.unknown = 1
@@ -0,0 +1,67 @@
+import asyncio
+
+from health import Readiness
+
+
+class Client:
+    def __init__(self, up: bool):
+        self.up = up
+
+    async def ping(self) -> bool:
+        if self.up is None:
+            raise ConnectionError("recusada")
+        return self.up
+
+
+class Tenant:
+    def __init__(self, id: str, chatwoot: bool | None = True, wuzapi: bool | None = True):
+        self.id = id
+        self.chatwoot = Client(chatwoot)
+        self.wuzapi = Client(wuzapi)
+
+
+class Queue:
+    def __init__(self, depth: int = 0):
+        self._depth = depth
+
+    async def depth(self) -> int:
+        return self._depth
+
+
+def check(readiness: Readiness, warm: bool = True) -> dict:
+    readiness.warm = warm
+    return asyncio.run(readiness.check())
+
+
+def test_not_ready_while_warming_up():
+    assert check(Readiness([Tenant("a")], Queue()), warm=False)["ready"] is False
+
+
+def test_upstream_outage_of_one_tenant_keeps_worker_ready():
+    result = check(Readiness([Tenant("a"), Tenant("b", wuzapi=None)], Queue()))
+    assert result["ready"] is True
+    assert result["upstreams"] == {"a": {"chatwoot": True, "wuzapi": True}, "b": {"chatwoot": True, "wuzapi": False}}
+
+
+def test_upstream_gating_is_opt_in():
+    readiness = Readiness([Tenant("a"), Tenant("b", chatwoot=False)], Queue(), require_upstreams=True)
+    assert check(readiness)["ready"] is False
+
+
+def test_deep_queue_or_no_tenants_is_not_ready():
+    assert check(Readiness([Tenant("a")], Queue(depth=11), max_queue_depth=10))["ready"] is False
+    assert check(Readiness([], Queue()))["ready"] is False
+
+
+def test_probe_is_cached():
+    tenant = Tenant("a")
+    readiness = Readiness([tenant], Queue(), ttl=60)
+    readiness.warm = True
+
+    async def scenario():
+        first = await readiness.check()
+        tenant.wuzapi.up = False
+        return first, await readiness.check()
+
+    first, second = asyncio.run(scenario())
+    assert second is first
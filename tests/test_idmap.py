@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+
+import idmap
+from idmap import IdMap
+
+
+@pytest.fixture
+def ids(tmp_path):
+    ids = IdMap(path=str(tmp_path / "queue.db"), conversation_ttl=3600)
+    ids.open()
+    yield ids
+    ids.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_pending_set_is_read_before_flush(ids):
+    async def scenario():
+        ids.put("default", "5511999", {"contact_id": 1, "conversation_id": 10})
+        pending = await ids.get("default", "5511999")
+        await ids.stop()
+        return pending, await ids.get("default", "5511999"), await ids.get("outro", "5511999")
+
+    assert run(scenario()) == ({"contact_id": 1, "conversation_id": 10},
+                               {"contact_id": 1, "conversation_id": 10}, None)
+
+
+def test_pending_delete_shadows_row(ids):
+    async def scenario():
+        ids.put("default", "5511999", {"contact_id": 1, "conversation_id": 10})
+        await ids.stop()
+        ids.forget("default", "5511999")
+        shadowed = await ids.get("default", "5511999")
+        await ids.stop()
+        return shadowed, await ids.get("default", "5511999")
+
+    assert run(scenario()) == (None, None)
+
+
+def test_pending_clear_conversation_keeps_contact(ids):
+    async def scenario():
+        ids.put("default", "5511999", {"contact_id": 1, "conversation_id": 10})
+        await ids.stop()
+        ids.forget("default", "5511999", keep_contact=True)
+        shadowed = await ids.get("default", "5511999")
+        await ids.stop()
+        return shadowed, await ids.get("default", "5511999")
+
+    assert run(scenario()) == ({"contact_id": 1}, {"contact_id": 1})
+
+
+def test_put_without_conversation_keeps_contact_only(ids):
+    async def scenario():
+        ids.put("default", "5511999", {"contact_id": 1, "conversation_id": None})
+        await ids.stop()
+        return await ids.get("default", "5511999")
+
+    assert run(scenario()) == {"contact_id": 1}
+
+
+def test_expired_conversation_is_dropped(ids):
+    now = time.time()
+    assert ids._entry(1, 10, now - 60) == {"contact_id": 1, "conversation_id": 10}
+    # a conversa expira; o contato continua valendo
+    assert ids._entry(1, 10, now - 7200) == {"contact_id": 1}
+    assert ids._entry(None, 10, now) is None
+
+
+def test_expired_conversation_in_table(ids):
+    ids._write({("default", "5511999"): (idmap._SET, {"contact_id": 1, "conversation_id": 10})}, {},
+               time.time() - 7200)
+    assert run(ids.get("default", "5511999")) == {"contact_id": 1}
+
+
+def test_recent_returns_newest_entries_of_tenant(ids):
+    now = time.time()
+    for index, key in enumerate(("a", "b", "c")):
+        ids._write({("default", key): (idmap._SET, {"contact_id": index + 1, "conversation_id": 10 + index})}, {},
+                   now - 10 + index)
+    ids._write({("outro", "d"): (idmap._SET, {"contact_id": 9, "conversation_id": 99})}, {}, now)
+    assert run(ids.recent("default", limit=2)) == [("c", {"contact_id": 3, "conversation_id": 12}),
+                                                   ("b", {"contact_id": 2, "conversation_id": 11})]
+    assert run(ids.recent("default", limit=0)) == []
+
+
+def test_failed_flush_requeues_without_overwriting_newer_operations(ids, monkeypatch):
+    write = ids._write
+
+    async def scenario():
+        ids.put("default", "a", {"contact_id": 1, "conversation_id": 10})
+        ids.put("default", "b", {"contact_id": 2, "conversation_id": 20})
+        ids.set_avatar("default", 1, "avatar-1", checked_at=100.0)
+
+        def failing_write(*args):
+            # enquanto o lote falha, chega uma operação mais nova para "a"
+            ids.forget("default", "a")
+            raise OSError("disk I/O error")
+
+        monkeypatch.setattr(ids, "_write", failing_write)
+        with pytest.raises(OSError):
+            await ids._flush()
+        requeued = dict(ids._pending), dict(ids._pending_avatars)
+        monkeypatch.setattr(ids, "_write", write)
+        await ids._flush()
+        return requeued, await ids.get("default", "a"), await ids.get("default", "b"), await ids.avatar("default", 1)
+
+    (pending, avatars), a, b, avatar = run(scenario())
+    assert pending == {("default", "a"): (idmap._DELETE, None),
+                       ("default", "b"): (idmap._SET, {"contact_id": 2, "conversation_id": 20})}
+    assert avatars == {("default", 1): ("avatar-1", 100.0)}
+    assert (a, b) == (None, {"contact_id": 2, "conversation_id": 20})
+    assert avatar == {"avatar_id": "avatar-1", "checked_at": 100.0}
+
+
+def test_disabled_index_is_a_no_op():
+    ids = IdMap(path=None)
+    ids.open()
+    ids.put("default", "a", {"contact_id": 1})
+    assert ids.bind("default") is None
+    assert run(ids.get("default", "a")) is None
+    assert run(ids.recent("default")) == []
+
+
+def test_receipt_status_only_advances(ids):
+    async def scenario():
+        ids.link_receipt("default", "wa1", 10, 100)
+        ids.set_receipt_status("default", "wa1", 2)
+        await ids.stop()
+        ids.link_receipt("default", "wa1", 10, 101)
+        ids.set_receipt_status("default", "wa1", 1)
+        await ids.stop()
+        return await ids.receipt_link("default", "wa1"), await ids.receipt_link("default", "wa2")
+
+    assert run(scenario()) == ({"messages": [(10, 100), (10, 101)], "status": 2}, None)
@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+
+from jobqueue import JobQueue, WorkerPool
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.db"), max_attempts=2)
+    queue.open()
+    yield queue
+    queue.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_claim_is_fifo_per_shard(queue):
+    async def scenario():
+        first = await queue.put("wuzapi", "a1", shard_key="a")
+        await queue.put("wuzapi", "a2", shard_key="a")
+        other = await queue.put("wuzapi", "b1", shard_key="b")
+        claimed = [await queue.claim(), await queue.claim(), await queue.claim()]
+        return first, other, claimed
+
+    first, other, claimed = run(scenario())
+    # O segundo job de "a" espera o primeiro terminar; "b" roda em paralelo
+    assert [job.id if job else None for job in claimed] == [first, other, None]
+
+
+def test_ack_releases_next_job_of_shard(queue):
+    async def scenario():
+        await queue.put("wuzapi", "a1", shard_key="a")
+        await queue.put("wuzapi", "a2", shard_key="a")
+        job = await queue.claim()
+        await queue.ack(job)
+        return (await queue.claim()).payload, await queue.depth()
+
+    assert run(scenario()) == ("a2", 1)
+
+
+def test_retry_keeps_shard_blocked(queue):
+    async def scenario():
+        await queue.put("wuzapi", "a1", shard_key="a")
+        await queue.put("wuzapi", "a2", shard_key="a")
+        job = await queue.claim()
+        dead = await queue.retry(job, "falhou")
+        # O job aguarda nova tentativa: o seguinte do shard não pode passar na frente
+        return dead, await queue.claim()
+
+    assert run(scenario()) == (False, None)
+
+
+def test_retry_moves_to_dead_letter_after_max_attempts(queue):
+    async def scenario():
+        await queue.put("wuzapi", "a1", shard_key="a", tenant="t1")
+        job = await queue.claim()
+        job.attempts = 1
+        dead = await queue.retry(job, "falhou")
+        return dead, await queue.depth(), await queue.dead_letter_count()
+
+    assert run(scenario()) == (True, 0, 1)
+
+
+def test_jobs_without_shard_run_in_parallel(queue):
+    async def scenario():
+        await queue.put("chatwoot", "x")
+        await queue.put("chatwoot", "y")
+        return [(await queue.claim()).payload, (await queue.claim()).payload]
+
+    assert run(scenario()) == ["x", "y"]
+
+
+def test_postpone_does_not_count_attempt(queue):
+    async def scenario():
+        await queue.put("wuzapi", "a1", shard_key="a")
+        job = await queue.claim()
+        await queue.postpone(job, 0, "circuito aberto")
+        return (await queue.claim()).attempts
+
+    assert run(scenario()) == 0
+
+
+def test_claim_coalesces_following_jobs_with_same_key(queue):
+    async def scenario():
+        await queue.put("wuzapi", "t1", shard_key="a", coalesce_key="sender")
+        await queue.put("wuzapi", "t2", shard_key="a", coalesce_key="sender")
+        await queue.put("wuzapi", "t3", shard_key="a", coalesce_key="sender")
+        await queue.put("wuzapi", "media", shard_key="a")
+        await queue.put("wuzapi", "t4", shard_key="a", coalesce_key="sender")
+        job = await queue.claim(coalesce_max=10)
+        payloads = [job.payload] + [follower.payload for follower in job.followers]
+        await queue.ack(job)
+        return payloads, (await queue.claim(coalesce_max=10)).payload, await queue.depth()
+
+    # O grupo para no primeiro job sem a chave (a mídia), que mantém a ordem do shard
+    assert run(scenario()) == (["t1", "t2", "t3"], "media", 2)
+
+
+def test_claim_respects_coalesce_max_and_other_keys(queue):
+    async def scenario():
+        for payload in ("t1", "t2", "t3"):
+            await queue.put("wuzapi", payload, shard_key="a", coalesce_key="sender")
+        await queue.put("wuzapi", "other", shard_key="a", coalesce_key="other-sender")
+        first = await queue.claim(coalesce_max=2)
+        await queue.ack(first)
+        second = await queue.claim(coalesce_max=2)
+        return [len(first.followers), second.payload, len(second.followers)]
+
+    assert run(scenario()) == [1, "t3", 0]
+
+
+def test_claim_without_coalescing_has_no_followers(queue):
+    async def scenario():
+        await queue.put("wuzapi", "t1", shard_key="a", coalesce_key="sender")
+        await queue.put("wuzapi", "t2", shard_key="a", coalesce_key="sender")
+        return (await queue.claim()).followers
+
+    assert run(scenario()) == []
+
+
+def test_delayed_job_waits_until_released(queue):
+    async def scenario():
+        await queue.put("wuzapi", "t1", shard_key="a", delay=60, coalesce_key="sender")
+        before = await queue.claim()
+        await queue.release("a")
+        return before, (await queue.claim()).payload
+
+    assert run(scenario()) == (None, "t1")
+
+
+def test_retry_applies_to_whole_batch(queue):
+    async def scenario():
+        for payload in ("t1", "t2", "t3"):
+            await queue.put("wuzapi", payload, shard_key="a", coalesce_key="sender")
+        await queue.retry(await queue.claim(coalesce_max=10), "Chatwoot fora do ar")
+        attempts = queue._execute("SELECT attempts FROM jobs ORDER BY id")
+        queue._execute("UPDATE jobs SET next_run_at = 0")
+        batch = await queue.claim(coalesce_max=10)
+        dead = await queue.retry(batch, "Chatwoot fora do ar")
+        return attempts, len(batch.followers), dead, await queue.depth(), await queue.dead_letter_count()
+
+    # os seguintes não voltam com a contagem zerada: o grupo inteiro vai para a dead-letter
+    assert run(scenario()) == ([(1,), (1,), (1,)], 2, True, 0, 3)
+
+
+def test_failing_batch_handler_dead_letters_every_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.db"), max_attempts=1)
+    queue.open()
+    dead_lettered = []
+
+    async def failing_batch(payloads, tenant):
+        raise RuntimeError("Chatwoot fora do ar")
+
+    async def report(payload, tenant, error):
+        dead_lettered.append((payload, error))
+
+    async def scenario():
+        for payload in ("t1", "t2", "t3"):
+            await queue.put("wuzapi", payload, shard_key="a", coalesce_key="sender")
+        pool = WorkerPool(queue, {"wuzapi": failing_batch}, size=1, dead_letter_handlers={"wuzapi": report},
+                          batch_handlers={"wuzapi": failing_batch})
+        pool.start()
+        while len(dead_lettered) < 3:
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        return await queue.depth(), await queue.dead_letter_count()
+
+    try:
+        assert asyncio.run(asyncio.wait_for(scenario(), 5)) == (0, 3)
+    finally:
+        queue.close()
+    assert dead_lettered == [(payload, "Chatwoot fora do ar") for payload in ("t1", "t2", "t3")]
@@ -0,0 +1,85 @@
+import asyncio
+import base64
+import io
+import json
+
+import pytest
+
+import media
+from media import MediaTooLargeError, data_url_json_body, decode_data_url
+
+
+def payload(data: bytes, mimetype: str = "image/jpeg", escape_slashes: bool = False) -> io.BytesIO:
+    encoded = base64.b64encode(data).decode()
+    body = json.dumps({"code": 200, "data": {"Mimetype": mimetype, "Data": f"data:{mimetype};base64,{encoded}"}})
+    if escape_slashes:
+        body = body.replace("/", "\\/")
+    return io.BytesIO(body.encode())
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 1000, media.MEDIA_CHUNK_SIZE * 3 + 7])
+def test_decode_data_url_roundtrip(size):
+    data = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    mimetype, file = decode_data_url(payload(data))
+    with file:
+        assert mimetype == "image/jpeg"
+        assert file.read() == data
+
+
+def test_decode_data_url_with_escaped_slashes():
+    data = b"\xff\xfe" * 5000
+    mimetype, file = decode_data_url(payload(data, "video/mp4", escape_slashes=True))
+    with file:
+        assert mimetype == "video/mp4"
+        assert file.read() == data
+
+
+def test_decode_data_url_marker_split_across_chunks(monkeypatch):
+    monkeypatch.setattr(media, "MEDIA_CHUNK_SIZE", 7)
+    data = b"conteudo do arquivo"
+    _, file = decode_data_url(payload(data))
+    with file:
+        assert file.read() == data
+
+
+def test_decode_data_url_without_data_url():
+    with pytest.raises(ValueError):
+        decode_data_url(io.BytesIO(b'{"code": 200, "data": {}}'))
+
+
+def test_decode_data_url_too_large():
+    with pytest.raises(MediaTooLargeError):
+        decode_data_url(payload(b"x" * 1000), max_bytes=100)
+
+
+def test_data_url_json_body_roundtrip(monkeypatch):
+    monkeypatch.setattr(media, "MEDIA_CHUNK_SIZE", 10)
+    data = bytes(range(256)) * 3 + b"!"
+
+    async def collect():
+        return b"".join([chunk async for chunk in data_url_json_body({"Phone": "5511"}, "Image", io.BytesIO(data),
+                                                                     "image/png")])
+
+    body = json.loads(asyncio.run(collect()))
+    assert body["Phone"] == "5511"
+    header, encoded = body["Image"].split(",", 1)
+    assert header == "data:image/png;base64"
+    assert base64.b64decode(encoded) == data
+
+
+def test_data_url_json_body_without_fields():
+    async def collect():
+        return b"".join([chunk async for chunk in data_url_json_body({}, "Audio", io.BytesIO(b"abc"), "audio/ogg")])
+
+    assert json.loads(asyncio.run(collect())) == {"Audio": "data:audio/ogg;base64,YWJj"}
+
+
+def test_inline_base64_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr(media, "MEDIA_INLINE_DIR", str(tmp_path / "media"))
+    data = bytes(range(256)) * 1000
+    path = media.save_inline_base64("data:video/mp4;base64," + base64.b64encode(data).decode())
+    with media.decode_inline_base64(path) as file:
+        assert file.read() == data
+    media.discard_inline_base64(path)
+    media.discard_inline_base64(path)
+    assert not (tmp_path / "media").joinpath(path).exists()
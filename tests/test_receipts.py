@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+from breaker import CircuitOpenError
+from idmap import IdMap
+from receipts import ReceiptTracker
+from state import RedisBackend
+
+
+class FakeChatwoot:
+    def __init__(self, fail: Exception | None = None):
+        self.updates = []
+        self.fail = fail
+
+    async def update_message_status(self, conversation_id, message_id, status, external_error=None):
+        if self.fail is not None:
+            raise self.fail
+        self.updates.append((conversation_id, message_id, status))
+        return True
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_window_groups_receipts_per_chatwoot_message():
+    chatwoot = FakeChatwoot()
+    tracker = ReceiptTracker(chatwoot)
+
+    async def scenario():
+        # resposta com dois anexos: duas mensagens no WhatsApp para a mesma mensagem do Chatwoot
+        await tracker.link(["wa1", "wa2"], 10, 100)
+        await tracker.link(["wa3"], 20, 200)
+        tracker.add("chat-a", ["wa1", "wa2"], "Delivered")
+        tracker.add("chat-b", ["wa3"], "Delivered")
+        tracker.add("chat-a", ["unknown"], "Delivered")
+        await tracker.flush()
+
+    run(scenario())
+    assert sorted(chatwoot.updates) == [(10, 100, "delivered"), (20, 200, "delivered")]
+
+
+def test_read_beats_delivered():
+    chatwoot = FakeChatwoot()
+    tracker = ReceiptTracker(chatwoot)
+
+    async def scenario():
+        await tracker.link(["wa1"], 10, 100)
+        tracker.add("chat", ["wa1"], "Delivered")
+        tracker.add("chat", ["wa1"], "Read")
+        tracker.add("chat", ["wa1"], "Delivered")
+        await tracker.flush()
+        # "delivered" atrasado, depois de "read", não volta o status
+        tracker.add("chat", ["wa1"], "Delivered")
+        tracker.add("chat", ["wa1"], "Read")
+        await tracker.flush()
+
+    run(scenario())
+    assert chatwoot.updates == [(10, 100, "read")]
+
+
+def test_unhandled_state_is_rejected():
+    assert ReceiptTracker(FakeChatwoot()).add("chat", ["wa1"], "Played") is False
+
+
+def test_open_circuit_drops_window_without_raising():
+    chatwoot = FakeChatwoot(fail=CircuitOpenError("chatwoot:update_message", 30))
+    tracker = ReceiptTracker(chatwoot)
+
+    async def scenario():
+        await tracker.link(["wa1"], 10, 100)
+        tracker.add("chat", ["wa1"], "Read")
+        await tracker.flush()
+        return tracker._pending
+
+    assert run(scenario()) == {}
+
+
+def test_failing_chat_does_not_block_others():
+    class FailingChat(FakeChatwoot):
+        async def update_message_status(self, conversation_id, message_id, status, external_error=None):
+            if conversation_id == 10:
+                raise RuntimeError("conexão recusada")
+            return await super().update_message_status(conversation_id, message_id, status)
+
+    chatwoot = FailingChat()
+    tracker = ReceiptTracker(chatwoot)
+
+    async def scenario():
+        await tracker.link(["wa1"], 10, 100)
+        await tracker.link(["wa2"], 20, 200)
+        tracker.add("chat-a", ["wa1"], "Read")
+        tracker.add("chat-b", ["wa2"], "Read")
+        await tracker.flush()
+
+    run(scenario())
+    assert chatwoot.updates == [(20, 200, "read")]
+
+
+def test_stop_applies_pending_receipts():
+    chatwoot = FakeChatwoot()
+    tracker = ReceiptTracker(chatwoot, window=60)
+
+    async def scenario():
+        tracker.start()
+        await tracker.link(["wa1"], 10, 100)
+        tracker.add("chat", ["wa1"], "Delivered")
+        await tracker.stop()
+
+    run(scenario())
+    assert chatwoot.updates == [(10, 100, "delivered")]
+
+
+def test_links_and_status_survive_restart(tmp_path):
+    ids = IdMap(path=str(tmp_path / "queue.db"))
+    ids.open()
+    chatwoot = FakeChatwoot()
+
+    async def scenario():
+        before = ReceiptTracker(chatwoot, ids=ids.bind("default"))
+        await before.link(["wa1"], 10, 100)
+        await before.link(["wa2"], 20, 200)
+        before.add("chat", ["wa2"], "Read")
+        await before.flush()
+        await ids.stop()
+        # novo processo: cache vazio, só o índice local
+        after = ReceiptTracker(chatwoot, ids=ids.bind("default"))
+        after.add("chat", ["wa1", "wa2"], "Delivered")
+        await after.flush()
+
+    try:
+        run(scenario())
+    finally:
+        ids.close()
+    assert chatwoot.updates == [(20, 200, "read"), (10, 100, "delivered")]
+
+
+def test_concurrent_links_on_shared_backend_are_kept(redis_url):
+    chatwoot = FakeChatwoot()
+
+    async def scenario():
+        first, second = RedisBackend(redis_url), RedisBackend(redis_url)
+        trackers = [ReceiptTracker(chatwoot, first), ReceiptTracker(chatwoot, second)]
+        try:
+            await asyncio.gather(*(trackers[i % 2].link(["wa1"], 10, 100 + i) for i in range(6)))
+            trackers[0].add("chat", ["wa1"], "Read")
+            await trackers[0].flush()
+        finally:
+            await first.close()
+            await second.close()
+
+    run(scenario())
+    assert sorted(chatwoot.updates) == [(10, 100 + i, "read") for i in range(6)]
@@ -0,0 +1,150 @@
+import asyncio
+
+from scheduler import PRIORITY_BOT, PRIORITY_HUMAN, OutboundScheduler
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_state_reports_queues():
+    async def scenario():
+        return OutboundScheduler().state()
+
+    assert run(scenario()) == {"pending": {PRIORITY_HUMAN: 0, PRIORITY_BOT: 0}, "sending": 0,
+                               "recipients_tracked": 0, "global_wait_seconds": 0.0}
+
+
+def test_messages_are_sent_separately_in_order():
+    async def scenario():
+        scheduler = OutboundScheduler(recipient_rate=100, recipient_burst=1)
+        scheduler.start()
+        sent = []
+
+        def send(text):
+            async def deliver():
+                sent.append(text)
+                return text
+            return deliver
+
+        try:
+            results = await asyncio.gather(*(scheduler.submit("5511", send(text)) for text in ("a", "b", "c")))
+        finally:
+            await scheduler.stop()
+        return results, sent, scheduler.state()["recipients_tracked"]
+
+    assert run(scenario()) == (["a", "b", "c"], ["a", "b", "c"], 1)
+
+
+def test_human_replies_go_first():
+    async def scenario():
+        scheduler = OutboundScheduler(rate=100, burst=1)
+        sent = []
+
+        async def submit(recipient, priority):
+            async def deliver():
+                sent.append(recipient)
+            await scheduler.submit(recipient, deliver, priority=priority)
+
+        tasks = [asyncio.create_task(submit("bot", PRIORITY_BOT)), asyncio.create_task(submit("human", PRIORITY_HUMAN))]
+        await asyncio.sleep(0)
+        scheduler.start()
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await scheduler.stop()
+        return sent
+
+    assert run(scenario()) == ["human", "bot"]
+
+
+def test_one_send_in_flight_per_recipient():
+    async def scenario():
+        scheduler = OutboundScheduler(recipient_rate=100, recipient_burst=10)
+        scheduler.start()
+        in_flight = {"a": 0, "b": 0}
+        peak = {"a": 0, "b": 0}
+        order = []
+
+        def send(recipient, text):
+            async def deliver():
+                in_flight[recipient] += 1
+                peak[recipient] = max(peak[recipient], in_flight[recipient])
+                await asyncio.sleep(0.01)
+                order.append(text)
+                in_flight[recipient] -= 1
+            return deliver
+
+        try:
+            await asyncio.gather(*(scheduler.submit(recipient, send(recipient, f"{recipient}{index}"))
+                                   for index in range(3) for recipient in ("a", "b")))
+        finally:
+            await scheduler.stop()
+        return peak, [text for text in order if text.startswith("a")], scheduler._in_flight
+
+    peak, order_a, in_flight = run(scenario())
+    # um envio por vez para cada destinatário, mas destinatários diferentes em paralelo
+    assert peak == {"a": 1, "b": 1}
+    assert order_a == ["a0", "a1", "a2"]
+    assert in_flight == set()
+
+
+def test_failed_send_releases_recipient():
+    async def scenario():
+        scheduler = OutboundScheduler(recipient_rate=100, recipient_burst=10)
+        scheduler.start()
+
+        async def fail():
+            raise RuntimeError("WuzAPI fora do ar")
+
+        async def ok():
+            return "ok"
+
+        try:
+            results = await asyncio.gather(scheduler.submit("a", fail), scheduler.submit("a", ok),
+                                           return_exceptions=True)
+        finally:
+            await scheduler.stop()
+        return [str(result) for result in results]
+
+    assert run(scenario()) == ["WuzAPI fora do ar", "ok"]
+
+
+def test_shared_limit_defers_only_the_throttled_recipient():
+    class SharedState:
+        shared = True
+
+        def __init__(self):
+            self.calls = []
+
+        async def acquire_tokens(self, buckets, cost=1):
+            recipient_key = buckets[1][0]
+            self.calls.append(recipient_key)
+            return 5.0 if recipient_key.endswith("slow") else 0.0
+
+    async def scenario():
+        state = SharedState()
+        scheduler = OutboundScheduler(state=state)
+        scheduler.start()
+        sent = []
+
+        def send(recipient):
+            async def deliver():
+                sent.append(recipient)
+            return deliver
+
+        slow = asyncio.create_task(scheduler.submit("slow", send("slow")))
+        await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(scheduler.submit("fast", send("fast")), 1)
+            pending = scheduler.pending()
+        finally:
+            slow.cancel()
+            await scheduler.stop()
+        return sent, pending, state.calls.count("outbound:slow")
+
+    sent, pending, slow_checks = run(scenario())
+    assert sent == ["fast"]
+    assert pending == 1
+    # o destinatário barrado não é consultado de novo antes do prazo
+    assert slow_checks == 1
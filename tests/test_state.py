@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from state import MemoryBackend, RedisBackend
+
+
+def run(backend_factory, scenario):
+    async def main():
+        backend = backend_factory()
+        try:
+            return await scenario(backend)
+        finally:
+            await backend.close()
+    return asyncio.run(main())
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend_factory(request, redis_url):
+    if request.param == "memory":
+        return MemoryBackend
+    return lambda: RedisBackend(redis_url, prefix="test:")
+
+
+def test_get_set_delete(backend_factory):
+    async def scenario(backend):
+        assert await backend.get("key") is None
+        await backend.set("key", {"contact_id": 1, "conversation_id": 2}, ttl=60)
+        value = await backend.get("key")
+        await backend.delete("key")
+        return value, await backend.get("key")
+
+    value, deleted = run(backend_factory, scenario)
+    assert value == {"contact_id": 1, "conversation_id": 2}
+    assert deleted is None
+
+
+def test_add_registers_only_once(backend_factory):
+    async def scenario(backend):
+        return [await backend.add("seen", ttl=60) for _ in range(3)]
+
+    assert run(backend_factory, scenario) == [True, False, False]
+
+
+def test_add_expires(backend_factory):
+    async def scenario(backend):
+        await backend.add("seen", ttl=0.05)
+        await asyncio.sleep(0.1)
+        return await backend.add("seen", ttl=60)
+
+    assert run(backend_factory, scenario) is True
+
+
+def test_set_fields_merges_concurrent_writes(backend_factory):
+    async def scenario(backend):
+        empty = await backend.get_fields("link")
+        await asyncio.gather(*(backend.set_fields("link", {f"m:{i}": "1"}, ttl=60) for i in range(5)))
+        await backend.set_fields("link", {"s:read": "1"}, ttl=60)
+        return empty, await backend.get_fields("link")
+
+    assert run(backend_factory, scenario) == ({}, {**{f"m:{i}": "1" for i in range(5)}, "s:read": "1"})
+
+
+def test_fields_expire(backend_factory):
+    async def scenario(backend):
+        await backend.set_fields("link", {"m:1": "1"}, ttl=0.05)
+        await asyncio.sleep(0.1)
+        return await backend.get_fields("link")
+
+    assert run(backend_factory, scenario) == {}
+
+
+def test_lock_is_exclusive(backend_factory):
+    async def scenario(backend):
+        inside = 0
+        peak = 0
+
+        async def critical():
+            nonlocal inside, peak
+            async with backend.lock("contact"):
+                inside += 1
+                peak = max(peak, inside)
+                await asyncio.sleep(0.01)
+                inside -= 1
+
+        await asyncio.gather(*(critical() for _ in range(5)))
+        return peak
+
+    assert run(backend_factory, scenario) == 1
+
+
+def test_acquire_tokens_all_or_nothing(backend_factory):
+    async def scenario(backend):
+        buckets = [("global", 1.0, 3.0), ("recipient", 1.0, 1.0)]
+        first = await backend.acquire_tokens(buckets)
+        # O bucket do destinatário está vazio: nenhuma ficha do global é consumida
+        second = await backend.acquire_tokens(buckets)
+        other = await backend.acquire_tokens([("global", 1.0, 3.0), ("other", 1.0, 1.0)])
+        third = await backend.acquire_tokens([("global", 1.0, 3.0), ("third", 1.0, 1.0)])
+        fourth = await backend.acquire_tokens([("global", 1.0, 3.0), ("fourth", 1.0, 1.0)])
+        return first, second, other, third, fourth
+
+    first, second, other, third, fourth = run(backend_factory, scenario)
+    assert first == 0
+    assert 0 < second <= 1
+    assert other == 0
+    assert third == 0
+    assert 0 < fourth <= 1
+
+
+def test_redis_lock_release_checks_owner(redis_url):
+    async def scenario(backend):
+        async with backend.lock("contact", ttl=0.05):
+            # O lock expira e é adquirido por outro processo antes de ser liberado aqui
+            await asyncio.sleep(0.1)
+            await backend._redis.set(f"{backend.prefix}lock:contact", "other", px=60000)
+        return await backend._redis.get(f"{backend.prefix}lock:contact")
+
+    assert run(lambda: RedisBackend(redis_url, prefix="test:owner:"), scenario) == "other"
+
+
+def test_redis_backends_share_state(redis_url):
+    async def scenario(backend):
+        other = RedisBackend(redis_url, prefix=backend.prefix)
+        try:
+            await backend.set("key", [1, 2], ttl=60)
+            return await other.get("key"), await backend.add("dedup", 60), await other.add("dedup", 60)
+        finally:
+            await other.close()
+
+    assert run(lambda: RedisBackend(redis_url, prefix="test:shared:"), scenario) == ([1, 2], True, False)
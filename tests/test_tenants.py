@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import tenants
+from tenants import TenantConfigError, TenantRegistry
+
+
+def tenant_config(tenant_id: str, instance: str, inbox: str, **extra) -> dict:
+    return {"id": tenant_id, "chatwoot_url": "http://chatwoot.test", "chatwoot_account_id": "1",
+            "chatwoot_inbox_id": inbox, "chatwoot_api_token": "chatwoot-token",
+            "wuzapi_api_url": "http://wuzapi.test", "wuzapi_api_token": f"token-{instance}",
+            "wuzapi_instance_name": instance, **extra}
+
+
+def write(path, *configs, mtime: float | None = None):
+    path.write_text(json.dumps({"tenants": list(configs)}))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def tenants_file(tmp_path):
+    path = tmp_path / "tenants.json"
+    write(path, tenant_config("centro", "centro", "3"), tenant_config("norte", "norte", "4"), mtime=1000)
+    return path
+
+
+def test_routes_by_instance_token_and_inbox(tenants_file):
+    registry = TenantRegistry(path=str(tenants_file))
+    registry.load()
+    assert registry.for_wuzapi("norte").id == "norte"
+    assert registry.for_wuzapi(None, "token-centro").id == "centro"
+    assert registry.for_chatwoot(1, 4).id == "norte"
+    assert registry.get("centro").instance_name == "centro"
+
+
+def test_unmatched_webhook_has_no_tenant_with_several(tenants_file):
+    registry = TenantRegistry(path=str(tenants_file))
+    registry.load()
+    assert registry.for_wuzapi("outra", "outro-token") is None
+    assert registry.for_chatwoot(1, 99) is None
+
+
+def test_unmatched_webhook_goes_to_single_tenant(tmp_path):
+    path = tmp_path / "tenants.json"
+    write(path, tenant_config("centro", "centro", "3"))
+    registry = TenantRegistry(path=str(path))
+    registry.load()
+    assert registry.for_wuzapi("outra").id == "centro"
+    assert registry.for_chatwoot(1, 99).id == "centro"
+
+
+def test_invalid_file_is_rejected(tmp_path):
+    path = tmp_path / "tenants.json"
+    write(path, tenant_config("centro", "centro", "3"), tenant_config("centro", "norte", "4"))
+    with pytest.raises(TenantConfigError):
+        TenantRegistry(path=str(path)).load()
+
+
+def test_reload_replaces_changed_tenants_and_drains_old_ones(tenants_file, monkeypatch):
+    monkeypatch.setattr(tenants, "TENANT_DRAIN_SECONDS", 0.05)
+    registry = TenantRegistry(path=str(tenants_file))
+    registry.load()
+    old_norte = registry.get("norte")
+    closed = []
+
+    async def aclose():
+        closed.append(old_norte.id)
+
+    monkeypatch.setattr(old_norte, "aclose", aclose)
+
+    async def scenario():
+        unchanged = registry.reload()
+        write(tenants_file, tenant_config("centro", "centro", "3"),
+              tenant_config("norte", "norte", "5"), mtime=2000)
+        changed = registry.reload()
+        # o tenant substituído sai do roteamento na hora, mas só é fechado após o prazo
+        routed = registry.for_chatwoot(1, 5), registry.for_chatwoot(1, 4)
+        before_drain = list(closed)
+        await asyncio.sleep(0.1)
+        new_norte = registry.get("norte")
+        await registry.stop()
+        return unchanged, changed, routed, before_drain, new_norte
+
+    unchanged, changed, (routed_new, routed_old), before_drain, new_norte = asyncio.run(scenario())
+    assert (unchanged, changed) == (False, True)
+    assert routed_new is new_norte and new_norte is not old_norte
+    assert routed_old is None
+    assert before_drain == [] and closed == ["norte"]
+
+
+def test_invalid_reload_keeps_current_tenants(tenants_file):
+    registry = TenantRegistry(path=str(tenants_file))
+    registry.load()
+    tenants_file.write_text("{")
+    os.utime(tenants_file, (2000, 2000))
+    assert registry.reload() is False
+    assert [tenant.id for tenant in registry] == ["centro", "norte"]
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+
+def text_message(message_id: str = "ABC") -> bytes:
+    return json.dumps({"type": "Message", "event": {
+        "Info": {"ID": message_id, "Sender": "5511999@s.whatsapp.net", "Chat": "5511999@s.whatsapp.net"},
+        "Message": {"conversation": "oi"}}}).encode()
+
+
+def queued(path: str = "data/queue.db") -> int:
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+def test_redelivery_is_dropped_as_duplicate(bridge):
+    with TestClient(bridge.app) as client:
+        first = client.post("/webhook/wuzapi", content=text_message())
+        second = client.post("/webhook/wuzapi", content=text_message())
+    assert first.json()["status"] == "queued"
+    assert second.json() == {"status": "ignored", "reason": "duplicate"}
+    assert queued() == 1
+
+
+def test_failed_enqueue_accepts_redelivery(bridge, monkeypatch):
+    put = bridge.job_queue.put
+    calls = []
+
+    async def failing_put(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        return await put(*args, **kwargs)
+
+    monkeypatch.setattr(bridge.job_queue, "put", failing_put)
+    with TestClient(bridge.app, raise_server_exceptions=False) as client:
+        failed = client.post("/webhook/wuzapi", content=text_message())
+        redelivered = client.post("/webhook/wuzapi", content=text_message())
+    assert failed.status_code == 500
+    assert redelivered.json()["status"] == "queued"
+    assert queued() == 1
+
+
+def test_failed_enqueue_of_chatwoot_reply_accepts_redelivery(bridge, monkeypatch):
+    body = json.dumps({"event": "message_created", "id": 7, "content": "resposta", "message_type": "outgoing",
+                       "private": False, "sender": {"type": "user"}, "account": {"id": 1}, "inbox": {"id": 1},
+                       "conversation": {"id": 3, "inbox_id": 1}}).encode()
+    put = bridge.job_queue.put
+    calls = []
+
+    async def failing_put(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("disk I/O error")
+        return await put(*args, **kwargs)
+
+    monkeypatch.setattr(bridge.job_queue, "put", failing_put)
+    with TestClient(bridge.app, raise_server_exceptions=False) as client:
+        failed = client.post("/webhook/chatwoot", content=body)
+        redelivered = client.post("/webhook/chatwoot", content=body)
+    assert failed.status_code == 500
+    assert redelivered.json()["status"] == "queued"
+
+
+def image_message(chat: str = "5511999@s.whatsapp.net") -> dict:
+    return {"type": "Message", "base64": "aGVsbG8=", "event": {
+        "Info": {"ID": "IMG", "Sender": "5511999@s.whatsapp.net", "Chat": chat},
+        "Message": {"imageMessage": {"mimetype": "image/jpeg"}}}}
+
+
+def spooled(bridge, message: dict) -> tuple[str, str]:
+    payload = asyncio.run(bridge.spool_inline_media(bridge.WuzAPIEvent(message), json.dumps(message).encode()))
+    return payload, json.loads(payload)["base64_file"]
+
+
+def test_dead_lettered_media_file_is_removed(bridge):
+    payload, path = spooled(bridge, image_message())
+    assert os.path.exists(path)
+    asyncio.run(bridge.discard_wuzapi_media(payload, "default", "Chatwoot fora do ar"))
+    assert not os.path.exists(path)
+
+
+def test_ignored_media_file_is_removed(bridge):
+    payload, path = spooled(bridge, image_message(chat="status@broadcast"))
+    with TestClient(bridge.app):
+        result = asyncio.run(bridge.process_wuzapi_event(payload, "default"))
+    assert result == {"status": "ignored", "reason": "status broadcast"}
+    assert not os.path.exists(path)
+
+
+def test_unmatched_webhook_is_rejected_with_several_tenants(bridge, tmp_path):
+    configs = [{"id": tenant_id, "chatwoot_url": "http://chatwoot.test", "chatwoot_account_id": "1",
+                "chatwoot_inbox_id": inbox, "chatwoot_api_token": "chatwoot-token",
+                "wuzapi_api_url": "http://wuzapi.test", "wuzapi_api_token": f"token-{tenant_id}",
+                "wuzapi_instance_name": tenant_id} for tenant_id, inbox in (("centro", "3"), ("norte", "4"))]
+    (tmp_path / "tenants.json").write_text(json.dumps({"tenants": configs}))
+    bridge.tenants.path = str(tmp_path / "tenants.json")
+    rejected = bridge.metrics.EVENTS_IGNORED.labels("wuzapi", "unknown tenant")
+    before = rejected._value.get()
+    with TestClient(bridge.app) as client:
+        unmatched = client.post("/webhook/wuzapi", content=text_message())
+        matched = client.post("/webhook/wuzapi", content=text_message(), headers={"token": "token-norte"})
+    assert unmatched.status_code == 404
+    assert rejected._value.get() == before + 1
+    assert matched.json()["status"] == "queued"